@@ -0,0 +1,92 @@
+# Copyright (c) The Diem Core Contributors
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+Compares broker message size and encode/decode throughput of LRWPubSubEvent
+messages between dramatiq's PickleEncoder and LRWEventEncoder.
+
+    python -m bench.event_encoding --batch 100
+"""
+
+import argparse
+import time
+
+from diem import txnmetadata
+from dramatiq import PickleEncoder
+
+from merchant_vasp.background_tasks import process_incoming_txn, process_incoming_txns
+from merchant_vasp.encoder import LRWEventEncoder
+from pubsub.types import LRWPubSubEvent
+
+
+def make_event(sequence: int) -> LRWPubSubEvent:
+    # fresh strings per event, as they come off the JSON-RPC response
+    return LRWPubSubEvent(
+        sender=f"{sequence:032x}",
+        receiver="".join(["c"] * 32),
+        amount=1_000_000 + sequence,
+        currency="XUS",
+        metadata=txnmetadata.general_metadata(
+            from_subaddress=bytes.fromhex("ff" * 8),
+            to_subaddress=sequence.to_bytes(8, "big"),
+        ),
+        version=10_000 + sequence,
+        sequence=sequence,
+    )
+
+
+def measure(encoder, data, iterations):
+    encoded = encoder.encode(data)
+
+    start = time.perf_counter()
+    for _ in range(iterations):
+        encoder.encode(data)
+    encode_rate = iterations / (time.perf_counter() - start)
+
+    start = time.perf_counter()
+    for _ in range(iterations):
+        encoder.decode(encoded)
+    decode_rate = iterations / (time.perf_counter() - start)
+
+    return len(encoded), encode_rate, decode_rate
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--batch", type=int, default=100)
+    parser.add_argument("--iterations", type=int, default=2000)
+    args = parser.parse_args()
+
+    print(
+        f"{'message':16} {'encoder':24} {'bytes':>8} {'encode/s':>10} {'decode/s':>10}"
+    )
+    for events in (1, args.batch):
+        lazy = [make_event(i) for i in range(events)]
+        # what pubsub used to send: metadata already deserialized by the poller
+        decoded = [make_event(i) for i in range(events)]
+        for event in decoded:
+            event.metadata
+
+        cases = {
+            "pickle (decoded metadata)": (PickleEncoder(), decoded),
+            "pickle (raw metadata)": (PickleEncoder(), lazy),
+            "lrw": (LRWEventEncoder(), lazy),
+        }
+        iterations = max(args.iterations // events, 10)
+        for encoder_name, (encoder, batch) in cases.items():
+            message = (
+                process_incoming_txn.message(batch[0])
+                if events == 1
+                else process_incoming_txns.message(batch)
+            )
+            size, encode_rate, decode_rate = measure(
+                encoder, message.asdict(), iterations
+            )
+            print(
+                f"{events:6} event(s)  {encoder_name:24} {size:8} "
+                f"{encode_rate:10.0f} {decode_rate:10.0f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
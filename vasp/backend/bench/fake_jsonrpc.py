@@ -0,0 +1,199 @@
+# Copyright (c) The Diem Core Contributors
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+Local stand-in for a Diem JSON-RPC node, serving `get_account` and
+`get_events` from a synthetic stream of received payments.
+
+    python -m bench.fake_jsonrpc --port 8080 --address <vasp addr> --events 1000
+"""
+
+import argparse
+import json
+import secrets
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Tuple
+
+from diem import txnmetadata
+
+CHAIN_ID = 2
+SENDER_ADDRESS = "b" * 32
+
+
+class SyntheticEventStream:
+    """
+    Received payment events for `address`, one per (subaddress, amount,
+    currency) payment. Event i is published `i / rate` seconds after
+    `start()`, or immediately when rate is 0.
+    """
+
+    def __init__(
+        self,
+        address: str,
+        payments: List[Tuple[str, int, str]],
+        rate: float = 0,
+    ) -> None:
+        self.address = address
+        self.received_events_key = "0300000000000000" + address
+        self.sent_events_key = "0200000000000000" + address
+        self.payments = payments
+        self.rate = rate
+        self.started_at = time.time()
+
+    def start(self) -> None:
+        self.started_at = time.time()
+
+    def published_at(self, sequence_number: int) -> float:
+        """Wall clock time at which the event became visible"""
+        if not self.rate:
+            return self.started_at
+        return self.started_at + sequence_number / self.rate
+
+    def published_count(self) -> int:
+        if not self.rate:
+            return len(self.payments)
+        elapsed = time.time() - self.started_at
+        return min(int(elapsed * self.rate) + 1, len(self.payments))
+
+    def event(self, sequence_number: int) -> Dict[str, Any]:
+        subaddress, amount, currency = self.payments[sequence_number]
+        metadata = txnmetadata.general_metadata(
+            from_subaddress=secrets.token_bytes(8),
+            to_subaddress=bytes.fromhex(subaddress),
+        )
+        return {
+            "key": self.received_events_key,
+            "sequence_number": sequence_number,
+            "transaction_version": self.version(sequence_number),
+            "data": {
+                "type": "receivedpayment",
+                "amount": {"amount": amount, "currency": currency},
+                "sender": SENDER_ADDRESS,
+                "receiver": self.address,
+                "metadata": metadata.hex(),
+            },
+        }
+
+    @staticmethod
+    def version(sequence_number: int) -> int:
+        return 1000 + sequence_number * 3
+
+
+class FakeJsonRpcServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(
+        self,
+        port: int,
+        stream: SyntheticEventStream,
+        latency_ms: float = 0,
+        max_page_size: int = 1000,
+    ) -> None:
+        super().__init__(("127.0.0.1", port), _Handler)
+        self.stream = stream
+        self.latency_ms = latency_ms
+        self.max_page_size = max_page_size
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}/v1"
+
+    def start(self) -> None:
+        self.stream.start()
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self.shutdown()
+        self.server_close()
+
+    def handle_rpc(self, method: str, params: List[Any]) -> Any:
+        if method == "get_account":
+            return self._account(params[0])
+        if method == "get_events":
+            return self._events(*params)
+        raise ValueError(f"method not found: {method}")
+
+    def ledger_version(self) -> int:
+        return self.stream.version(self.stream.published_count())
+
+    def _account(self, address: str) -> Optional[Dict[str, Any]]:
+        if address.lower() != self.stream.address:
+            return None
+        return {
+            "address": self.stream.address,
+            "balances": [],
+            "sequence_number": 0,
+            "authentication_key": "",
+            "sent_events_key": self.stream.sent_events_key,
+            "received_events_key": self.stream.received_events_key,
+            "role": {"type": "parent_vasp"},
+        }
+
+    def _events(self, key: str, start: int, limit: int) -> List[Dict[str, Any]]:
+        if key != self.stream.received_events_key:
+            return []
+        end = min(start + min(limit, self.max_page_size), self.stream.published_count())
+        return [self.stream.event(seq) for seq in range(start, end)]
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server: FakeJsonRpcServer
+
+    def do_POST(self) -> None:
+        request = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        if self.server.latency_ms:
+            time.sleep(self.server.latency_ms / 1000)
+
+        response: Dict[str, Any] = {
+            "jsonrpc": "2.0",
+            "id": request.get("id"),
+            "diem_chain_id": CHAIN_ID,
+            "diem_ledger_version": self.server.ledger_version(),
+            "diem_ledger_timestampusec": int(time.time() * 1_000_000),
+        }
+        try:
+            response["result"] = self.server.handle_rpc(
+                request["method"], request.get("params", [])
+            )
+        except Exception as e:
+            response["error"] = {"code": -32601, "message": str(e), "data": None}
+
+        body = json.dumps(response).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args: Any) -> None:
+        pass
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--address", type=str, required=True)
+    parser.add_argument("--events", type=int, default=1000)
+    parser.add_argument("--rate", type=float, default=0, help="events/s, 0 for all")
+    parser.add_argument("--latency-ms", type=float, default=0)
+    parser.add_argument("--max-page-size", type=int, default=1000)
+    args = parser.parse_args()
+
+    payments = [(secrets.token_hex(8), 1_000_000, "XUS") for _ in range(args.events)]
+    server = FakeJsonRpcServer(
+        args.port,
+        SyntheticEventStream(args.address.lower(), payments, args.rate),
+        latency_ms=args.latency_ms,
+        max_page_size=args.max_page_size,
+    )
+    print(f"Serving {args.events} events for {args.address} on {server.url}")
+    server.stream.start()
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+# Copyright (c) The Diem Core Contributors
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+Checkpoint write-throughput benchmark for the pubsub progress storages.
+
+    python -m bench.progress_storage --keys 16 --checkpoints 5000
+"""
+
+import argparse
+import tempfile
+import time
+
+from pubsub.progress import FileProgressStorage, LogProgressStorage
+
+
+def run(storage: FileProgressStorage, keys: int, checkpoints: int) -> float:
+    storage.fetch_state()
+    storage.save_state({f"key-{i}": 0 for i in range(keys)})
+
+    start = time.perf_counter()
+    for i in range(checkpoints):
+        storage.save_key_state(f"key-{i % keys}", i)
+    storage.flush()
+    return checkpoints / (time.perf_counter() - start)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--keys", type=int, default=16)
+    parser.add_argument("--checkpoints", type=int, default=2000)
+    parser.add_argument("--fsync-interval-ms", type=int, default=1000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        storages = {
+            "file (atomic rewrite)": FileProgressStorage(f"{workdir}/file"),
+            "log (fsync per checkpoint)": LogProgressStorage(f"{workdir}/log"),
+            f"log (fsync every {args.fsync_interval_ms}ms)": LogProgressStorage(
+                f"{workdir}/coalesced", fsync_interval_ms=args.fsync_interval_ms
+            ),
+        }
+        for name, storage in storages.items():
+            rate = run(storage, args.keys, args.checkpoints)
+            print(f"{name:40} {rate:12.0f} checkpoints/s")
+
+
+if __name__ == "__main__":
+    main()
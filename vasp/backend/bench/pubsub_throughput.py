@@ -0,0 +1,183 @@
+# Copyright (c) The Diem Core Contributors
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+End-to-end clearing benchmark: LRWPubSubClient polls a local fake JSON-RPC
+node (bench.fake_jsonrpc) whose event stream pays freshly seeded payments,
+dramatiq workers run process_incoming_txn(s) against DB_URL, and the time
+from an event being published to its payment being cleared is measured.
+
+    DB_URL=postgresql://... python -m bench.pubsub_throughput --payments 2000
+
+Uses the configured Redis broker, or an in-process StubBroker with
+--stub-broker. Seeded payments belong to a new "bench-*" merchant and are
+left in the database.
+"""
+
+import argparse
+import json
+import os
+import secrets
+import tempfile
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+
+# The payment service checks the receiver against the custody wallet, make
+# sure one exists before merchant_vasp initializes custody
+os.environ.setdefault("WALLET_CUSTODY_ACCOUNT_NAME", "merchant-wallet")
+os.environ.setdefault(
+    "CUSTODY_PRIVATE_KEYS", json.dumps({"merchant-wallet": secrets.token_hex(32)})
+)
+
+import dramatiq
+from dramatiq.brokers.stub import StubBroker
+
+from merchant_vasp.background_tasks import process_incoming_txn, process_incoming_txns
+from merchant_vasp.onchainwallet import OnchainWallet
+from merchant_vasp.storage import (
+    Base,
+    Merchant,
+    Payment,
+    PaymentOption,
+    PaymentStatus,
+    db_session,
+    engine,
+)
+from merchant_vasp.storage.models import PaymentStatusLog
+from pubsub import DEFL_CONFIG
+from pubsub.client import LRWPubSubClient
+from .fake_jsonrpc import FakeJsonRpcServer, SyntheticEventStream
+
+PAYMENT_AMOUNT = 1_000_000
+PAYMENT_CURRENCY = "XUS"
+
+
+def seed_payments(count: int):
+    Base.metadata.create_all(bind=engine)
+    merchant = Merchant(name=f"bench-{uuid.uuid4().hex[:8]}")
+    merchant.generate_api_key()
+    db_session.add(merchant)
+    db_session.commit()
+
+    payments = []
+    for i in range(count):
+        payment = Payment(
+            merchant_id=merchant.id,
+            merchant_reference_id=f"bench-{i}",
+            requested_amount=1,
+            requested_currency="USD",
+            subaddress=secrets.token_hex(8),
+            expiry_date=datetime.utcnow() + timedelta(hours=1),
+        )
+        payment.payment_options.append(
+            PaymentOption(amount=PAYMENT_AMOUNT, currency=PAYMENT_CURRENCY)
+        )
+        payments.append(payment)
+    db_session.add_all(payments)
+    db_session.commit()
+
+    seeded = [(p.id, p.subaddress) for p in payments]
+    db_session.remove()
+    return seeded
+
+
+def cleared_at(payment_ids):
+    logs = PaymentStatusLog.query.filter(
+        PaymentStatusLog.payment_id.in_(payment_ids),
+        PaymentStatusLog.status == PaymentStatus.cleared,
+    ).all()
+    result = {
+        log.payment_id: log.created_at.replace(tzinfo=timezone.utc).timestamp()
+        for log in logs
+    }
+    db_session.remove()
+    return result
+
+
+def start_worker(stub_broker: bool, threads: int) -> dramatiq.Worker:
+    broker = dramatiq.get_broker()
+    if stub_broker:
+        broker = StubBroker(middleware=[])
+        for actor in (process_incoming_txn, process_incoming_txns):
+            actor.broker = broker
+            broker.declare_actor(actor)
+    worker = dramatiq.Worker(broker, worker_threads=threads, worker_timeout=100)
+    worker.start()
+    return worker
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--payments", type=int, default=500)
+    parser.add_argument("--rate", type=float, default=0, help="events/s, 0 for burst")
+    parser.add_argument("--latency-ms", type=float, default=5)
+    parser.add_argument("--max-page-size", type=int, default=1000)
+    parser.add_argument("--sync-interval-ms", type=int, default=100)
+    parser.add_argument("--worker-threads", type=int, default=4)
+    parser.add_argument("--stub-broker", action="store_true")
+    parser.add_argument("--timeout", type=float, default=300)
+    args = parser.parse_args()
+
+    seeded = seed_payments(args.payments)
+    address = OnchainWallet.shared().address_str
+    stream = SyntheticEventStream(
+        address,
+        [(subaddress, PAYMENT_AMOUNT, PAYMENT_CURRENCY) for _, subaddress in seeded],
+        rate=args.rate,
+    )
+    server = FakeJsonRpcServer(
+        0, stream, latency_ms=args.latency_ms, max_page_size=args.max_page_size
+    )
+    worker = start_worker(args.stub_broker, args.worker_threads)
+
+    with tempfile.TemporaryDirectory() as workdir:
+        client = LRWPubSubClient(
+            {
+                **DEFL_CONFIG,
+                "diem_node_uri": server.url,
+                "accounts": [address],
+                "sync_interval_ms": args.sync_interval_ms,
+                "progress_storage_type": "file",
+                "progress_file_path": f"{workdir}/progress",
+                "broker": worker.broker,
+            }
+        )
+        server.start()
+        threading.Thread(target=client.start, daemon=True).start()
+
+        payment_ids = [payment_id for payment_id, _ in seeded]
+        deadline = time.time() + args.timeout
+        cleared = {}
+        while len(cleared) < len(payment_ids) and time.time() < deadline:
+            time.sleep(0.2)
+            cleared = cleared_at(payment_ids)
+
+    worker.stop()
+    server.stop()
+
+    latencies = [
+        cleared[payment_id] - stream.published_at(seq)
+        for seq, payment_id in enumerate(payment_ids)
+        if payment_id in cleared
+    ]
+    if not latencies:
+        print("No payment was cleared")
+        return
+    elapsed = max(cleared.values()) - stream.started_at
+    print(f"cleared       {len(latencies)}/{len(payment_ids)} payments")
+    print(f"throughput    {len(latencies) / elapsed:.1f} events/s")
+    print(f"latency p50   {percentile(latencies, 0.5) * 1000:.0f} ms")
+    print(f"latency p99   {percentile(latencies, 0.99) * 1000:.0f} ms")
+
+
+if __name__ == "__main__":
+    main()
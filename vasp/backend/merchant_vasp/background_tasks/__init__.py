@@ -1,4 +1,11 @@
-from .background import *
-
 # Copyright (c) The Diem Core Contributors
 # SPDX-License-Identifier: Apache-2.0
+
+import dramatiq
+
+from .background import *
+from .periodic import PeriodicScheduler
+from .reaper import expire_payments
+from .refunds import refund_errant_payments
+
+dramatiq.get_broker().add_middleware(PeriodicScheduler())
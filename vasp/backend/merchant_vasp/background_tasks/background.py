@@ -1,47 +1,134 @@
+import logging
+from typing import Any, Dict, List
+
 import dramatiq
-from diem import diem_types
 from diem_utils.types.currencies import DiemCurrency
 
 from pubsub.types import LRWPubSubEvent
-from ..payment_service import process_incoming_transaction, PaymentServiceException
-from ..storage import db_session
+from ..payment_service import (
+    process_incoming_transaction,
+    process_incoming_transactions,
+    PaymentServiceException,
+    ERRANT_PAYMENT_EXCEPTIONS,
+)
+from ..storage import db_session, ErrantPayment, ProcessedEvent
+
+logger = logging.getLogger(__name__)
 
 
 @dramatiq.actor(store_results=True)
-def process_incoming_txn(txn: LRWPubSubEvent) -> None:
-    metadata = txn.metadata
+def process_incoming_txn(txn: LRWPubSubEvent, reprocess: bool = False) -> None:
+    try:
+        _process_incoming_txn(txn, reprocess)
+    finally:
+        db_session.remove()
 
-    sender_sub_address = None
-    receiver_sub_address = None
 
-    if (
-        metadata
-        and isinstance(metadata, diem_types.Metadata__GeneralMetadata)
-        and isinstance(
-            metadata.value, diem_types.GeneralMetadata__GeneralMetadataVersion0
-        )
-    ):
-        general_metadata = metadata.value.value
+@dramatiq.actor(store_results=True)
+def process_incoming_txns(txns: List[LRWPubSubEvent], reprocess: bool = False) -> None:
+    """Handle a whole page of events fetched by pubsub in a single message"""
+    try:
+        _process_incoming_txns(txns, reprocess)
+    finally:
+        db_session.remove()
 
-        if general_metadata.to_subaddress:
-            receiver_sub_address = general_metadata.to_subaddress.hex()
 
-        if general_metadata.from_subaddress:
-            sender_sub_address = general_metadata.from_subaddress.hex()
+def _process_incoming_txns(txns: List[LRWPubSubEvent], reprocess: bool) -> None:
+    """
+    Clear the whole batch in one transaction. If it cannot be committed, the
+    events are retried one by one, so a single bad event can't fail the rest.
+    """
+    processed = ProcessedEvent.find_processed((t.version, t.sequence) for t in txns)
+    if not reprocess:
+        txns = [txn for txn in txns if (txn.version, txn.sequence) not in processed]
+    if not txns:
+        return
+
+    batch = []
+    for txn in txns:
+        try:
+            batch.append((txn, _transaction_args(txn)))
+        except Exception:
+            logger.exception(f"Dropping event {txn.version} that can't be processed")
+    if not batch:
+        return
+    txns = [txn for txn, _ in batch]
 
     try:
-        process_incoming_transaction(
-            version=txn.version,
+        results = process_incoming_transactions([args for _, args in batch])
+        for txn, result in zip(txns, results):
+            if (txn.version, txn.sequence) in processed:
+                continue
+            _record_errant_payment(txn, result)
+            db_session.add(ProcessedEvent(version=txn.version, sequence=txn.sequence))
+        db_session.commit()
+    except Exception as e:
+        logger.warning(f"Batch of {len(txns)} events failed, retrying one by one: {e}")
+        db_session.rollback()
+        for txn in txns:
+            try:
+                _process_incoming_txn(txn, reprocess)
+            except Exception:
+                logger.exception(f"Failed to process event {txn.version}")
+                db_session.rollback()
+        return
+
+    rejected = sum(1 for result in results if result is not None)
+    logger.debug(f"Processed {len(txns)} events, {rejected} rejected")
+
+
+def _process_incoming_txn(txn: LRWPubSubEvent, reprocess: bool = False) -> None:
+    """
+    pubsub delivers at-least-once, so events we already went through are
+    dropped. Replays pass `reprocess` to run them again: clearing is
+    idempotent, but only events never processed before are recorded for
+    refund, so a replay can't refund twice.
+    """
+    processed = ProcessedEvent.is_processed(txn.version, txn.sequence)
+    if processed and not reprocess:
+        logger.debug(f"Skipping already processed event {txn.version}")
+        return
+
+    try:
+        process_incoming_transaction(**_transaction_args(txn))
+    except PaymentServiceException as e:
+        db_session.rollback()
+        if processed:
+            return
+        _record_errant_payment(txn, e)
+
+    if not processed:
+        ProcessedEvent.mark(txn.version, txn.sequence)
+
+
+def _record_errant_payment(txn: LRWPubSubEvent, rejection) -> None:
+    """Keep funds we won't clear for refund, committed with the processed mark"""
+    if not isinstance(rejection, ERRANT_PAYMENT_EXCEPTIONS):
+        return
+    if txn.receiver_sub_address is None:
+        # untagged deposits, like top ups of the wallet, are not payments
+        logger.info(f"Not refunding untagged deposit {txn.version}: {rejection}")
+        return
+    logger.info(f"Recording errant payment {txn.version}: {rejection}")
+    db_session.add(
+        ErrantPayment(
+            tx_id=txn.version,
             sender_address=txn.sender,
-            sender_sub_address=sender_sub_address,
-            receiver_address=txn.receiver,
-            receiver_sub_address=receiver_sub_address,
+            sender_sub_address=txn.sender_sub_address,
             amount=txn.amount,
-            currency=DiemCurrency[txn.currency],
+            currency=txn.currency,
+            reason=str(rejection),
         )
-    except PaymentServiceException as _:
-        # TODO - log exception
-        db_session.rollback()
+    )
 
-    finally:
-        db_session.remove()
+
+def _transaction_args(txn: LRWPubSubEvent) -> Dict[str, Any]:
+    return dict(
+        version=txn.version,
+        sender_address=txn.sender,
+        sender_sub_address=txn.sender_sub_address,
+        receiver_address=txn.receiver,
+        receiver_sub_address=txn.receiver_sub_address,
+        amount=txn.amount,
+        currency=DiemCurrency[txn.currency],
+    )
@@ -0,0 +1,91 @@
+import logging
+import threading
+import uuid
+from typing import Callable, List, Optional, Tuple
+
+import dramatiq
+from dramatiq import Actor, Middleware
+
+logger = logging.getLogger(__name__)
+
+# functions starting the schedule of each periodic job, with their interval
+_schedules: List[Tuple[Callable[[], None], int]] = []
+
+# Continue a chain while it owns the lock, or take the lock back when it
+# lapsed and no other chain took over meanwhile
+_CONTINUE_CHAIN = """
+local owner = redis.call("GET", KEYS[1])
+if owner and owner ~= ARGV[1] then
+    return 0
+end
+redis.call("SET", KEYS[1], ARGV[1], "PX", ARGV[2])
+return 1
+"""
+
+
+def schedule_periodic(
+    actor: Actor, interval_seconds: int, chain: Optional[str] = None
+) -> None:
+    """
+    Enqueue the next run of a periodic actor. A single chain of runs is kept
+    alive per actor: its runs carry the chain id, which holds a lock in
+    Redis. A run enqueues the next one only while its chain holds the lock,
+    and a new chain (`chain` None) is only started once the lock has lapsed.
+
+    Workers try to start a chain on boot and then every interval, see
+    PeriodicScheduler, so a lost run stops the job for two intervals at most.
+    """
+    broker = dramatiq.get_broker()
+    interval_ms = interval_seconds * 1000
+    lock_key = f"lrm:periodic:{actor.actor_name}"
+    client = getattr(broker, "client", None)
+    if client is not None:
+        if chain is None:
+            chain = uuid.uuid4().hex
+            if not client.set(lock_key, chain, nx=True, px=2 * interval_ms):
+                return
+        elif not client.eval(_CONTINUE_CHAIN, 1, lock_key, chain, 2 * interval_ms):
+            logger.info(f"Stopping a superseded schedule of {actor.actor_name}")
+            return
+    actor.send_with_options(args=(chain,), delay=interval_ms)
+
+
+def register_schedule(schedule: Callable[[], None], interval_seconds: int) -> None:
+    _schedules.append((schedule, interval_seconds))
+
+
+class PeriodicScheduler(Middleware):
+    """
+    Starts the schedules of the periodic jobs when a worker boots, and keeps
+    trying every interval in case a chain of runs broke. Dramatiq has no
+    Retries middleware configured here, so a run whose message is lost would
+    otherwise stop its job until a worker restarts.
+    """
+
+    def __init__(self) -> None:
+        self._stopped = threading.Event()
+
+    def after_worker_boot(self, broker, worker):
+        self._stopped.clear()
+        for schedule, interval_seconds in _schedules:
+            schedule()
+            # without Redis there is no lock telling a broken chain apart
+            if getattr(broker, "client", None) is not None:
+                threading.Thread(
+                    target=self._keep_scheduled,
+                    args=(schedule, interval_seconds),
+                    name="periodic-watchdog",
+                    daemon=True,
+                ).start()
+
+    def before_worker_shutdown(self, broker, worker):
+        self._stopped.set()
+
+    def _keep_scheduled(
+        self, schedule: Callable[[], None], interval_seconds: int
+    ) -> None:
+        while not self._stopped.wait(interval_seconds):
+            try:
+                schedule()
+            except Exception:
+                logger.exception("Failed to check a periodic schedule")
@@ -0,0 +1,40 @@
+import logging
+from datetime import datetime
+from typing import Optional
+
+import dramatiq
+
+from .periodic import register_schedule, schedule_periodic
+from ..config import PAYMENT_REAPER_CHUNK_SIZE, PAYMENT_REAPER_INTERVAL_SECONDS
+from ..storage import db_session, Payment
+
+logger = logging.getLogger(__name__)
+
+
+@dramatiq.actor
+def expire_payments(chain: Optional[str] = None) -> None:
+    """
+    Reject created payments past their expiry date, chunk by chunk, then
+    schedule the next run of the chain, see schedule_periodic. Several
+    workers may run it at once.
+    """
+    try:
+        now = datetime.utcnow()
+        total = 0
+        while True:
+            rejected = Payment.reject_expired(now, PAYMENT_REAPER_CHUNK_SIZE)
+            total += rejected
+            if rejected < PAYMENT_REAPER_CHUNK_SIZE:
+                break
+        if total:
+            logger.info(f"Rejected {total} expired payments")
+    finally:
+        db_session.remove()
+        schedule_expire_payments(chain)
+
+
+def schedule_expire_payments(chain: Optional[str] = None) -> None:
+    schedule_periodic(expire_payments, PAYMENT_REAPER_INTERVAL_SECONDS, chain)
+
+
+register_schedule(schedule_expire_payments, PAYMENT_REAPER_INTERVAL_SECONDS)
@@ -0,0 +1,47 @@
+import logging
+from typing import Optional
+
+import dramatiq
+
+from .periodic import register_schedule, schedule_periodic
+from ..config import (
+    ERRANT_REFUND_BATCH_SIZE,
+    ERRANT_REFUND_ENABLED,
+    ERRANT_REFUND_INTERVAL_SECONDS,
+)
+from ..storage import db_session
+
+logger = logging.getLogger(__name__)
+
+
+@dramatiq.actor
+def refund_errant_payments(chain: Optional[str] = None) -> None:
+    """
+    Refund pending errant payments batch by batch, then schedule the next run
+    of the chain, see schedule_periodic
+    """
+    # imported here, transaction_manager pulls in the whole payment flow
+    from .. import transaction_manager
+
+    try:
+        total = 0
+        while True:
+            refunded = transaction_manager.refund_errant_payments(
+                ERRANT_REFUND_BATCH_SIZE
+            )
+            total += refunded
+            if refunded < ERRANT_REFUND_BATCH_SIZE:
+                break
+        if total:
+            logger.info(f"Refunded {total} errant payments")
+    finally:
+        db_session.remove()
+        schedule_refund_errant_payments(chain)
+
+
+def schedule_refund_errant_payments(chain: Optional[str] = None) -> None:
+    schedule_periodic(refund_errant_payments, ERRANT_REFUND_INTERVAL_SECONDS, chain)
+
+
+if ERRANT_REFUND_ENABLED:
+    register_schedule(schedule_refund_errant_payments, ERRANT_REFUND_INTERVAL_SECONDS)
@@ -3,19 +3,69 @@ import os
 import dramatiq
 import redis
 from dramatiq.brokers.redis import RedisBroker, Broker
-from dramatiq.encoder import PickleEncoder
 from dramatiq.results import Results
 from dramatiq.results.backends.redis import RedisBackend
 from diem import identifier
 
 DB_URL: str = os.getenv("DB_URL", "sqlite:////tmp/merchant_test.db")
+# sized per process by the worker profile, see worker_profile.py
+DB_POOL_SIZE: int = int(os.getenv("DB_POOL_SIZE", 5))
+DB_MAX_OVERFLOW: int = int(os.getenv("DB_MAX_OVERFLOW", 10))
+WORKER_GEVENT: bool = os.getenv("WORKER_GEVENT", "0") == "1"
 
 PAYMENT_EXPIRE_MINUTES = 10
 
+# Expired payments still created are rejected in bulk by the reaper job
+PAYMENT_REAPER_INTERVAL_SECONDS: int = int(
+    os.getenv("PAYMENT_REAPER_INTERVAL_SECONDS", 60)
+)
+PAYMENT_REAPER_CHUNK_SIZE: int = int(os.getenv("PAYMENT_REAPER_CHUNK_SIZE", 500))
+
+# Errant payments are refunded in batches by a periodic job
+ERRANT_REFUND_ENABLED: bool = os.getenv("ERRANT_REFUND_ENABLED", "1") == "1"
+ERRANT_REFUND_INTERVAL_SECONDS: int = int(
+    os.getenv("ERRANT_REFUND_INTERVAL_SECONDS", 300)
+)
+ERRANT_REFUND_BATCH_SIZE: int = int(os.getenv("ERRANT_REFUND_BATCH_SIZE", 100))
+
+# How far, in basis points of the option amount, an incoming payment may fall
+# short of or exceed a payment option and still clear it. 0 means exact match.
+PAYMENT_UNDERPAY_TOLERANCE_BPS: int = int(
+    os.getenv("PAYMENT_UNDERPAY_TOLERANCE_BPS", 0)
+)
+PAYMENT_OVERPAY_TOLERANCE_BPS: int = int(os.getenv("PAYMENT_OVERPAY_TOLERANCE_BPS", 0))
+
+# Page sizes of the merchant payment listing
+PAYMENTS_PAGE_SIZE: int = int(os.getenv("PAYMENTS_PAGE_SIZE", 100))
+PAYMENTS_MAX_PAGE_SIZE: int = int(os.getenv("PAYMENTS_MAX_PAGE_SIZE", 1000))
+# Payments fetched per round trip by the streaming export
+PAYMENTS_EXPORT_CHUNK_SIZE: int = int(os.getenv("PAYMENTS_EXPORT_CHUNK_SIZE", 1000))
+# Incremental exports stop this far behind now, it must exceed the longest
+# payment transaction (batches included) plus the clock skew between hosts
+PAYMENTS_EXPORT_SAFETY_LAG_SECONDS: int = int(
+    os.getenv("PAYMENTS_EXPORT_SAFETY_LAG_SECONDS", 300)
+)
+
+# Internal port of the web app's Prometheus metrics, kept off the public API.
+# 0 disables the endpoint.
+WEBAPP_METRICS_PORT: int = int(os.getenv("WEBAPP_METRICS_PORT", 9192))
+
 REDIS_HOST: str = os.getenv("REDIS_HOST", "localhost")
 REDIS_PORT: int = int(os.getenv("REDIS_PORT", 6379))
 REDIS_PASSWORD: str = os.getenv("REDIS_PASSWORD", "")
 
+# Keep open payments in Redis for clearing, see storage/cache.py
+PAYMENT_CACHE_ENABLED: bool = os.getenv("PAYMENT_CACHE_ENABLED", "1") == "1"
+# Cache calls slower than this fail and fall back to the database
+PAYMENT_CACHE_TIMEOUT_MS: int = int(os.getenv("PAYMENT_CACHE_TIMEOUT_MS", 200))
+
+# Authenticated merchants are kept in process for the TTL, see storage/cache.py
+MERCHANT_AUTH_CACHE_ENABLED: bool = os.getenv("MERCHANT_AUTH_CACHE_ENABLED", "1") == "1"
+MERCHANT_AUTH_CACHE_TTL_SECONDS: int = int(
+    os.getenv("MERCHANT_AUTH_CACHE_TTL_SECONDS", 60)
+)
+MERCHANT_AUTH_CACHE_SIZE: int = int(os.getenv("MERCHANT_AUTH_CACHE_SIZE", 1024))
+
 JSON_RPC_URL = os.environ["JSON_RPC_URL"]
 CHAIN_ID: int = int(os.environ["CHAIN_ID"])
 CHAIN_HRP: str = identifier.HRPS[CHAIN_ID]
@@ -23,11 +73,14 @@ CHAIN_HRP: str = identifier.HRPS[CHAIN_ID]
 
 # init redis and dramatiq broker
 def setup_redis_broker() -> None:
+    # imported here, pubsub imports this module while being initialized
+    from .encoder import LRWEventEncoder
+
     _connection_pool: redis.BlockingConnectionPool = redis.BlockingConnectionPool(
         host=REDIS_HOST, port=REDIS_PORT, db=0, password=REDIS_PASSWORD
     )
     _redis_db: redis.StrictRedis = redis.StrictRedis(connection_pool=_connection_pool)
-    _result_backend = RedisBackend(encoder=PickleEncoder(), client=_redis_db)
+    _result_backend = RedisBackend(encoder=LRWEventEncoder(), client=_redis_db)
     _result_middleware = Results(backend=_result_backend)
     broker: Broker = RedisBroker(
         connection_pool=_connection_pool,
@@ -35,7 +88,7 @@ def setup_redis_broker() -> None:
         namespace="lrm",
     )
     dramatiq.set_broker(broker)
-    dramatiq.set_encoder(dramatiq.PickleEncoder())
+    dramatiq.set_encoder(LRWEventEncoder())
 
 
 if dramatiq.broker.global_broker is None:
@@ -0,0 +1,50 @@
+# Copyright (c) The Diem Core Contributors
+# SPDX-License-Identifier: Apache-2.0
+
+import json
+from typing import Any, Dict, List
+
+import dramatiq
+
+from pubsub.types import LRWPubSubEvent
+
+_EVENT_TAG = "$lrw"
+# JSON output never holds a raw NUL, so it safely ends the envelope
+_SEPARATOR = b"\0"
+
+
+class LRWEventEncoder(dramatiq.Encoder):
+    """
+    Encodes dramatiq messages as a JSON envelope followed by the compact
+    binary records of every LRWPubSubEvent argument, instead of pickling
+    whole Python objects. Inside the envelope an event is replaced by a
+    reference to its record.
+    """
+
+    def encode(self, data: Dict[str, Any]) -> bytes:
+        records: List[bytes] = []
+
+        def default(obj: Any) -> Any:
+            if isinstance(obj, LRWPubSubEvent):
+                records.append(obj.to_bytes())
+                return {_EVENT_TAG: len(records) - 1}
+            raise TypeError(f"Object of type {type(obj).__name__} is not serializable")
+
+        envelope = json.dumps(data, separators=(",", ":"), default=default)
+        return b"".join([envelope.encode("utf-8"), _SEPARATOR, *records])
+
+    def decode(self, data: bytes) -> Dict[str, Any]:
+        envelope, _, records = bytes(data).partition(_SEPARATOR)
+
+        events = []
+        offset = 0
+        while offset < len(records):
+            event, offset = LRWPubSubEvent.unpack_from(records, offset)
+            events.append(event)
+
+        def object_hook(obj: Dict[str, Any]) -> Any:
+            if _EVENT_TAG in obj:
+                return events[obj[_EVENT_TAG]]
+            return obj
+
+        return json.loads(envelope.decode("utf-8"), object_hook=object_hook)
@@ -1,22 +1,142 @@
 # Copyright (c) The Diem Core Contributors
 # SPDX-License-Identifier: Apache-2.0
 
+import functools
+import logging
 import os
+import threading
+from typing import List, Optional, Tuple
 
-from diem import testnet, jsonrpc, diem_types
+import requests
+from diem import identifier, testnet, jsonrpc, diem_types, stdlib, txnmetadata, utils
 from diem_utils.custody import Custody
+from diem_utils.types.currencies import DiemCurrency
 from diem_utils.vasp import Vasp
 
-from merchant_vasp.config import JSON_RPC_URL
+from merchant_vasp.config import CHAIN_HRP, JSON_RPC_URL
+
+logger = logging.getLogger(__name__)
 
 CHAIN_ID = diem_types.ChainId(value=os.getenv("CHAIN_ID", testnet.CHAIN_ID.value))
 
 Custody.init(CHAIN_ID)
 
+# currency, amount, destination address and destination sub address
+Transfer = Tuple[DiemCurrency, int, str, Optional[str]]
+
+HTTP_POOL_SIZE = int(os.getenv("JSON_RPC_POOL_SIZE", 32))
+
+_session_lock = threading.Lock()
+_wallet_lock = threading.Lock()
+_http_session: Optional[requests.Session] = None
+_thread_clients = threading.local()
+
+
+def get_http_session() -> requests.Session:
+    """Process wide HTTP session, pooling the JSON-RPC connections"""
+    global _http_session
+    if _http_session is None:
+        with _session_lock:
+            if _http_session is None:
+                session = requests.Session()
+                adapter = requests.adapters.HTTPAdapter(
+                    pool_connections=HTTP_POOL_SIZE, pool_maxsize=HTTP_POOL_SIZE
+                )
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                _http_session = session
+    return _http_session
+
+
+def get_diem_client() -> jsonrpc.Client:
+    """
+    JSON-RPC client of the calling thread. A client serializes its calls and
+    rejects responses older than the last one it saw, so sharing one across
+    threads would stall them; only the HTTP session is shared.
+    """
+    client = getattr(_thread_clients, "client", None)
+    if client is None:
+        client = jsonrpc.Client(JSON_RPC_URL, session=get_http_session())
+        _thread_clients.client = client
+    return client
+
 
 class OnchainWallet(Vasp):
-    def __init__(self):
+    _shared: Optional["OnchainWallet"] = None
+
+    def __init__(self, diem_client: Optional[jsonrpc.Client] = None):
         wallet_custody_account_name = os.getenv(
             "WALLET_CUSTODY_ACCOUNT_NAME", "merchant-wallet"
         )
-        super().__init__(jsonrpc.Client(JSON_RPC_URL), wallet_custody_account_name)
+        super().__init__(diem_client, wallet_custody_account_name)
+
+    @property
+    def _diem_client(self) -> jsonrpc.Client:
+        # the wallet is shared across threads, see get_diem_client
+        return self._own_diem_client or get_diem_client()
+
+    @_diem_client.setter
+    def _diem_client(self, diem_client: Optional[jsonrpc.Client]) -> None:
+        self._own_diem_client = diem_client
+
+    @classmethod
+    def shared(cls) -> "OnchainWallet":
+        """
+        The wallet instance shared by the process, so the custody account and
+        its key are loaded once instead of on every call
+        """
+        if cls._shared is None:
+            with _wallet_lock:
+                if cls._shared is None:
+                    cls._shared = cls()
+        return cls._shared
+
+    @functools.lru_cache(maxsize=4096)
+    def encode_address(self, subaddress: str) -> str:
+        """Bech32 account identifier of the wallet with the given subaddress"""
+        return identifier.encode_account(self.address_str, subaddress, CHAIN_HRP)
+
+    def send_transactions(self, transfers: List[Transfer]) -> List[Optional[int]]:
+        """
+        Submit the transfers back to back with consecutive sequence numbers,
+        then wait for all of them, instead of a round trip per transfer.
+        Returns the version of each executed transfer, None for failed ones.
+        Transfers after a failed submission are not sent, since their
+        sequence numbers could never execute.
+        """
+        account_info = self.fetch_account_info()
+        if not account_info:
+            raise RuntimeError(f"Could not find account {self.address_str}")
+
+        submitted = []
+        for offset, (currency, amount, address, sub_address) in enumerate(transfers):
+            script = stdlib.encode_peer_to_peer_with_metadata_script(
+                currency=utils.currency_code(currency.value),
+                payee=utils.account_address(address),
+                amount=amount,
+                metadata=txnmetadata.general_metadata(
+                    to_subaddress=bytes.fromhex(sub_address) if sub_address else None
+                ),
+                metadata_signature=b"",
+            )
+            tx = self._custody.create_transaction(
+                self._custody_account_name,
+                account_info.sequence_number + offset,
+                script,
+                currency.value,
+            )
+            try:
+                self._diem_client.submit(tx)
+            except Exception:
+                logger.exception(f"Failed to submit transfer to {address}")
+                break
+            submitted.append(tx)
+
+        versions = []
+        for tx in submitted:
+            try:
+                versions.append(self._diem_client.wait_for_transaction(tx, 30).version)
+            except Exception:
+                logger.exception("Submitted transfer failed")
+                versions.append(None)
+        return versions + [None] * (len(transfers) - len(submitted))
@@ -0,0 +1,192 @@
+"""
+Streaming export of a merchant's payments, together with their status logs
+and chain transactions. Payments are read through a server-side cursor in
+chunks of PAYMENTS_EXPORT_CHUNK_SIZE, and the details of each chunk are
+fetched with one query per table, so memory use does not grow with the
+number of exported payments.
+
+Exports are ordered by (last_update, id). A payment is exported again once
+it changes, which makes `since` the watermark of incremental exports.
+
+last_update is stamped by the application before its transaction commits,
+so a payment may become visible with a last_update older than the moment
+it was committed. Exports therefore end at `watermark()`, now minus
+PAYMENTS_EXPORT_SAFETY_LAG_SECONDS. As long as every transaction, worker
+batches included, commits within that lag, including clock skew between
+hosts, a chain of incremental exports misses no change. A payment that
+changes again later is exported again.
+"""
+
+import csv
+import io
+import json
+from collections import defaultdict
+from datetime import datetime, timedelta
+from itertools import islice
+from typing import Dict, Iterable, Iterator, List, Optional
+
+from merchant_vasp.config import (
+    PAYMENTS_EXPORT_CHUNK_SIZE,
+    PAYMENTS_EXPORT_SAFETY_LAG_SECONDS,
+)
+from merchant_vasp.storage import Payment, db_session
+from merchant_vasp.storage.models import ChainTransaction, PaymentStatusLog
+
+CSV_COLUMNS = [
+    "record",
+    "payment_id",
+    "merchant_reference_id",
+    "created_at",
+    "last_update",
+    "status",
+    "requested_amount",
+    "requested_currency",
+    "refund_requested",
+    "expiry_date",
+    "tx_id",
+    "is_refund",
+    "sender_address",
+    "amount",
+    "currency",
+]
+
+
+def watermark() -> datetime:
+    """The `until` of an export started now, see the module docstring"""
+    return datetime.utcnow() - timedelta(seconds=PAYMENTS_EXPORT_SAFETY_LAG_SECONDS)
+
+
+def export_payments(
+    merchant_id: int,
+    until: datetime,
+    since: Optional[datetime] = None,
+    chunk_size: int = PAYMENTS_EXPORT_CHUNK_SIZE,
+) -> Iterator[Dict]:
+    """
+    The merchant's payments last updated in (since, until], each with its
+    `status_logs` and `chain_transactions`
+    """
+    query = db_session.query(
+        Payment.id,
+        Payment.merchant_reference_id,
+        Payment.created_at,
+        Payment.last_update,
+        Payment.status,
+        Payment.requested_amount,
+        Payment.requested_currency,
+        Payment.refund_requested,
+        Payment.expiry_date,
+    ).filter(Payment.merchant_id == merchant_id, Payment.last_update <= until)
+    if since is not None:
+        query = query.filter(Payment.last_update > since)
+    # yield_per streams the results from a server-side cursor
+    rows = iter(query.order_by(Payment.last_update, Payment.id).yield_per(chunk_size))
+
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            return
+        yield from _with_details(chunk)
+
+
+def _with_details(rows: List) -> Iterator[Dict]:
+    ids = [row.id for row in rows]
+    status_logs = defaultdict(list)
+    for log in (
+        db_session.query(
+            PaymentStatusLog.payment_id,
+            PaymentStatusLog.created_at,
+            PaymentStatusLog.status,
+        )
+        .filter(PaymentStatusLog.payment_id.in_(ids))
+        .order_by(PaymentStatusLog.id)
+    ):
+        status_logs[log.payment_id].append(
+            {"created_at": _iso(log.created_at), "status": log.status}
+        )
+    chain_transactions = defaultdict(list)
+    for tx in (
+        db_session.query(
+            ChainTransaction.payment_id,
+            ChainTransaction.tx_id,
+            ChainTransaction.is_refund,
+            ChainTransaction.sender_address,
+            ChainTransaction.amount,
+            ChainTransaction.currency,
+        )
+        .filter(ChainTransaction.payment_id.in_(ids))
+        .order_by(ChainTransaction.id)
+    ):
+        chain_transactions[tx.payment_id].append(
+            {
+                "tx_id": tx.tx_id,
+                "is_refund": tx.is_refund,
+                "sender_address": tx.sender_address,
+                "amount": tx.amount,
+                "currency": tx.currency,
+            }
+        )
+
+    for row in rows:
+        yield {
+            "payment_id": row.id,
+            "merchant_reference_id": row.merchant_reference_id,
+            "created_at": _iso(row.created_at),
+            "last_update": _iso(row.last_update),
+            "status": row.status,
+            "requested_amount": row.requested_amount,
+            "requested_currency": row.requested_currency,
+            "refund_requested": row.refund_requested,
+            "expiry_date": _iso(row.expiry_date),
+            "status_logs": status_logs[row.id],
+            "chain_transactions": chain_transactions[row.id],
+        }
+
+
+def _iso(value: Optional[datetime]) -> Optional[str]:
+    return value.isoformat() if value is not None else None
+
+
+def ndjson_lines(payments: Iterable[Dict]) -> Iterator[str]:
+    """One JSON document per payment, details nested"""
+    for payment in payments:
+        yield json.dumps(payment) + "\n"
+
+
+def csv_lines(payments: Iterable[Dict]) -> Iterator[str]:
+    """
+    One row per payment, status log and chain transaction, told apart by the
+    `record` column. Detail rows follow the row of their payment.
+    """
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, CSV_COLUMNS, extrasaction="ignore")
+
+    def flush():
+        line = buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+        return line
+
+    writer.writeheader()
+    yield flush()
+    for payment in payments:
+        writer.writerow({"record": "payment", **payment})
+        for log in payment["status_logs"]:
+            writer.writerow(
+                {"record": "status_log", "payment_id": payment["payment_id"], **log}
+            )
+        for tx in payment["chain_transactions"]:
+            writer.writerow(
+                {
+                    "record": "chain_transaction",
+                    "payment_id": payment["payment_id"],
+                    **tx,
+                }
+            )
+        yield flush()
+
+
+FORMATS = {
+    "ndjson": (ndjson_lines, "application/x-ndjson"),
+    "csv": (csv_lines, "text/csv"),
+}
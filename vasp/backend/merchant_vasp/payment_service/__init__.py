@@ -1,6 +1,7 @@
 from .payment_service import (
     get_supported_currencies,
     process_incoming_transaction,
+    process_incoming_transactions,
     get_supported_network_currencies,
     generate_payment_options_with_qr,
 )
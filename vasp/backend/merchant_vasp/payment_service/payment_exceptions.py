@@ -20,3 +20,11 @@ class PaymentExpiredException(PaymentServiceException):
 
 class PaymentOptionNotFoundException(PaymentServiceException):
     pass
+
+
+# Rejections leaving the funds in the merchant wallet, to be refunded
+ERRANT_PAYMENT_EXCEPTIONS = (
+    PaymentForSubaddrNotFoundException,
+    PaymentExpiredException,
+    PaymentOptionNotFoundException,
+)
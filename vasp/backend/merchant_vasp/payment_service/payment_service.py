@@ -1,22 +1,22 @@
 import logging
-from typing import Tuple
+from typing import Any, Dict, List, Optional, Tuple
 
 import pyqrcode
-from diem import identifier, jsonrpc, testnet
+from diem import identifier, testnet
 from diem_utils.types.currencies import FiatCurrency, DiemCurrency
 
 from .payment_exceptions import *
-from ..config import CHAIN_HRP, JSON_RPC_URL
-from ..onchainwallet import OnchainWallet
-from ..storage import Payment, PaymentStatus, db_session
+from ..config import CHAIN_HRP
+from ..onchainwallet import OnchainWallet, get_diem_client
+from ..storage import Payment, PaymentStatus, db_session, payment_cache
+from ..storage.models import ChainTransaction, match_payment_option
 
 logger = logging.getLogger(__name__)
 
 
 def get_supported_network_currencies() -> Tuple[str]:
     # TODO - error handling
-    api = jsonrpc.Client(JSON_RPC_URL)
-    supported_currency_info = api.get_currencies()
+    supported_currency_info = get_diem_client().get_currencies()
 
     return tuple(_.code for _ in supported_currency_info if _.code == DiemCurrency.XUS)
 
@@ -41,17 +41,144 @@ def process_incoming_transaction(
 ) -> None:
     """This function receives incoming payment events from the chain"""
     # Check if the payment is intended for us - this address is configured via environment variable, see config.py
-    if receiver_address != OnchainWallet().address_str:
+    if receiver_address != OnchainWallet.shared().address_str:
         logging.debug("Received payment to unknown base address.")
         raise WrongReceiverAddressException("wrongaddr")
 
+    # Open payments are usually cached, clear them without reading the db
+    if _clear_cached_payment(
+        payment_cache.get(receiver_sub_address),
+        version,
+        sender_address,
+        sender_sub_address,
+        amount,
+        currency,
+    ):
+        db_session.commit()
+        return
+
     # Locate payment id and payment options related to the given subaddress
     payment = Payment.find_by_subaddress(receiver_sub_address)
+    try:
+        _clear_payment(
+            payment,
+            version,
+            sender_address,
+            sender_sub_address,
+            receiver_sub_address,
+            amount,
+            currency,
+        )
+    except PaymentExpiredException:
+        db_session.commit()
+        raise
+    db_session.commit()
+
+
+def process_incoming_transactions(
+    transactions: List[Dict[str, Any]],
+) -> List[Optional[PaymentServiceException]]:
+    """
+    Batch variant of process_incoming_transaction, taking its keyword arguments
+    per transaction. The payments are loaded with a single query and all
+    changes are left in the session, for the caller to commit at once.
+    Returns the exception each transaction was rejected with, None if cleared.
+    """
+    vasp_addr = OnchainWallet.shared().address_str
+    subaddresses = [txn["receiver_sub_address"] for txn in transactions]
+    cached = dict(zip(subaddresses, payment_cache.get_many(subaddresses)))
+    uncached = {subaddress for subaddress, hit in cached.items() if hit is None}
+    payments = {
+        payment.subaddress: payment
+        for payment in (Payment.find_by_subaddresses(uncached) if uncached else [])
+    }
+
+    results = []
+    for txn in transactions:
+        subaddress = txn["receiver_sub_address"]
+        try:
+            if txn["receiver_address"] != vasp_addr:
+                logging.debug("Received payment to unknown base address.")
+                raise WrongReceiverAddressException("wrongaddr")
+            if _clear_cached_payment(
+                cached[subaddress],
+                txn["version"],
+                txn["sender_address"],
+                txn["sender_sub_address"],
+                txn["amount"],
+                txn["currency"],
+            ):
+                results.append(None)
+                continue
+            if subaddress not in payments and cached[subaddress] is not None:
+                # the cached payment could not be cleared, let the db decide
+                payments[subaddress] = Payment.find_by_subaddress(subaddress)
+            _clear_payment(
+                payments.get(subaddress),
+                txn["version"],
+                txn["sender_address"],
+                txn["sender_sub_address"],
+                txn["receiver_sub_address"],
+                txn["amount"],
+                txn["currency"],
+            )
+            results.append(None)
+        except PaymentServiceException as e:
+            results.append(e)
+    return results
+
+
+def _clear_cached_payment(
+    cached,
+    version,
+    sender_address,
+    sender_sub_address,
+    amount,
+    currency,
+) -> bool:
+    """
+    Clear an open payment from its cached copy. Returns False whenever the
+    cache can't vouch for the payment, leaving the decision to _clear_payment.
+    """
+    if (
+        cached is None
+        or cached.status != PaymentStatus.created
+        or cached.is_expired()
+        or match_payment_option(cached.payment_options, amount, currency) is None
+    ):
+        return False
+
+    logging.debug(f"Clearing cached payment id {cached.id}")
+    cleared = Payment.clear_by_id(
+        cached.id,
+        ChainTransaction(
+            payment_id=cached.id,
+            sender_address=identifier.encode_account(
+                sender_address, sender_sub_address, CHAIN_HRP
+            ),
+            amount=amount,
+            currency=currency,
+            tx_id=version,
+        ),
+    )
+    payment_cache.evict(cached.subaddress)
+    return cleared
+
+
+def _clear_payment(
+    payment,
+    version,
+    sender_address,
+    sender_sub_address,
+    receiver_sub_address,
+    amount,
+    currency,
+) -> None:
     if payment is None:
         logging.debug(
             f"Could not find the qualifying payment {receiver_sub_address}, ignoring."
         )
-        # TODO - Process for errant payments?
+        # the worker records the funds as an errant payment to refund
         raise PaymentForSubaddrNotFoundException("wrongsubaddr")
 
     if payment.status != PaymentStatus.created:
@@ -61,8 +188,6 @@ def process_incoming_transaction(
     if payment.is_expired():
         logging.debug(f"Payment expired: {payment.expiry_date}. Rejecting.")
         payment.set_status(PaymentStatus.rejected)
-        db_session.commit()
-        # TODO - Do we need a reaper process to simply mark expired payments as such?
         raise PaymentExpiredException("paymentexpired")
 
     # verify payment matches any of the payment options for this payment id
@@ -83,21 +208,17 @@ def process_incoming_transaction(
         amount,
         currency,
         version,
+        commit=False,
     )
-    db_session.commit()
 
 
 def generate_payment_options_with_qr(payment):
     payment_options_with_qr = []
 
-    vasp_addr = OnchainWallet().address_str
-    logger.debug(f"Current vasp address: {vasp_addr}")
-    full_payment_addr = identifier.encode_account(
-        vasp_addr, payment.subaddress, CHAIN_HRP
-    )
-    logger.debug(f"Rendering full payment link: {full_payment_addr}")
-
-    bech32addr = identifier.encode_account(vasp_addr, payment.subaddress, CHAIN_HRP)
+    wallet = OnchainWallet.shared()
+    logger.debug(f"Current vasp address: {wallet.address_str}")
+    bech32addr = wallet.encode_address(payment.subaddress)
+    logger.debug(f"Rendering full payment link: {bech32addr}")
 
     for payment_option in payment.payment_options:
         payment_link = f"diem://{bech32addr}?c={payment_option.currency}&am={payment_option.amount}"
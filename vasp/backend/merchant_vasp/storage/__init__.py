@@ -1,16 +1,31 @@
 # pyre-ignore-all-errors
+import logging
+
 from sqlalchemy import MetaData
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker, scoped_session
 from sqlalchemy.ext.declarative import declarative_base
-from ..config import DB_URL
+from ..config import DB_URL, DB_POOL_SIZE, DB_MAX_OVERFLOW, WORKER_GEVENT
 
-connect_args = {}
+engine_args = {}
 
 if DB_URL.startswith("sqlite"):
-    connect_args = {"check_same_thread": False}
+    engine_args["connect_args"] = {"check_same_thread": False}
+else:
+    engine_args.update(pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW)
+
+if WORKER_GEVENT and DB_URL.startswith("postgresql"):
+    # let psycopg2 yield to other greenlets while waiting on the database
+    try:
+        from psycogreen.gevent import patch_psycopg
+
+        patch_psycopg()
+    except ImportError:
+        logging.getLogger(__name__).warning(
+            "psycogreen is not installed, database calls will block greenlets"
+        )
 
-engine = create_engine(DB_URL, connect_args=connect_args)
+engine = create_engine(DB_URL, **engine_args)
 metadata = MetaData()
 db_session = scoped_session(
     sessionmaker(autocommit=False, autoflush=False, bind=engine)
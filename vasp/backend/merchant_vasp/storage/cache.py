@@ -0,0 +1,207 @@
+# pyre-ignore-all-errors
+"""
+Write-through cache of open payments, keyed by subaddress, so clearing an
+incoming payment doesn't need to read the payment table. And the in-process
+cache of authenticated merchants, keyed by API key hash.
+"""
+
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, List, NamedTuple, Optional
+
+import redis
+from prometheus_client import Counter
+
+from ..config import (
+    REDIS_HOST,
+    REDIS_PORT,
+    REDIS_PASSWORD,
+    PAYMENT_CACHE_ENABLED,
+    PAYMENT_CACHE_TIMEOUT_MS,
+    MERCHANT_AUTH_CACHE_ENABLED,
+    MERCHANT_AUTH_CACHE_TTL_SECONDS,
+    MERCHANT_AUTH_CACHE_SIZE,
+)
+
+logger = logging.getLogger(__name__)
+
+auth_cache_lookups = Counter(
+    "merchant_auth_cache_lookups",
+    "Merchant authentications by cache result, hit or miss",
+    ["result"],
+)
+
+
+class CachedPaymentOption(NamedTuple):
+    amount: int
+    currency: str
+
+
+class CachedPayment(NamedTuple):
+    id: str
+    subaddress: str
+    status: str
+    expiry_date: datetime
+    payment_options: List[CachedPaymentOption]
+
+    def is_expired(self):
+        return self.expiry_date <= datetime.utcnow()
+
+
+class PaymentCache:
+    """
+    Open payments live in Redis until they expire or are evicted when they
+    reach another status. Redis errors are logged and treated as misses,
+    the database stays the source of truth. Calls time out after
+    PAYMENT_CACHE_TIMEOUT_MS, so an unreachable Redis is a miss too.
+    """
+
+    def __init__(self, client: Optional[redis.Redis] = None, namespace="lrm:payment"):
+        self._client = client
+        self.namespace = namespace
+        self.enabled = PAYMENT_CACHE_ENABLED
+
+    @property
+    def client(self) -> redis.Redis:
+        if self._client is None:
+            self._client = redis.StrictRedis(
+                host=REDIS_HOST,
+                port=REDIS_PORT,
+                password=REDIS_PASSWORD,
+                socket_timeout=PAYMENT_CACHE_TIMEOUT_MS / 1000,
+                socket_connect_timeout=PAYMENT_CACHE_TIMEOUT_MS / 1000,
+            )
+        return self._client
+
+    @client.setter
+    def client(self, client: redis.Redis) -> None:
+        self._client = client
+
+    def put(self, payment) -> None:
+        ttl = int((payment.expiry_date - datetime.utcnow()).total_seconds())
+        if not self.enabled or ttl <= 0:
+            return
+        value = json.dumps(
+            {
+                "id": payment.id,
+                "status": payment.status,
+                "expiry_date": payment.expiry_date.isoformat(),
+                "payment_options": [
+                    [option.amount, option.currency]
+                    for option in payment.payment_options
+                ],
+            }
+        )
+        try:
+            self.client.set(self._key(payment.subaddress), value, ex=ttl)
+        except redis.RedisError as e:
+            logger.warning(f"Failed to cache payment {payment.id}: {e}")
+
+    def get_many(self, subaddresses: List[str]) -> List[Optional[CachedPayment]]:
+        if not self.enabled or not subaddresses:
+            return [None] * len(subaddresses)
+        try:
+            values = self.client.mget([self._key(s) for s in subaddresses])
+        except redis.RedisError as e:
+            logger.warning(f"Failed to read the payment cache: {e}")
+            return [None] * len(subaddresses)
+        return [
+            self._decode(subaddress, value) if value is not None else None
+            for subaddress, value in zip(subaddresses, values)
+        ]
+
+    def get(self, subaddress: str) -> Optional[CachedPayment]:
+        return self.get_many([subaddress])[0]
+
+    def evict(self, subaddress: str) -> None:
+        if not self.enabled:
+            return
+        try:
+            self.client.delete(self._key(subaddress))
+        except redis.RedisError as e:
+            logger.warning(f"Failed to evict payment {subaddress} from cache: {e}")
+
+    def _key(self, subaddress: str) -> str:
+        return f"{self.namespace}:{subaddress}"
+
+    @staticmethod
+    def _decode(subaddress: str, value: bytes) -> CachedPayment:
+        data = json.loads(value)
+        return CachedPayment(
+            id=data["id"],
+            subaddress=subaddress,
+            status=data["status"],
+            expiry_date=datetime.fromisoformat(data["expiry_date"]),
+            payment_options=[
+                CachedPaymentOption(amount, currency)
+                for amount, currency in data["payment_options"]
+            ],
+        )
+
+
+class MerchantAuthCache:
+    """
+    Column values of authenticated merchants by API key hash, kept for
+    `ttl_seconds` and at most `max_entries` of them, least recently used
+    first out. Entries are invalidated when a merchant changes in this
+    process; the TTL bounds how long changes made elsewhere take to show.
+    """
+
+    def __init__(self, ttl_seconds: int, max_entries: int):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.enabled = MERCHANT_AUTH_CACHE_ENABLED
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key_hash: str) -> Optional[Dict]:
+        if not self.enabled:
+            return None
+        with self._lock:
+            entry = self._entries.get(key_hash)
+            if entry is not None and entry[0] <= time.monotonic():
+                del self._entries[key_hash]
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(key_hash)
+        if entry is None:
+            self.misses += 1
+            auth_cache_lookups.labels("miss").inc()
+            return None
+        self.hits += 1
+        auth_cache_lookups.labels("hit").inc()
+        return entry[1]
+
+    def put(self, key_hash: str, values: Dict) -> None:
+        if not self.enabled:
+            return
+        with self._lock:
+            self._entries[key_hash] = (time.monotonic() + self.ttl_seconds, values)
+            self._entries.move_to_end(key_hash)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, key_hash: str) -> None:
+        with self._lock:
+            self._entries.pop(key_hash, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+
+payment_cache = PaymentCache()
+merchant_auth_cache = MerchantAuthCache(
+    MERCHANT_AUTH_CACHE_TTL_SECONDS, MERCHANT_AUTH_CACHE_SIZE
+)
@@ -0,0 +1,100 @@
+# pyre-ignore-all-errors
+"""
+Versioned schema migrations. Each `mNNNN_<name>.py` module of this package
+has an `upgrade(connection)` function, applied in order of NNNN inside its
+own transaction. Applied versions are recorded in the schema_version table.
+
+Migrations must be idempotent (IF NOT EXISTS and the like): databases
+created before migrations existed already hold part of the schema.
+
+Every web worker migrates on startup, so migrations are applied under a
+lock: a PostgreSQL advisory lock, or a lock file next to a SQLite database.
+"""
+
+import fcntl
+import importlib
+import logging
+import pkgutil
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Iterator, List, Tuple
+
+from sqlalchemy import Column, DateTime, Integer, MetaData, Table, text
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+schema_version = Table(
+    "schema_version",
+    MetaData(),
+    Column("version", Integer, primary_key=True, autoincrement=False),
+    Column("applied_at", DateTime, nullable=False),
+)
+
+# Key of the PostgreSQL advisory lock held while migrating, any constant works
+MIGRATION_LOCK_KEY = 0x6D69_6772
+
+
+def migrations() -> List[Tuple[int, object]]:
+    found = []
+    for module in pkgutil.iter_modules(__path__):
+        if module.name.startswith("m") and module.name[1:5].isdigit():
+            version = int(module.name[1:5])
+            found.append(
+                (version, importlib.import_module(f"{__name__}.{module.name}"))
+            )
+    return sorted(found, key=lambda migration: migration[0])
+
+
+def current_version(engine: Engine) -> int:
+    schema_version.create(bind=engine, checkfirst=True)
+    with engine.connect() as connection:
+        versions = [row.version for row in connection.execute(schema_version.select())]
+    return max(versions, default=0)
+
+
+@contextmanager
+def migration_lock(engine: Engine) -> Iterator[None]:
+    """Held by one process at a time, across all the hosts of the database"""
+    if engine.dialect.name == "postgresql":
+        with engine.connect() as connection:
+            lock = {"key": MIGRATION_LOCK_KEY}
+            connection.execute(text("SELECT pg_advisory_lock(:key)"), **lock)
+            try:
+                yield
+            finally:
+                connection.execute(text("SELECT pg_advisory_unlock(:key)"), **lock)
+    elif engine.dialect.name == "sqlite" and engine.url.database not in (
+        None,
+        "",
+        ":memory:",
+    ):
+        with open(f"{engine.url.database}.migrate.lock", "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+    else:
+        # in-memory databases are private to their process
+        yield
+
+
+def migrate(engine: Engine) -> int:
+    """Apply the pending migrations, returns the resulting schema version"""
+    with migration_lock(engine):
+        # read under the lock, another worker may have migrated meanwhile
+        version = current_version(engine)
+        for migration_version, migration in migrations():
+            if migration_version <= version:
+                continue
+            logger.info(f"Applying schema migration {migration.__name__}")
+            with engine.begin() as connection:
+                migration.upgrade(connection)
+                connection.execute(
+                    schema_version.insert().values(
+                        version=migration_version, applied_at=datetime.utcnow()
+                    )
+                )
+            version = migration_version
+    return version
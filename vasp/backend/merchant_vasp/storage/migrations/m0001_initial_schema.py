@@ -0,0 +1,115 @@
+# pyre-ignore-all-errors
+"""
+The schema as it was when migrations were introduced. Frozen on purpose:
+later changes to the models go into their own migrations, never here.
+"""
+
+from sqlalchemy import (
+    BigInteger,
+    Boolean,
+    Column,
+    DateTime,
+    ForeignKey,
+    Index,
+    Integer,
+    MetaData,
+    String,
+    Table,
+)
+
+metadata = MetaData()
+
+Table(
+    "merchant",
+    metadata,
+    Column("id", Integer, primary_key=True, autoincrement=True),
+    Column("name", String, nullable=True),
+    Column("settlement_information", String, nullable=True),
+    Column("settlement_currency", String, nullable=True),
+    Column("api_key", String, unique=True),
+)
+
+Table(
+    "payment",
+    metadata,
+    Column("id", String, primary_key=True),
+    Column("merchant_reference_id", String, nullable=False),
+    Column(
+        "merchant_id", Integer, ForeignKey("merchant.id"), index=True, nullable=False
+    ),
+    Column("created_at", DateTime, nullable=False),
+    Column("requested_amount", BigInteger, nullable=False),
+    Column("requested_currency", String, nullable=False),
+    Column("status", String, nullable=False),
+    Column("refund_requested", Boolean, nullable=False),
+    Column("last_update", DateTime, nullable=True),
+    Column("subaddress", String, unique=True, nullable=False),
+    Column("expiry_date", DateTime, nullable=False),
+    Index("ix_payment_status_expiry_date", "status", "expiry_date"),
+    Index(
+        "uq_payment_merchant_reference_id",
+        "merchant_id",
+        "merchant_reference_id",
+        unique=True,
+    ),
+)
+
+Table(
+    "chain_transaction",
+    metadata,
+    Column("id", Integer, primary_key=True, autoincrement=True),
+    Column("payment_id", String, ForeignKey("payment.id"), index=True, nullable=False),
+    Column("sender_address", String, nullable=False),
+    Column("amount", BigInteger, nullable=False),
+    Column("currency", String, nullable=False),
+    Column("is_refund", Boolean, nullable=False),
+    Column("tx_id", Integer, index=True, nullable=False),
+)
+
+Table(
+    "payment_option",
+    metadata,
+    Column("id", Integer, primary_key=True, autoincrement=True),
+    Column("payment_id", String, ForeignKey("payment.id"), index=True, nullable=False),
+    Column("amount", BigInteger, nullable=False),
+    Column("currency", String, nullable=False),
+)
+
+Table(
+    "payment_status_log",
+    metadata,
+    Column("id", Integer, primary_key=True, autoincrement=True),
+    Column("payment_id", String, ForeignKey("payment.id"), index=True, nullable=False),
+    Column("created_at", DateTime, nullable=False),
+    Column("status", String, nullable=False),
+)
+
+Table(
+    "errant_payment",
+    metadata,
+    Column("id", Integer, primary_key=True, autoincrement=True),
+    Column("tx_id", BigInteger, unique=True, nullable=False),
+    Column("sender_address", String, nullable=False),
+    Column("sender_sub_address", String, nullable=True),
+    Column("amount", BigInteger, nullable=False),
+    Column("currency", String, nullable=False),
+    Column("reason", String, nullable=False),
+    Column("status", String, nullable=False),
+    Column("refund_tx_id", BigInteger, nullable=True),
+    Column("created_at", DateTime, nullable=False),
+    Column("last_update", DateTime, nullable=True),
+    Index("ix_errant_payment_status", "status"),
+)
+
+Table(
+    "processed_event",
+    metadata,
+    Column("version", BigInteger, primary_key=True, autoincrement=False),
+    Column("sequence", BigInteger, primary_key=True, autoincrement=False),
+    Column("created_at", DateTime, nullable=False),
+)
+
+
+def upgrade(connection) -> None:
+    # Databases created before migrations existed already hold these tables
+    metadata.create_all(bind=connection, checkfirst=True)
@@ -0,0 +1,21 @@
+# pyre-ignore-all-errors
+INDEXES = [
+    "CREATE UNIQUE INDEX IF NOT EXISTS uq_payment_merchant_reference_id "
+    "ON payment (merchant_id, merchant_reference_id)",
+    "CREATE INDEX IF NOT EXISTS ix_payment_status_expiry_date "
+    "ON payment (status, expiry_date)",
+    "CREATE INDEX IF NOT EXISTS ix_chain_transaction_payment_id "
+    "ON chain_transaction (payment_id)",
+    "CREATE INDEX IF NOT EXISTS ix_chain_transaction_tx_id "
+    "ON chain_transaction (tx_id)",
+    "CREATE INDEX IF NOT EXISTS ix_payment_option_payment_id "
+    "ON payment_option (payment_id)",
+    "CREATE INDEX IF NOT EXISTS ix_payment_status_log_payment_id "
+    "ON payment_status_log (payment_id)",
+]
+
+
+def upgrade(connection) -> None:
+    # Fails on duplicate merchant references, which must be resolved by hand
+    for statement in INDEXES:
+        connection.execute(statement)
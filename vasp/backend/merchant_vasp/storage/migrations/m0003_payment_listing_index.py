@@ -0,0 +1,7 @@
+# pyre-ignore-all-errors
+def upgrade(connection) -> None:
+    # Serves the keyset pagination of the merchant payment listing
+    connection.execute(
+        "CREATE INDEX IF NOT EXISTS ix_payment_merchant_created_at "
+        "ON payment (merchant_id, created_at, id)"
+    )
@@ -0,0 +1,11 @@
+# pyre-ignore-all-errors
+def upgrade(connection) -> None:
+    # Payments written before last_update was maintained enter the
+    # incremental exports at their creation time
+    connection.execute(
+        "UPDATE payment SET last_update = created_at WHERE last_update IS NULL"
+    )
+    connection.execute(
+        "CREATE INDEX IF NOT EXISTS ix_payment_merchant_last_update "
+        "ON payment (merchant_id, last_update, id)"
+    )
@@ -0,0 +1,28 @@
+# pyre-ignore-all-errors
+import hashlib
+
+from sqlalchemy import inspect, text
+
+
+def upgrade(connection) -> None:
+    # Replaces the plaintext API keys with their SHA-256, see hash_api_key
+    columns = {column["name"] for column in inspect(connection).get_columns("merchant")}
+    if "api_key_hash" not in columns:
+        connection.execute("ALTER TABLE merchant ADD COLUMN api_key_hash VARCHAR")
+    if "api_key" in columns:
+        keys = connection.execute(
+            "SELECT id, api_key FROM merchant WHERE api_key IS NOT NULL"
+        ).fetchall()
+        for merchant_id, api_key in keys:
+            connection.execute(
+                text(
+                    "UPDATE merchant SET api_key_hash = :key_hash, api_key = NULL "
+                    "WHERE id = :id"
+                ),
+                key_hash=hashlib.sha256(api_key.encode()).hexdigest(),
+                id=merchant_id,
+            )
+    connection.execute(
+        "CREATE UNIQUE INDEX IF NOT EXISTS uq_merchant_api_key_hash "
+        "ON merchant (api_key_hash)"
+    )
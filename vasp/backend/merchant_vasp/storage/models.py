@@ -1,8 +1,10 @@
 # pyre-ignore-all-errors
 import uuid
 import enum
+import hashlib
 import secrets
 from datetime import datetime
+from typing import Optional, Tuple
 from sqlalchemy import (
     Column,
     Integer,
@@ -13,26 +15,92 @@ from sqlalchemy import (
     ForeignKey,
     BigInteger,
     Float,
+    Index,
+    and_,
     event,
+    inspect,
+    literal,
+    or_,
+    select,
 )
-from sqlalchemy.orm import relationship
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import make_transient_to_detached, relationship
 from . import Base, db_session
+from .cache import merchant_auth_cache, payment_cache
+from ..config import PAYMENT_UNDERPAY_TOLERANCE_BPS, PAYMENT_OVERPAY_TOLERANCE_BPS
+
+
+def hash_api_key(api_key: str) -> str:
+    """
+    API keys are random tokens, so an unsalted digest is safe to store and
+    keeps the lookup by key an indexed equality match
+    """
+    return hashlib.sha256(api_key.encode()).hexdigest()
 
 
 class Merchant(Base):
     __tablename__ = "merchant"
+    __table_args__ = (Index("uq_merchant_api_key_hash", "api_key_hash", unique=True),)
 
     id = Column(Integer, primary_key=True, autoincrement=True)
     name = Column(String, unique=False, nullable=True)
     settlement_information = Column(String, unique=False, nullable=True)
     settlement_currency = Column(String, unique=False, nullable=True)
-    api_key = Column(String, unique=True, default=lambda: secrets.token_urlsafe(64))
+    api_key_hash = Column(String)
 
     payments = relationship("Payment", lazy=True)
 
+    def _set_api_key(self, api_key: str):
+        self.api_key_hash = hash_api_key(api_key)
+
+    # Write only, the key itself is never stored
+    api_key = property(fset=_set_api_key)
+
+    def generate_api_key(self) -> str:
+        """Set a new random API key, returned once since it is never stored"""
+        api_key = secrets.token_urlsafe(64)
+        self.api_key = api_key
+        return api_key
+
     @staticmethod
     def find_by_token(token: str):
-        return Merchant.query.filter_by(api_key=token).first()
+        """
+        The merchant authenticated by `token`. Cached merchants are merged
+        into the session without a query.
+        """
+        key_hash = hash_api_key(token)
+        values = merchant_auth_cache.get(key_hash)
+        if values is not None:
+            merchant = Merchant(**values)
+            make_transient_to_detached(merchant)
+            return db_session.merge(merchant, load=False)
+
+        merchant = Merchant.query.filter_by(api_key_hash=key_hash).first()
+        if merchant is not None:
+            merchant_auth_cache.put(
+                key_hash,
+                {
+                    column.key: getattr(merchant, column.key)
+                    for column in Merchant.__table__.columns
+                },
+            )
+        return merchant
+
+
+@event.listens_for(Merchant, "before_insert")
+def require_api_key(mapper, connect, target):
+    # a key generated here could never be handed out, see generate_api_key
+    if target.api_key_hash is None:
+        raise ValueError("A merchant needs an API key, see generate_api_key")
+
+
+@event.listens_for(Merchant, "after_update")
+@event.listens_for(Merchant, "after_delete")
+def invalidate_merchant_auth(mapper, connect, target):
+    # both the current and, after a key rotation, the previous key
+    history = inspect(target).attrs.api_key_hash.history
+    for key_hash in [target.api_key_hash, *history.deleted]:
+        merchant_auth_cache.invalidate(key_hash)
 
 
 class PaymentStatus(str, enum.Enum):
@@ -56,6 +124,17 @@ class RefundStatus(str, enum.Enum):
 
 class Payment(Base):
     __tablename__ = "payment"
+    __table_args__ = (
+        Index("ix_payment_status_expiry_date", "status", "expiry_date"),
+        Index("ix_payment_merchant_created_at", "merchant_id", "created_at", "id"),
+        Index("ix_payment_merchant_last_update", "merchant_id", "last_update", "id"),
+        Index(
+            "uq_payment_merchant_reference_id",
+            "merchant_id",
+            "merchant_reference_id",
+            unique=True,
+        ),
+    )
 
     id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
     merchant_reference_id = Column(String, nullable=False)
@@ -66,7 +145,9 @@ class Payment(Base):
     requested_currency = Column(String, nullable=False)
     status = Column(String, nullable=False, default=PaymentStatus.created)
     refund_requested = Column(Boolean, nullable=False, default=False)
-    last_update = Column(DateTime, nullable=True)  # TODO - meta field setup
+    last_update = Column(
+        DateTime, nullable=True, default=datetime.utcnow, onupdate=datetime.utcnow
+    )
     subaddress = Column(String, unique=True, nullable=False)
     expiry_date = Column(DateTime, nullable=False)
 
@@ -91,21 +172,136 @@ class Payment(Base):
     def find_by_subaddress(subaddress: str):
         return Payment.query.filter_by(subaddress=subaddress).one_or_none()
 
+    @staticmethod
+    def find_by_subaddresses(subaddresses):
+        return Payment.query.filter(Payment.subaddress.in_(subaddresses)).all()
+
     @staticmethod
     def find_by_public_token(public_token: str):
         return Payment.query.filter_by(public_token=public_token).one_or_none()
 
+    @staticmethod
+    def list_for_merchant(
+        merchant_id: int,
+        limit: int,
+        after: Optional[Tuple[datetime, str]] = None,
+        status: Optional[str] = None,
+        created_from: Optional[datetime] = None,
+        created_to: Optional[datetime] = None,
+    ):
+        """
+        A page of the merchant's payments, newest first. Only the listed
+        columns are selected, so the eagerly loaded relationships stay out of
+        the query. Pages are keyed on (created_at, id): `after` is the key of
+        the last row of the previous page.
+        """
+        query = db_session.query(
+            Payment.id,
+            Payment.created_at,
+            Payment.status,
+            Payment.refund_requested,
+        ).filter(Payment.merchant_id == merchant_id)
+        if status is not None:
+            query = query.filter(Payment.status == status)
+        if created_from is not None:
+            query = query.filter(Payment.created_at >= created_from)
+        if created_to is not None:
+            query = query.filter(Payment.created_at < created_to)
+        if after is not None:
+            created_at, payment_id = after
+            query = query.filter(
+                or_(
+                    Payment.created_at < created_at,
+                    and_(Payment.created_at == created_at, Payment.id < payment_id),
+                )
+            )
+        return (
+            query.order_by(Payment.created_at.desc(), Payment.id.desc())
+            .limit(limit)
+            .all()
+        )
+
+    @staticmethod
+    def reject_expired(now: datetime, limit: int) -> int:
+        """
+        Reject up to `limit` created payments past their expiry date, with
+        one set-based statement for the status logs and one for the update.
+        The chunk is locked with SKIP LOCKED where supported, so concurrent
+        reapers pick disjoint chunks. Returns the number of rejected payments.
+        """
+        ids = [
+            row.id
+            for row in db_session.query(Payment.id)
+            .filter(Payment.status == PaymentStatus.created, Payment.expiry_date <= now)
+            .order_by(Payment.expiry_date)
+            .limit(limit)
+            .with_for_update(skip_locked=True)
+        ]
+        if not ids:
+            db_session.commit()
+            return 0
+
+        payment = Payment.__table__
+        stale = and_(payment.c.id.in_(ids), payment.c.status == PaymentStatus.created)
+        db_session.execute(
+            PaymentStatusLog.__table__.insert().from_select(
+                ["payment_id", "status", "created_at"],
+                select(
+                    [
+                        payment.c.id,
+                        literal(PaymentStatus.rejected.value),
+                        literal(now),
+                    ]
+                ).where(stale),
+            )
+        )
+        rejected = db_session.execute(
+            payment.update()
+            .where(stale)
+            .values(status=PaymentStatus.rejected, last_update=now)
+        ).rowcount
+        db_session.commit()
+        return rejected
+
     def is_expired(self):
         return self.expiry_date <= datetime.utcnow()
 
     def is_payment_option_valid(self, amount: int, currency: str):
-        return (
-            PaymentOption.query.filter_by(
-                payment_id=self.id, amount=amount, currency=currency
-            ).one_or_none()
-            is not None
+        return self.find_payment_option(amount, currency) is not None
+
+    def find_payment_option(
+        self,
+        amount: int,
+        currency: str,
+        underpay_bps: int = PAYMENT_UNDERPAY_TOLERANCE_BPS,
+        overpay_bps: int = PAYMENT_OVERPAY_TOLERANCE_BPS,
+    ):
+        """
+        The payment option matched by the amount, see match_payment_option.
+        Payment options are eagerly loaded with the payment, so this never
+        queries.
+        """
+        return match_payment_option(
+            self.payment_options, amount, currency, underpay_bps, overpay_bps
         )
 
+    @staticmethod
+    def clear_by_id(payment_id: str, chain_transaction) -> bool:
+        """
+        Mark a payment that is still created as cleared without loading it.
+        Returns False when the payment has moved on to another status.
+        """
+        updated = Payment.query.filter_by(
+            id=payment_id, status=PaymentStatus.created
+        ).update({Payment.status: PaymentStatus.cleared}, synchronize_session=False)
+        if not updated:
+            return False
+        db_session.add(
+            PaymentStatusLog(payment_id=payment_id, status=PaymentStatus.cleared)
+        )
+        db_session.add(chain_transaction)
+        return True
+
     def set_status(self, status: PaymentStatus):
         if (
             status in (PaymentStatus.refund_requested, PaymentStatus.payout_processing)
@@ -115,6 +311,11 @@ class Payment(Base):
         self.status = status
         status_log = PaymentStatusLog(payment_id=self.id, status=status)
         self.payment_status_logs.append(status_log)
+        # incremental exports pick up payments by last_update, child rows
+        # alone wouldn't bump it when the status is unchanged
+        self.last_update = datetime.utcnow()
+        if status != PaymentStatus.created:
+            payment_cache.evict(self.subaddress)
 
     def add_chain_transaction(
         self,
@@ -123,6 +324,7 @@ class Payment(Base):
         currency: int,
         tx_id: int,
         is_refund: bool = False,
+        commit: bool = True,
     ):
         self.chain_transactions.append(
             ChainTransaction(
@@ -134,12 +336,37 @@ class Payment(Base):
                 is_refund=is_refund,
             )
         )
-        db_session.commit()
+        self.last_update = datetime.utcnow()
+        if commit:
+            db_session.commit()
 
     def get_chain_transaction(self, tx_id: int):
         return ChainTransaction.query.filter_by(tx_id=tx_id).one_or_none()
 
 
+def match_payment_option(
+    payment_options,
+    amount: int,
+    currency: str,
+    underpay_bps: int = PAYMENT_UNDERPAY_TOLERANCE_BPS,
+    overpay_bps: int = PAYMENT_OVERPAY_TOLERANCE_BPS,
+):
+    """
+    The option out of `payment_options` matched by the amount, within the
+    given tolerances in basis points. Exact matches win, then the closest
+    amount.
+    """
+    candidates = [
+        option
+        for option in payment_options
+        if option.currency == currency
+        and option.amount * (10000 - underpay_bps)
+        <= amount * 10000
+        <= option.amount * (10000 + overpay_bps)
+    ]
+    return min(candidates, key=lambda option: abs(option.amount - amount), default=None)
+
+
 @event.listens_for(Payment, "after_insert")
 def set_initial_status(mapper, connect, target):
     target.set_status(target.status)
@@ -149,19 +376,19 @@ class ChainTransaction(Base):
     __tablename__ = "chain_transaction"
 
     id = Column(Integer, primary_key=True, autoincrement=True)
-    payment_id = Column(String, ForeignKey("payment.id"), nullable=False)
+    payment_id = Column(String, ForeignKey("payment.id"), index=True, nullable=False)
     sender_address = Column(String, nullable=False)
     amount = Column(BigInteger, nullable=False)
     currency = Column(String, nullable=False)
     is_refund = Column(Boolean, nullable=False, default=False)
-    tx_id = Column(Integer, nullable=False)  # version
+    tx_id = Column(Integer, index=True, nullable=False)  # version
 
 
 class PaymentOption(Base):
     __tablename__ = "payment_option"
 
     id = Column(Integer, primary_key=True, autoincrement=True)
-    payment_id = Column(String, ForeignKey("payment.id"), nullable=False)
+    payment_id = Column(String, ForeignKey("payment.id"), index=True, nullable=False)
     amount = Column(BigInteger, nullable=False)
     currency = Column(String, nullable=False)
 
@@ -170,6 +397,88 @@ class PaymentStatusLog(Base):
     __tablename__ = "payment_status_log"
 
     id = Column(Integer, primary_key=True, autoincrement=True)
-    payment_id = Column(String, ForeignKey("payment.id"), nullable=False)
+    payment_id = Column(String, ForeignKey("payment.id"), index=True, nullable=False)
     created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
     status = Column(String, nullable=False)
+
+
+class ErrantPaymentStatus(str, enum.Enum):
+    pending = "pending"
+    refunding = "refunding"
+    refunded = "refunded"
+    refund_error = "refund_error"
+
+
+class ErrantPayment(Base):
+    """Incoming funds that couldn't be matched to a payment, kept for refund"""
+
+    __tablename__ = "errant_payment"
+    __table_args__ = (Index("ix_errant_payment_status", "status"),)
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    tx_id = Column(BigInteger, unique=True, nullable=False)  # version
+    sender_address = Column(String, nullable=False)
+    sender_sub_address = Column(String, nullable=True)
+    amount = Column(BigInteger, nullable=False)
+    currency = Column(String, nullable=False)
+    reason = Column(String, nullable=False)
+    status = Column(String, nullable=False, default=ErrantPaymentStatus.pending)
+    refund_tx_id = Column(BigInteger, nullable=True)
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    last_update = Column(DateTime, nullable=True)
+
+    @staticmethod
+    def claim_pending(limit: int):
+        """
+        Move up to `limit` pending errant payments to refunding and return
+        them. Rows are locked with SKIP LOCKED, so concurrent jobs never
+        claim the same payment.
+        """
+        errant = (
+            ErrantPayment.query.filter_by(status=ErrantPaymentStatus.pending)
+            .order_by(ErrantPayment.id)
+            .limit(limit)
+            .with_for_update(skip_locked=True)
+            .all()
+        )
+        for errant_payment in errant:
+            errant_payment.set_status(ErrantPaymentStatus.refunding)
+        db_session.commit()
+        return errant
+
+    def set_status(self, status: ErrantPaymentStatus):
+        self.status = status
+        self.last_update = datetime.utcnow()
+
+
+class ProcessedEvent(Base):
+    """On-chain events the workers already handled, whatever the outcome"""
+
+    __tablename__ = "processed_event"
+
+    version = Column(BigInteger, primary_key=True, autoincrement=False)
+    sequence = Column(BigInteger, primary_key=True, autoincrement=False)
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+
+    @staticmethod
+    def is_processed(version: int, sequence: int) -> bool:
+        return ProcessedEvent.query.get((version, sequence)) is not None
+
+    @staticmethod
+    def find_processed(events) -> set:
+        """The (version, sequence) pairs out of `events` that were processed"""
+        events = set(events)
+        versions = {version for version, _ in events}
+        rows = ProcessedEvent.query.filter(ProcessedEvent.version.in_(versions))
+        return {(row.version, row.sequence) for row in rows} & events
+
+    @staticmethod
+    def mark(version: int, sequence: int) -> bool:
+        """Returns False when another worker already marked the event"""
+        db_session.add(ProcessedEvent(version=version, sequence=sequence))
+        try:
+            db_session.commit()
+        except IntegrityError:
+            db_session.rollback()
+            return False
+        return True
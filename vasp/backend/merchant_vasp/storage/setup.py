@@ -1,8 +1,18 @@
 # pyre-ignore-all-errors
 from . import db_session, engine, Base
-from .models import Merchant, PaymentStatus, Payment, PaymentOption
+from .cache import merchant_auth_cache, payment_cache
+from .models import (
+    Merchant,
+    PaymentStatus,
+    Payment,
+    PaymentOption,
+    ProcessedEvent,
+    ErrantPayment,
+    ErrantPaymentStatus,
+)
 
 
 def clear_db() -> None:
     Base.metadata.drop_all(bind=engine)
     Base.metadata.create_all(bind=engine)
+    merchant_auth_cache.clear()
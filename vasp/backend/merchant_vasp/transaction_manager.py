@@ -1,19 +1,31 @@
 # VASP imports
+import base64
+import binascii
 import logging
 import secrets
+from collections import defaultdict
 from datetime import datetime, timedelta
 
 from diem import utils, identifier
 from diem_utils.types.currencies import DiemCurrency
+from sqlalchemy.exc import IntegrityError
 
 from merchant_vasp import payment_service
-from merchant_vasp.config import PAYMENT_EXPIRE_MINUTES, CHAIN_HRP
+from merchant_vasp.config import (
+    PAYMENT_EXPIRE_MINUTES,
+    CHAIN_HRP,
+    PAYMENTS_PAGE_SIZE,
+    PAYMENTS_MAX_PAGE_SIZE,
+)
 from merchant_vasp.fiat_liquidity_wrapper import FiatLiquidityWrapper
 from merchant_vasp.onchainwallet import OnchainWallet
 from merchant_vasp.storage import (
+    ErrantPayment,
+    ErrantPaymentStatus,
     Payment,
     PaymentOption,
     db_session,
+    payment_cache,
 )
 from merchant_vasp.storage.models import PaymentStatus, Merchant
 
@@ -30,6 +42,11 @@ class TakenMerchantReferenceId(ValueError):
         pass
 
 
+class InvalidListArguments(ValueError):
+    def __init__(self, message):
+        self.message = message
+
+
 def create_payment(currency, merchant_reference_id, amount, merchant_id):
     existing_order = Payment.find_by_merchant_reference_id(
         merchant_id, merchant_reference_id
@@ -60,7 +77,13 @@ def create_payment(currency, merchant_reference_id, amount, merchant_id):
                 currency=quote_currency,
             )
         )
-    Payment.add_payment(new_payment)
+    try:
+        Payment.add_payment(new_payment)
+    except IntegrityError:
+        # lost a race on the unique merchant reference
+        db_session.rollback()
+        raise TakenMerchantReferenceId
+    payment_cache.put(new_payment)
     logger.debug(
         f"Adding new payment (id {new_payment.id}) to sub address {new_payment.subaddress}"
     )
@@ -95,7 +118,7 @@ def refund(payment):
     refund_tx_id = None
 
     try:
-        wallet = OnchainWallet()
+        wallet = OnchainWallet.shared()
 
         refund_tx_id, _ = wallet.send_transaction(
             refund_currency,
@@ -118,6 +141,53 @@ def refund(payment):
     return refund_tx_id, target_transaction
 
 
+def refund_errant_payments(limit: int) -> int:
+    """
+    Refund up to `limit` pending errant payments. Payments of the same sender
+    account and currency are refunded together with a single transfer, and
+    all transfers go out pipelined. Returns the number of refunded payments.
+    """
+    errant = ErrantPayment.claim_pending(limit)
+    if not errant:
+        return 0
+
+    groups = defaultdict(list)
+    for errant_payment in errant:
+        destination = (
+            errant_payment.currency,
+            errant_payment.sender_address,
+            errant_payment.sender_sub_address,
+        )
+        groups[destination].append(errant_payment)
+
+    try:
+        tx_ids = OnchainWallet.shared().send_transactions(
+            [
+                (DiemCurrency(currency), sum(p.amount for p in payments), address, sub)
+                for (currency, address, sub), payments in groups.items()
+            ]
+        )
+    except Exception:
+        # some transfers may have gone out, leave the claim for manual review
+        # rather than risking a second refund
+        for errant_payment in errant:
+            errant_payment.set_status(ErrantPaymentStatus.refund_error)
+        db_session.commit()
+        raise
+
+    refunded = 0
+    for payments, tx_id in zip(groups.values(), tx_ids):
+        for errant_payment in payments:
+            if tx_id is None:
+                errant_payment.set_status(ErrantPaymentStatus.refund_error)
+                continue
+            errant_payment.refund_tx_id = tx_id
+            errant_payment.set_status(ErrantPaymentStatus.refunded)
+            refunded += 1
+    db_session.commit()
+    return refunded
+
+
 def payout(merchant: Merchant, payment: Payment):
     if not payment_can_payout(payment):
         raise InvalidPaymentStatus("invalid_status")
@@ -154,7 +224,7 @@ def payout(merchant: Merchant, payment: Payment):
         merchant.settlement_information,
     )
     # 3. Pay according to quote to payout_target
-    tx_id, _ = OnchainWallet().send_transaction(
+    tx_id, _ = OnchainWallet.shared().send_transaction(
         DiemCurrency(client_payment.currency),
         client_payment.amount,
         liquidity_provider.vasp_address(),
@@ -177,21 +247,60 @@ def get_payment_events(payment):
 
 
 def get_merchant_full_addr(payment):
-    return identifier.encode_account(
-        OnchainWallet().address_str, payment.subaddress, CHAIN_HRP
+    return OnchainWallet.shared().encode_address(payment.subaddress)
+
+
+def get_merchant_payments(
+    merchant,
+    limit=PAYMENTS_PAGE_SIZE,
+    cursor=None,
+    status=None,
+    created_from=None,
+    created_to=None,
+):
+    """
+    A page of the merchant's payments, newest first, and the cursor of the
+    next page. The cursor is None on the last page.
+    """
+    if not 0 < limit <= PAYMENTS_MAX_PAGE_SIZE:
+        raise InvalidListArguments("invalid_limit")
+    if status is not None and status not in PaymentStatus.__members__:
+        raise InvalidListArguments("invalid_status")
+
+    rows = Payment.list_for_merchant(
+        merchant.id,
+        limit,
+        after=decode_payments_cursor(cursor) if cursor else None,
+        status=status,
+        created_from=created_from,
+        created_to=created_to,
     )
-
-
-def get_merchant_payments(merchant):
-    return [
+    payments = [
         {
-            "payment_id": payment.id,
-            "created_at": payment.created_at,
-            "status": payment.status,
-            "refund_requested": payment.refund_requested,
+            "payment_id": row.id,
+            "created_at": row.created_at,
+            "status": row.status,
+            "refund_requested": row.refund_requested,
         }
-        for payment in merchant.payments
+        for row in rows
     ]
+    next_cursor = encode_payments_cursor(rows[-1]) if len(rows) == limit else None
+    return payments, next_cursor
+
+
+def encode_payments_cursor(row):
+    key = f"{row.created_at.isoformat()}|{row.id}"
+    return base64.urlsafe_b64encode(key.encode()).decode()
+
+
+def decode_payments_cursor(cursor: str):
+    try:
+        created_at, payment_id = (
+            base64.urlsafe_b64decode(cursor.encode()).decode().split("|", 1)
+        )
+        return datetime.fromisoformat(created_at), payment_id
+    except (binascii.Error, UnicodeError, ValueError):
+        raise InvalidListArguments("invalid_cursor")
 
 
 def load_payment(payment_id: str):
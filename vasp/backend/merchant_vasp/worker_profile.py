@@ -0,0 +1,109 @@
+# Copyright (c) The Diem Core Contributors
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+Worker runtime profiles size the dramatiq processes, threads, prefetch and
+the DB pool of each process together. run_worker.sh evaluates the output of
+`python -m merchant_vasp.worker_profile` before starting dramatiq.
+
+The profile is picked with WORKER_PROFILE and each of its values can be
+overridden with WORKER_PROCESSES, WORKER_THREADS, WORKER_PREFETCH,
+WORKER_GEVENT, DB_POOL_SIZE and DB_MAX_OVERFLOW.
+"""
+
+import os
+import sys
+from typing import NamedTuple, Optional
+
+
+class WorkerProfile(NamedTuple):
+    processes: int
+    threads: int
+    # green threads instead of OS threads, for actors waiting on the LP and
+    # JSON-RPC rather than on the database
+    gevent: bool = False
+    # defaults to one connection per thread, so actors never wait on the pool
+    db_pool_size: Optional[int] = None
+    db_max_overflow: int = 2
+    # defaults to dramatiq's two messages per thread
+    prefetch: Optional[int] = None
+
+    @property
+    def pool_size(self) -> int:
+        return self.db_pool_size or self.threads
+
+    @property
+    def queue_prefetch(self) -> int:
+        return self.prefetch or self.threads * 2
+
+    def report(self) -> str:
+        kind = "greenlets" if self.gevent else "threads"
+        connections = (self.pool_size + self.db_max_overflow) * self.processes
+        return (
+            f"{self.processes} processes x {self.threads} {kind} = "
+            f"{self.processes * self.threads} concurrent actors, "
+            f"DB pool {self.pool_size}+{self.db_max_overflow} per process "
+            f"({connections} connections at most), "
+            f"prefetch {self.queue_prefetch} per process"
+        )
+
+
+PROFILES = {
+    "default": WorkerProfile(processes=2, threads=2),
+    "cpu": WorkerProfile(processes=os.cpu_count() or 2, threads=2),
+    "io": WorkerProfile(processes=2, threads=64, gevent=True, db_pool_size=16),
+}
+
+
+def load_profile() -> WorkerProfile:
+    name = os.getenv("WORKER_PROFILE", "default")
+    if name not in PROFILES:
+        raise ValueError(
+            f"unknown worker profile {name}, expected one of {list(PROFILES)}"
+        )
+
+    profile = PROFILES[name]
+    overrides = {
+        "processes": ("WORKER_PROCESSES", int),
+        "threads": ("WORKER_THREADS", int),
+        "prefetch": ("WORKER_PREFETCH", int),
+        "gevent": ("WORKER_GEVENT", lambda value: value == "1"),
+        "db_pool_size": ("DB_POOL_SIZE", int),
+        "db_max_overflow": ("DB_MAX_OVERFLOW", int),
+    }
+    return profile._replace(
+        **{
+            field: parse(os.environ[variable])
+            for field, (variable, parse) in overrides.items()
+            if os.getenv(variable)
+        }
+    )
+
+
+def main() -> None:
+    profile = load_profile()
+    if profile.gevent:
+        try:
+            import gevent  # noqa: F401
+        except ImportError:
+            print(
+                "gevent worker profile requires `pip install gevent`", file=sys.stderr
+            )
+            sys.exit(1)
+
+    print(f"worker profile: {profile.report()}", file=sys.stderr)
+    exports = {
+        "DRAMATIQ": "dramatiq-gevent" if profile.gevent else "dramatiq",
+        "WORKER_PROCESSES": profile.processes,
+        "WORKER_THREADS": profile.threads,
+        "WORKER_GEVENT": int(profile.gevent),
+        "DB_POOL_SIZE": profile.pool_size,
+        "DB_MAX_OVERFLOW": profile.db_max_overflow,
+        "dramatiq_queue_prefetch": profile.queue_prefetch,
+    }
+    for variable, value in exports.items():
+        print(f"export {variable}={value}")
+
+
+if __name__ == "__main__":
+    main()
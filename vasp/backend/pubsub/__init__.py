@@ -10,10 +10,28 @@ VASP_ADDR = os.getenv("VASP_ADDR")
 DEFL_CONFIG = {
     "diem_node_uri": JSON_RPC_URL,
     "sync_interval_ms": 1000,
+    "sync_workers": 4,
+    "resolve_workers": 16,
+    "fetch_batch_size": 10,
+    "adaptive_fetch": True,
+    "max_fetch_batch_size": 1000,
+    "max_drain_cycles": 100,
+    "batch_dispatch": True,
+    "processing_mode": "broker",
+    "in_process_workers": 4,
+    "backpressure": True,
+    "queue_name": "default",
+    "queue_high_water_mark": 10000,
+    "queue_low_water_mark": 2000,
+    "metrics_port": 9191,
     "progress_file_path": "/tmp/pubsub_progress",
     "accounts": [VASP_ADDR],
     "log_file": "/tmp/pubsub_log",
-    "progress_storage_type": "file",
+    "progress_storage_type": "log",
+    "progress_fsync_interval_ms": 1000,
+    "progress_compact_every": 1000,
+    "progress_lease_ttl_ms": 10000,
+    "checkpoint_interval_ms": 1000,
     "account_subscription_storage_type": "in_memory",
     "transaction_progress_storage_type": "in_memory",
     "transaction_progress_storage_config": {},
@@ -4,15 +4,44 @@
 import argparse
 import json
 import sys
+import time
 
-from pubsub import DEFL_CONFIG, VASP_ADDR
-from pubsub.client import LRWPubSubClient
+from pubsub import DEFL_CONFIG, VASP_ADDR, metrics
+from pubsub.client import LRWPubSubClient, DryRunProcessor
+
+
+def parse_range(value: str):
+    try:
+        start, end = (int(part) for part in value.split(":"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected FROM:TO, got {value}")
+    if not 0 <= start < end:
+        raise argparse.ArgumentTypeError(f"invalid sequence range {value}")
+    return start, end
 
 
 parser = argparse.ArgumentParser(
     description="Pubsub CLI tool. Takes in pubsub config file or VASP_ADDR environment variable"
 )
 parser.add_argument("-f", "--file", type=str, help="LRW pubsub config file path")
+parser.add_argument(
+    "--replay",
+    type=parse_range,
+    metavar="FROM:TO",
+    help="re-send events with sequence numbers FROM (inclusive) to TO (exclusive) "
+    "and exit. Workers process replayed events again even if already processed",
+)
+parser.add_argument(
+    "--event-key",
+    action="append",
+    dest="event_keys",
+    help="event key to replay, may be repeated. Defaults to the configured accounts",
+)
+parser.add_argument(
+    "--dry-run",
+    action="store_true",
+    help="log replayed events instead of sending them to the workers",
+)
 args = parser.parse_args()
 
 if args.file:
@@ -30,5 +59,28 @@ else:  # load in by env var
 
 print(conf)
 
+if args.dry_run:
+    conf = {
+        **conf,
+        "processor": DryRunProcessor(),
+        "batch_processor": DryRunProcessor(),
+    }
+
 client = LRWPubSubClient(conf)
+
+if args.replay:
+    start, end = args.replay
+    keys = args.event_keys or client.received_events_keys()
+    started_at = time.monotonic()
+    replayed = client.replay(keys, start, end)
+    elapsed = time.monotonic() - started_at
+    print(
+        f"Replayed {replayed} events in {elapsed:.2f}s "
+        f"({replayed / max(elapsed, 1e-9):.0f} events/s)"
+    )
+    sys.exit(0)
+
+if conf.get("metrics_port"):
+    metrics.serve(conf["metrics_port"])
+
 client.start()
@@ -0,0 +1,83 @@
+# Copyright (c) The Diem Core Contributors
+# SPDX-License-Identifier: Apache-2.0
+
+import enum
+import logging
+import time
+
+import dramatiq
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class ThrottleState(enum.IntEnum):
+    open = 0
+    slowed = 1
+    paused = 2
+
+
+class QueueDepthThrottle:
+    """
+    Watches the depth of the dramatiq queue the events are sent to.
+
+    Below `low_water_mark` the poller runs freely. Between the marks it is
+    slowed down to interval polling. Above `high_water_mark` it pauses until
+    the workers drained the queue back below `low_water_mark`.
+    """
+
+    def __init__(
+        self,
+        broker: dramatiq.Broker,
+        queue_name: str = "default",
+        high_water_mark: int = 10000,
+        low_water_mark: int = 2000,
+        poll_interval_ms: int = 1000,
+    ) -> None:
+        self.broker = broker
+        self.queue_name = queue_name
+        self.high_water_mark = high_water_mark
+        self.low_water_mark = low_water_mark
+        self.poll_interval_ms = poll_interval_ms
+        self.state = ThrottleState.open
+
+    def depth(self) -> int:
+        if hasattr(self.broker, "do_qsize"):
+            return self.broker.do_qsize(self.queue_name)
+        # StubBroker keeps plain in-memory queues
+        return self.broker.queues[self.queue_name].qsize()
+
+    def update(self) -> ThrottleState:
+        try:
+            depth = self.depth()
+        except Exception as e:
+            # fail open, a broker hiccup must not stop the poller
+            logger.warning(f"failed to read depth of queue {self.queue_name}: {e}")
+            self.state = ThrottleState.open
+            metrics.throttle_state.set(self.state)
+            return self.state
+        if depth >= self.high_water_mark:
+            state = ThrottleState.paused
+        elif self.state == ThrottleState.paused and depth >= self.low_water_mark:
+            state = ThrottleState.paused
+        elif depth >= self.low_water_mark:
+            state = ThrottleState.slowed
+        else:
+            state = ThrottleState.open
+
+        if state != self.state:
+            logger.warning(
+                f"queue {self.queue_name} holds {depth} messages, "
+                f"throttle {self.state.name} -> {state.name}"
+            )
+        self.state = state
+        metrics.queue_depth.labels(self.queue_name).set(depth)
+        metrics.throttle_state.set(state)
+        return state
+
+    def wait(self) -> ThrottleState:
+        """Blocks while paused, returns the state polling resumes with"""
+        while self.update() == ThrottleState.paused:
+            time.sleep(self.poll_interval_ms / 1000)
+        return self.state
@@ -3,33 +3,38 @@
 # Copyright (c) The Diem Core Contributors
 # SPDX-License-Identifier: Apache-2.0
 
-import json
 import logging
+import threading
 import time
-from typing import Any, Dict, Optional
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Dict, List, Optional
 
+import dramatiq
+import requests
 from diem import jsonrpc
 
-from merchant_vasp.background_tasks import process_incoming_txn
+from merchant_vasp.background_tasks import process_incoming_txn, process_incoming_txns
+from . import metrics
+from .backpressure import QueueDepthThrottle, ThrottleState
+from .progress import EventKeyCache, make_progress_storage
 from .types import LRWPubSubEvent
 
 logger = logging.getLogger(__name__)
 
 
-class FileProgressStorage:
-    def __init__(self, path: str) -> None:
-        self.path = path
+class DryRunProcessor:
+    """
+    Stands in for the dramatiq actors, only logging what would be sent, or
+    processed in process through `fn`
+    """
 
-    def fetch_state(self) -> Dict[str, int]:
-        try:
-            with open(self.path, "r") as file:
-                return json.loads(file.read())
-        except (FileNotFoundError, json.JSONDecodeError):
-            return {}
+    def send(self, event: Any, **kwargs: Any) -> None:
+        self.fn(event, **kwargs)
 
-    def save_state(self, state: Dict[str, int]) -> None:
-        with open(self.path, "w") as file:
-            file.write(json.dumps(state))
+    def fn(self, event: Any, **kwargs: Any) -> None:
+        events = event if isinstance(event, list) else [event]
+        for lrw_event in events:
+            logger.info(f"DRY RUN: {lrw_event}")
 
 
 class LRWPubSubClient:
@@ -39,53 +44,362 @@ class LRWPubSubClient:
 
         self.diem_node_uri = config["diem_node_uri"]
         self.progress_file_path = config["progress_file_path"]
-        self.fetch_batch_size = 10
+        self.fetch_batch_size = config.get("fetch_batch_size", 10)
+        # Adaptive fetching grows a key's page size while full pages keep coming
+        # back, and drains without sleeping until every key is caught up
+        self.adaptive_fetch = config.get("adaptive_fetch", False)
+        self.max_fetch_batch_size = config.get(
+            "max_fetch_batch_size", self.fetch_batch_size
+        )
+        self.max_drain_cycles = config.get("max_drain_cycles", 1)
+        self.sync_workers = config.get("sync_workers", 1)
         self.processor = config.get("processor", process_incoming_txn)
+        # Batch dispatch sends every fetched page as a single broker message
+        self.batch_dispatch = config.get("batch_dispatch", False)
+        self.batch_processor = config.get("batch_processor", process_incoming_txns)
+        # In-process mode runs the processor function on a local pool instead
+        # of going through the broker. Pages are checkpointed only once all of
+        # their events were processed, so delivery stays at-least-once.
+        self.in_process = config.get("processing_mode", "broker") == "in_process"
+        self.process_pool = (
+            ThreadPoolExecutor(max_workers=config.get("in_process_workers", 4))
+            if self.in_process
+            else None
+        )
 
         logger.info(f"Loaded LRWPubSubClient with config: {config}")
 
-        self.client = jsonrpc.Client(self.diem_node_uri)
-        self.progress = FileProgressStorage(self.progress_file_path)
+        # jsonrpc.Client serializes its calls and rejects responses older than
+        # the last one it saw, so each thread gets its own client. They all
+        # share the pooled connections of one HTTP session.
+        self.session = requests.Session()
+        pool_size = max(self.sync_workers, config.get("resolve_workers", 1))
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=pool_size, pool_maxsize=pool_size
+        )
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self._thread_clients = threading.local()
+        self._client: Optional[jsonrpc.Client] = None
+        self.progress = make_progress_storage(config)
+        self.event_key_cache = EventKeyCache(f"{self.progress_file_path}.accounts")
+        self.resolve_workers = config.get("resolve_workers", 1)
+        self.executor = ThreadPoolExecutor(max_workers=self.sync_workers)
+        # Backpressure holds off fetching while the workers lag behind on the
+        # broker queue. In-process processing has no queue to watch.
+        self.throttle = (
+            QueueDepthThrottle(
+                config.get("broker", None) or dramatiq.get_broker(),
+                queue_name=config.get("queue_name", "default"),
+                high_water_mark=config.get("queue_high_water_mark", 10000),
+                low_water_mark=config.get("queue_low_water_mark", 2000),
+                poll_interval_ms=self.sync_interval_ms,
+            )
+            if config.get("backpressure", False) and not self.in_process
+            else None
+        )
+        # Ledger versions between the newest fetched event of a key and the
+        # node's current version. 0 means the key is caught up.
+        self.lag: Dict[str, int] = {}
+        self.batch_sizes: Dict[str, int] = {}
+        self.event_keys: List[str] = []
+        self._revalidate_event_keys = False
+        # The workers skip events they already processed, so checkpoints may
+        # be taken lazily: at most every checkpoint_interval_ms per key, and
+        # on shutdown. Deferred checkpoints of idle keys are saved once their
+        # interval elapsed. A crash replays the events since the last one.
+        self.checkpoint_interval_ms = config.get("checkpoint_interval_ms", 0)
+        self._uncheckpointed: Dict[str, int] = {}
+        self._last_checkpoint: Dict[str, float] = {}
 
     def start(self) -> None:
-        sync_state = self.init_progress_state()
-        while True:
-            sync_state = self.sync(sync_state, catch_error=True)
-            time.sleep(self.sync_interval_ms / 1000)
+        self.event_keys = list(self.init_progress_state())
+        if self._revalidate_event_keys:
+            threading.Thread(
+                target=self.revalidate_event_keys,
+                name="revalidate-event-keys",
+                daemon=True,
+            ).start()
+        sync_state: Dict[str, int] = {}
+        drain_cycles = 0
+        try:
+            while True:
+                throttle_state = self.throttle.wait() if self.throttle else None
+                try:
+                    sync_state = self.claim_event_keys(sync_state)
+                except Exception as exc:
+                    # keep syncing the keys we had, retry on the next cycle
+                    logger.exception(f"failed to claim event keys: {exc}")
+                sync_state = self.sync(sync_state, catch_error=True)
+                self.checkpoint_due()
+                drain_cycles += 1
+                if (
+                    self.adaptive_fetch
+                    and throttle_state != ThrottleState.slowed
+                    and not self.is_caught_up()
+                    and drain_cycles < self.max_drain_cycles
+                ):
+                    continue
+                drain_cycles = 0
+                time.sleep(self.sync_interval_ms / 1000)
+        finally:
+            self.checkpoint_pending()
+            self.progress.flush()
+            self.progress.release_leases()
+
+    def claim_event_keys(self, state: Dict[str, int]) -> Dict[str, int]:
+        """
+        Renew the leases of the event keys this replica syncs and pick up
+        unowned ones. Progress of newly claimed keys is reloaded from the
+        storage, since another replica may have advanced them.
+        """
+        owned = self.progress.acquire_leases(self.event_keys)
+        if set(owned) == set(state):
+            return state
+
+        logger.info(f"now syncing event keys {owned}")
+        for key in set(self.lag) - set(owned):
+            del self.lag[key]
+            metrics.sync_lag.remove(key)
+        stored = self.progress.fetch_state()
+        return {
+            key: state[key] if key in state else stored.get(key, 0) for key in owned
+        }
+
+    def is_caught_up(self) -> bool:
+        return all(lag == 0 for lag in self.lag.values())
 
     def sync(
-            self, state: Dict[str, int], catch_error: Optional[bool] = False
+        self, state: Dict[str, int], catch_error: Optional[bool] = False
     ) -> Dict[str, int]:
+        """
+        Poll every event key concurrently, at most `sync_workers` at a time.
+        Events of a single key are always handled in order by one worker,
+        and each key is checkpointed as soon as its page was processed.
+        """
         after_sync_state = state.copy()
-        for key in state:
+        futures = {
+            self.executor.submit(self.sync_key, key, sequence_num): key
+            for key, sequence_num in state.items()
+        }
+        for future in as_completed(futures):
+            key = futures[future]
             try:
-                sequence_num = state[key]
-                events = self.client.get_events(
-                    key, sequence_num, self.fetch_batch_size
-                )
-                for event in events:
-                    lrw_event = LRWPubSubEvent.from_jsonrpc_event(event)
-                    self.processor.send(lrw_event)
-                    logger.info(f"SUCCESS: sent to wallet onchain {lrw_event}")
-
-                after_sync_state[key] = sequence_num + len(events)
+                after_sync_state[key] = future.result()
             except Exception as exc:
                 logger.exception(f"failed to perform sync for event key {key}: {exc}")
                 if not catch_error:
                     raise exc
 
-        self.progress.save_state(after_sync_state)
-        logger.info(f"processed next chunk. New state is {after_sync_state}")
+        logger.info(
+            f"processed next chunk. New state is {after_sync_state}, lag is {self.lag}"
+        )
 
         return after_sync_state
 
-    def init_progress_state(self) -> Dict[str, int]:
-        state = self.progress.fetch_state()
-        for address in self.accounts:
-            account = self.client.get_account(address)
+    @property
+    def client(self) -> jsonrpc.Client:
+        """The JSON-RPC client of the calling thread, unless one was assigned"""
+        if self._client is not None:
+            return self._client
+        client = getattr(self._thread_clients, "client", None)
+        if client is None:
+            client = jsonrpc.Client(self.diem_node_uri, session=self.session)
+            self._thread_clients.client = client
+        return client
+
+    @client.setter
+    def client(self, client: jsonrpc.Client) -> None:
+        self._client = client
+
+    def get_events(self, key: str, start: int, limit: int) -> List[Any]:
+        return self.client.get_events(key, start, limit)
+
+    def get_account(self, address: str) -> Optional[Any]:
+        return self.client.get_account(address)
+
+    def sync_key(self, key: str, sequence_num: int) -> int:
+        batch_size = self.batch_sizes.get(key, self.fetch_batch_size)
+        with metrics.fetch_latency.labels(key).time():
+            events = self.client.get_events(key, sequence_num, batch_size)
+        metrics.events_fetched.labels(key).inc(len(events))
+        with metrics.dispatch_latency.time():
+            self.dispatch(
+                [LRWPubSubEvent.from_jsonrpc_event(event) for event in events]
+            )
+
+        next_sequence_num = sequence_num + len(events)
+        if events:
+            self.checkpoint(key, next_sequence_num)
+        self.lag[key] = self._lag(events, batch_size)
+        metrics.sync_lag.labels(key).set(self.lag[key])
+        self.batch_sizes[key] = self._next_batch_size(len(events), batch_size)
+
+        return next_sequence_num
+
+    def checkpoint(self, key: str, sequence_num: int) -> None:
+        now = time.monotonic()
+        elapsed_ms = (now - self._last_checkpoint.get(key, 0)) * 1000
+        if elapsed_ms < self.checkpoint_interval_ms:
+            self._uncheckpointed[key] = sequence_num
+            return
+
+        with metrics.checkpoint_duration.time():
+            self.progress.save_key_state(key, sequence_num)
+        self._last_checkpoint[key] = now
+        self._uncheckpointed.pop(key, None)
+
+    def checkpoint_due(self) -> None:
+        """Save the deferred checkpoints whose interval elapsed"""
+        now = time.monotonic()
+        for key, sequence_num in list(self._uncheckpointed.items()):
+            elapsed_ms = (now - self._last_checkpoint.get(key, 0)) * 1000
+            if elapsed_ms < self.checkpoint_interval_ms:
+                continue
+            try:
+                self.checkpoint(key, sequence_num)
+            except Exception as exc:
+                logger.exception(f"failed to checkpoint event key {key}: {exc}")
+
+    def checkpoint_pending(self) -> None:
+        for key, sequence_num in list(self._uncheckpointed.items()):
+            try:
+                self.progress.save_key_state(key, sequence_num)
+            except Exception as exc:
+                logger.exception(f"failed to checkpoint event key {key}: {exc}")
+        self._uncheckpointed.clear()
+
+    def dispatch(
+        self, lrw_events: List[LRWPubSubEvent], reprocess: bool = False
+    ) -> None:
+        """
+        `reprocess` makes the workers process events again even if they
+        already did, see background._process_incoming_txn
+        """
+        if not lrw_events:
+            return
+        kwargs = {"reprocess": True} if reprocess else {}
+
+        if self.process_pool is not None:
+            futures = [
+                self.process_pool.submit(self.processor.fn, lrw_event, **kwargs)
+                for lrw_event in lrw_events
+            ]
+            for future in futures:
+                future.result()
+            logger.info(f"SUCCESS: processed {len(lrw_events)} events in process")
+            return
+
+        if self.batch_dispatch:
+            self.batch_processor.send(lrw_events, **kwargs)
+            logger.info(f"SUCCESS: sent {len(lrw_events)} events to wallet onchain")
+            return
+
+        for lrw_event in lrw_events:
+            self.processor.send(lrw_event, **kwargs)
+            logger.info(f"SUCCESS: sent to wallet onchain {lrw_event}")
+
+    def _next_batch_size(self, fetched: int, batch_size: int) -> int:
+        if not self.adaptive_fetch:
+            return self.fetch_batch_size
+        if fetched < batch_size:
+            return self.fetch_batch_size
+        return min(batch_size * 2, self.max_fetch_batch_size)
+
+    def _lag(self, events: Any, batch_size: int) -> int:
+        if len(events) < batch_size:
+            return 0
+        ledger_version = self.client.get_last_known_state().version
+        return max(ledger_version - events[-1].transaction_version, 0)
+
+    def replay(self, keys: List[str], start: int, end: int) -> int:
+        """
+        Re-send the events with sequence numbers in [start, end) of the given
+        event keys to the processor, leaving the stored progress untouched.
+        Replayed events are flagged to be processed again, even though the
+        workers recorded them as processed.
+        Pages are fetched in parallel and dispatched in order as they arrive.
+        Returns the number of replayed events.
+        """
+        page_size = self.max_fetch_batch_size
+        window = self.sync_workers * 2
+        replayed = 0
+        for key in keys:
+            next_start = start
+            while next_start < end:
+                if self.throttle:
+                    self.throttle.wait()
+                page_starts = range(next_start, end, page_size)[:window]
+                futures = [
+                    self.executor.submit(
+                        self.get_events,
+                        key,
+                        page_start,
+                        min(page_size, end - page_start),
+                    )
+                    for page_start in page_starts
+                ]
+                exhausted = False
+                for page_start, future in zip(page_starts, futures):
+                    events = future.result()
+                    self.dispatch(
+                        [LRWPubSubEvent.from_jsonrpc_event(event) for event in events],
+                        reprocess=True,
+                    )
+                    replayed += len(events)
+                    if len(events) < min(page_size, end - page_start):
+                        # reached the end of the stream, later pages are empty
+                        exhausted = True
+                        break
+                if exhausted:
+                    break
+                next_start = page_starts[-1] + page_size
+            logger.info(f"replayed event key {key} from {start} to {end}")
+        return replayed
+
+    def received_events_keys(self) -> List[str]:
+        """
+        Event keys of the configured accounts. When every account is in the
+        event key cache, the cached keys are used right away and the mapping
+        is revalidated against the node in the background.
+        """
+        cached = self.event_key_cache.load()
+        if not all(address in cached for address in self.accounts):
+            return list(self.resolve_event_keys().values())
+
+        self._revalidate_event_keys = True
+        return [cached[address] for address in self.accounts]
+
+    def resolve_event_keys(self) -> Dict[str, str]:
+        """Look up the accounts concurrently and refresh the event key cache"""
+        with ThreadPoolExecutor(max_workers=self.resolve_workers) as pool:
+            accounts = list(
+                zip(self.accounts, pool.map(self.get_account, self.accounts))
+            )
+
+        event_keys = {}
+        for address, account in accounts:
             if account is None:
                 logger.error(f"account not found: {address}")
                 continue
-            if account.received_events_key not in state:
-                state[account.received_events_key] = 0
+            event_keys[address] = account.received_events_key
+        self.event_key_cache.save(event_keys)
+        return event_keys
+
+    def revalidate_event_keys(self) -> None:
+        try:
+            event_keys = list(self.resolve_event_keys().values())
+        except Exception as exc:
+            logger.exception(f"failed to revalidate event keys: {exc}")
+            return
+        new_keys = [key for key in event_keys if key not in self.event_keys]
+        if new_keys:
+            logger.warning(f"accounts resolved to new event keys {new_keys}")
+            self.event_keys = self.event_keys + new_keys
+
+    def init_progress_state(self) -> Dict[str, int]:
+        state = self.progress.fetch_state()
+        for key in self.received_events_keys():
+            if key not in state:
+                state[key] = 0
         return state
@@ -0,0 +1,39 @@
+# Copyright (c) The Diem Core Contributors
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+Prometheus metrics of the pubsub process, served by `serve` on a text
+endpoint when `metrics_port` is configured.
+"""
+
+from prometheus_client import Counter, Gauge, Histogram, start_http_server
+
+queue_depth = Gauge(
+    "pubsub_broker_queue_depth", "Messages waiting in the dramatiq queue", ["queue"]
+)
+throttle_state = Gauge(
+    "pubsub_throttle_state",
+    "Backpressure state of the poller: 0 open, 1 slowed down, 2 paused",
+)
+events_fetched = Counter(
+    "pubsub_events_fetched", "Events fetched from the node", ["event_key"]
+)
+fetch_latency = Histogram(
+    "pubsub_fetch_latency_seconds", "Duration of get_events calls", ["event_key"]
+)
+dispatch_latency = Histogram(
+    "pubsub_dispatch_latency_seconds",
+    "Time to hand a fetched page over to the processor",
+)
+checkpoint_duration = Histogram(
+    "pubsub_checkpoint_duration_seconds", "Duration of progress checkpoints"
+)
+sync_lag = Gauge(
+    "pubsub_sync_lag_versions",
+    "Ledger versions between the newest fetched event and the node's version",
+    ["event_key"],
+)
+
+
+def serve(port: int) -> None:
+    start_http_server(port)
@@ -0,0 +1,387 @@
+# pyre-strict
+
+# Copyright (c) The Diem Core Contributors
+# SPDX-License-Identifier: Apache-2.0
+
+"""
+Progress storages keep the next event sequence number to fetch per event key.
+"""
+
+import json
+import logging
+import math
+import os
+import socket
+import threading
+import time
+import uuid
+from typing import Any, Dict, List, Tuple
+
+import redis
+
+from merchant_vasp.config import REDIS_HOST, REDIS_PORT, REDIS_PASSWORD
+
+logger = logging.getLogger(__name__)
+
+
+def _atomic_write(path: str, content: str) -> None:
+    """Write to a temp file, fsync it and rename it over the target"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as file:
+        file.write(content)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(tmp_path, path)
+    # make the rename itself durable
+    dir_fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    try:
+        os.fsync(dir_fd)
+    finally:
+        os.close(dir_fd)
+
+
+class EventKeyCache:
+    """
+    Maps account addresses to their received events keys, persisted next to
+    the progress state so restarts can skip resolving them on the node.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+
+    def load(self) -> Dict[str, str]:
+        try:
+            with open(self.path, "r") as file:
+                return json.loads(file.read())
+        except FileNotFoundError:
+            return {}
+        except json.JSONDecodeError:
+            logger.error(f"corrupted event key cache {self.path}, ignoring it")
+            return {}
+
+    def save(self, event_keys: Dict[str, str]) -> None:
+        _atomic_write(self.path, json.dumps(event_keys))
+
+
+class FileProgressStorage:
+    """Keeps the whole progress map in a single JSON file, rewritten atomically"""
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._state: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def fetch_state(self) -> Dict[str, int]:
+        self._state = self._read_snapshot()
+        return self._state.copy()
+
+    def save_state(self, state: Dict[str, int]) -> None:
+        with self._lock:
+            self._state = state.copy()
+            self._write()
+
+    def save_key_state(self, key: str, sequence_num: int) -> None:
+        """Checkpoint a single event key, keeping the others untouched"""
+        with self._lock:
+            self._state[key] = sequence_num
+            self._write()
+
+    def flush(self) -> None:
+        pass
+
+    def acquire_leases(self, keys: List[str]) -> List[str]:
+        """A local file has a single owner, which always holds every key"""
+        return list(keys)
+
+    def release_leases(self) -> None:
+        pass
+
+    def _read_snapshot(self) -> Dict[str, int]:
+        try:
+            with open(self.path, "r") as file:
+                return json.loads(file.read())
+        except FileNotFoundError:
+            return {}
+        except json.JSONDecodeError:
+            logger.error(f"corrupted progress file {self.path}, starting over")
+            return {}
+
+    def _write(self) -> None:
+        _atomic_write(self.path, json.dumps(self._state))
+
+
+class CorruptProgressLogError(Exception):
+    pass
+
+
+class LogProgressStorage(FileProgressStorage):
+    """
+    Appends every key checkpoint to `<path>.log` instead of rewriting the
+    whole map. The log is folded into the JSON snapshot at `path` once it
+    holds `compact_every` entries.
+
+    With `fsync_interval_ms` 0 every checkpoint is fsynced. Otherwise fsyncs
+    are coalesced: a timer fsyncs the writes at most that interval after the
+    first unsynced one, even if no checkpoint follows. An OS crash may thus
+    lose up to that interval of progress (events are then replayed), while a
+    process crash loses nothing.
+
+    Only a torn final entry is tolerated when replaying the log, an
+    undecodable entry followed by others raises CorruptProgressLogError.
+    """
+
+    def __init__(
+        self, path: str, fsync_interval_ms: int = 0, compact_every: int = 1000
+    ) -> None:
+        super().__init__(path)
+        self.log_path = f"{path}.log"
+        self.fsync_interval_ms = fsync_interval_ms
+        self.compact_every = compact_every
+        self._log_entries = 0
+        self._last_fsync = time.monotonic()
+        self._dirty = False
+        self._fsync_timer = None
+        self._log = None
+
+    def fetch_state(self) -> Dict[str, int]:
+        with self._lock:
+            self._state = self._read_snapshot()
+            self._log_entries, torn = self._replay_log()
+            if torn:
+                # entries appended after the torn bytes would be glued to
+                # them and lost on the next replay, fold the log instead
+                self._compact()
+            else:
+                self._open_log()
+        return self._state.copy()
+
+    def save_state(self, state: Dict[str, int]) -> None:
+        with self._lock:
+            self._state = state.copy()
+            self._compact()
+
+    def save_key_state(self, key: str, sequence_num: int) -> None:
+        with self._lock:
+            self._state[key] = sequence_num
+            if self._log_entries >= self.compact_every:
+                self._compact()
+                return
+
+            self._open_log()
+            self._log.write(json.dumps([key, sequence_num]) + "\n")
+            self._log.flush()
+            self._log_entries += 1
+            self._dirty = True
+
+            elapsed_ms = (time.monotonic() - self._last_fsync) * 1000
+            if elapsed_ms >= self.fsync_interval_ms:
+                self._fsync()
+            elif self._fsync_timer is None:
+                self._fsync_timer = threading.Timer(
+                    (self.fsync_interval_ms - elapsed_ms) / 1000, self._fsync_due
+                )
+                self._fsync_timer.daemon = True
+                self._fsync_timer.start()
+
+    def flush(self) -> None:
+        with self._lock:
+            if self._dirty:
+                self._fsync()
+
+    def _replay_log(self) -> Tuple[int, bool]:
+        """Returns the number of replayed entries and whether the log is torn"""
+        try:
+            with open(self.log_path, "r") as file:
+                lines = file.readlines()
+        except FileNotFoundError:
+            return 0, False
+
+        for number, line in enumerate(lines, start=1):
+            try:
+                key, sequence_num = json.loads(line)
+            except (TypeError, ValueError):
+                if number < len(lines):
+                    raise CorruptProgressLogError(
+                        f"undecodable entry on line {number} of {self.log_path}: "
+                        f"{line!r}"
+                    )
+                # torn write of the last entry, everything before it is intact
+                logger.warning(f"ignoring partial progress log entry {line!r}")
+                return number - 1, True
+            self._state[key] = sequence_num
+        # an intact last entry missing its newline would be glued to the next one
+        return len(lines), bool(lines) and not lines[-1].endswith("\n")
+
+    def _open_log(self) -> None:
+        if self._log is None:
+            self._log = open(self.log_path, "a")
+
+    def _fsync_due(self) -> None:
+        with self._lock:
+            self._fsync_timer = None
+            if self._dirty:
+                self._fsync()
+
+    def _fsync(self) -> None:
+        os.fsync(self._log.fileno())
+        self._last_fsync = time.monotonic()
+        self._dirty = False
+
+    def _compact(self) -> None:
+        _atomic_write(self.path, json.dumps(self._state))
+        if self._log is not None:
+            self._log.close()
+        # the snapshot already holds every logged entry, start a fresh log
+        self._log = open(self.log_path, "w")
+        self._log_entries = 0
+        self._dirty = False
+
+
+class LeaseLostError(Exception):
+    pass
+
+
+# Renew the lease when we own it, or take it when nobody does
+_ACQUIRE_LEASE = """
+local owner = redis.call("GET", KEYS[1])
+if owner == ARGV[1] then
+    return redis.call("PEXPIRE", KEYS[1], ARGV[2])
+end
+if not owner then
+    return redis.call("SET", KEYS[1], ARGV[1], "PX", ARGV[2]) and 1 or 0
+end
+return 0
+"""
+
+# Checkpoint only while holding the lease, so a replica that stalled past
+# its lease can't move a key backwards under the new owner
+_SAVE_IF_OWNER = """
+if redis.call("GET", KEYS[1]) ~= ARGV[1] then
+    return 0
+end
+redis.call("HSET", KEYS[2], ARGV[2], ARGV[3])
+return 1
+"""
+
+_RELEASE_LEASE = """
+if redis.call("GET", KEYS[1]) == ARGV[1] then
+    return redis.call("DEL", KEYS[1])
+end
+return 0
+"""
+
+
+class RedisProgressStorage:
+    """
+    Shares progress between pubsub replicas through Redis.
+
+    Every event key is guarded by a lease that its owner renews on each sync
+    cycle. Replicas announce themselves with a heartbeat and each claims at
+    most its fair share of the keys, so keys are split between live replicas
+    and the keys of a dead replica are picked up once its leases expire.
+    """
+
+    def __init__(
+        self,
+        client: redis.StrictRedis,
+        namespace: str = "lrm:pubsub",
+        lease_ttl_ms: int = 10000,
+        replica_id: str = "",
+    ) -> None:
+        self.redis = client
+        self.lease_ttl_ms = lease_ttl_ms
+        self.replica_id = (
+            replica_id or f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        )
+        self.progress_key = f"{namespace}:progress"
+        self.replicas_key = f"{namespace}:replicas"
+        self.lease_prefix = f"{namespace}:lease:"
+        self._owned: List[str] = []
+
+        self._acquire = self.redis.register_script(_ACQUIRE_LEASE)
+        self._save_if_owner = self.redis.register_script(_SAVE_IF_OWNER)
+        self._release = self.redis.register_script(_RELEASE_LEASE)
+
+    def fetch_state(self) -> Dict[str, int]:
+        return {
+            key.decode(): int(sequence_num)
+            for key, sequence_num in self.redis.hgetall(self.progress_key).items()
+        }
+
+    def save_state(self, state: Dict[str, int]) -> None:
+        for key, sequence_num in state.items():
+            self.save_key_state(key, sequence_num)
+
+    def save_key_state(self, key: str, sequence_num: int) -> None:
+        saved = self._save_if_owner(
+            keys=[self._lease_key(key), self.progress_key],
+            args=[self.replica_id, key, sequence_num],
+        )
+        if not saved:
+            raise LeaseLostError(
+                f"lease for event key {key} is held by another replica"
+            )
+
+    def flush(self) -> None:
+        pass
+
+    def acquire_leases(self, keys: List[str]) -> List[str]:
+        now_ms = int(time.time() * 1000)
+        pipe = self.redis.pipeline()
+        pipe.zadd(self.replicas_key, {self.replica_id: now_ms})
+        pipe.zremrangebyscore(self.replicas_key, 0, now_ms - self.lease_ttl_ms)
+        pipe.zcard(self.replicas_key)
+        replicas = pipe.execute()[-1]
+        fair_share = math.ceil(len(keys) / max(replicas, 1))
+
+        # Renew what we already own first, then try to take unowned keys.
+        # Keys beyond the fair share are handed back to the other replicas.
+        owned = []
+        candidates = [key for key in self._owned if key in keys]
+        candidates += [key for key in keys if key not in candidates]
+        for key in candidates:
+            if len(owned) >= fair_share:
+                if key in self._owned:
+                    self._release(keys=[self._lease_key(key)], args=[self.replica_id])
+                continue
+            if self._acquire(
+                keys=[self._lease_key(key)],
+                args=[self.replica_id, self.lease_ttl_ms],
+            ):
+                owned.append(key)
+
+        self._owned = owned
+        return owned
+
+    def release_leases(self) -> None:
+        for key in self._owned:
+            self._release(keys=[self._lease_key(key)], args=[self.replica_id])
+        self.redis.zrem(self.replicas_key, self.replica_id)
+        self._owned = []
+
+    def _lease_key(self, key: str) -> str:
+        return f"{self.lease_prefix}{key}"
+
+
+def make_progress_storage(config: Dict[str, Any]) -> Any:
+    storage_type = config.get("progress_storage_type", "file")
+
+    if storage_type == "file":
+        return FileProgressStorage(config["progress_file_path"])
+    if storage_type == "log":
+        return LogProgressStorage(
+            config["progress_file_path"],
+            fsync_interval_ms=config.get("progress_fsync_interval_ms", 0),
+            compact_every=config.get("progress_compact_every", 1000),
+        )
+    if storage_type == "redis":
+        client = redis.StrictRedis(
+            host=REDIS_HOST, port=REDIS_PORT, db=0, password=REDIS_PASSWORD
+        )
+        return RedisProgressStorage(
+            client,
+            lease_ttl_ms=config.get("progress_lease_ttl_ms", 10000),
+            replica_id=config.get("replica_id", ""),
+        )
+
+    raise ValueError(f"Unknown progress_storage_type {storage_type}")
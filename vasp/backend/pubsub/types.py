@@ -3,10 +3,34 @@
 # Copyright (c) The Diem Core Contributors
 # SPDX-License-Identifier: Apache-2.0
 
+import struct
+from typing import Optional, Tuple
+
 from diem import diem_types, jsonrpc
 
+# Wire record, version 1:
+#   version (u8) | sender (16 bytes) | receiver (16 bytes) | amount (u64)
+#   | tx version (u64) | sequence (u64) | currency length (u8) | currency
+#   | metadata length (u32) | raw metadata
+WIRE_FORMAT_VERSION = 1
+_WIRE_HEADER = struct.Struct(">B16s16sQQQB")
+_WIRE_METADATA_LEN = struct.Struct(">I")
+
 
 class LRWPubSubEvent:
+    # Backfills hold many events at once, skip the per-instance __dict__
+    __slots__ = (
+        "sender",
+        "receiver",
+        "amount",
+        "currency",
+        "version",
+        "sequence",
+        "raw_metadata",
+        "_metadata",
+        "_subaddresses",
+    )
+
     def __init__(
         self,
         sender: str,
@@ -23,14 +47,55 @@ class LRWPubSubEvent:
         self.currency = currency
         self.version = version
         self.sequence = sequence
+        self.raw_metadata = metadata
+        self._metadata = None
+        self._subaddresses = None
+
+    @property
+    def metadata(self) -> diem_types.Metadata:
+        """Deserialized on first access, so it's paid by the worker, not pubsub"""
+        if self._metadata is None:
+            # The metadata deserializer is totally a prickly drama queen
+            # It breaks on data directly from the blockchain without saying much
+            self._metadata = diem_types.Metadata__Undefined()
+            try:
+                self._metadata = diem_types.Metadata.bcs_deserialize(self.raw_metadata)
+            except:
+                pass
+        return self._metadata
+
+    @property
+    def sender_sub_address(self) -> Optional[str]:
+        return self._general_metadata_subaddresses()[0]
+
+    @property
+    def receiver_sub_address(self) -> Optional[str]:
+        return self._general_metadata_subaddresses()[1]
 
-        # The metadata deserializer is totally a prickly drama queen
-        # It breaks on data directly from the blockchain without saying much
-        self.metadata = diem_types.Metadata__Undefined()
-        try:
-            self.metadata = diem_types.Metadata.lcs_deserialize(metadata)
-        except:
-            pass
+    def _general_metadata_subaddresses(self) -> Tuple[Optional[str], Optional[str]]:
+        """Hex (from, to) subaddresses of general metadata v0, decoded once"""
+        if self._subaddresses is None:
+            sender_sub_address = None
+            receiver_sub_address = None
+
+            metadata = self.metadata
+            if (
+                metadata
+                and isinstance(metadata, diem_types.Metadata__GeneralMetadata)
+                and isinstance(
+                    metadata.value, diem_types.GeneralMetadata__GeneralMetadataVersion0
+                )
+            ):
+                general_metadata = metadata.value.value
+
+                if general_metadata.to_subaddress:
+                    receiver_sub_address = general_metadata.to_subaddress.hex()
+
+                if general_metadata.from_subaddress:
+                    sender_sub_address = general_metadata.from_subaddress.hex()
+
+            self._subaddresses = (sender_sub_address, receiver_sub_address)
+        return self._subaddresses
 
     @classmethod
     def from_jsonrpc_event(cls, event: jsonrpc.Event) -> "LRWPubSubEvent":
@@ -44,10 +109,83 @@ class LRWPubSubEvent:
             sequence=event.sequence_number,
         )
 
+    def to_bytes(self) -> bytes:
+        """
+        Pack into a compact versioned record. Only the raw metadata is kept,
+        it is deserialized again by the receiving side.
+        Addresses are restored as lowercase hex.
+        """
+        currency = self.currency.encode("ascii")
+        return b"".join(
+            (
+                _WIRE_HEADER.pack(
+                    WIRE_FORMAT_VERSION,
+                    bytes.fromhex(self.sender),
+                    bytes.fromhex(self.receiver),
+                    self.amount,
+                    self.version,
+                    self.sequence,
+                    len(currency),
+                ),
+                currency,
+                _WIRE_METADATA_LEN.pack(len(self.raw_metadata)),
+                self.raw_metadata,
+            )
+        )
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "LRWPubSubEvent":
+        event, _ = cls.unpack_from(data)
+        return event
+
+    @classmethod
+    def unpack_from(cls, data: bytes, offset: int = 0) -> Tuple["LRWPubSubEvent", int]:
+        """Unpack one record at `offset`, returns it and the offset past it"""
+        (
+            wire_version,
+            sender,
+            receiver,
+            amount,
+            version,
+            sequence,
+            currency_len,
+        ) = _WIRE_HEADER.unpack_from(data, offset)
+        if wire_version != WIRE_FORMAT_VERSION:
+            raise ValueError(f"Unsupported LRWPubSubEvent wire version {wire_version}")
+
+        offset += _WIRE_HEADER.size
+        currency = bytes(data[offset : offset + currency_len]).decode("ascii")
+        offset += currency_len
+        (metadata_len,) = _WIRE_METADATA_LEN.unpack_from(data, offset)
+        offset += _WIRE_METADATA_LEN.size
+        metadata = bytes(data[offset : offset + metadata_len])
+        offset += metadata_len
+
+        event = LRWPubSubEvent(
+            sender=sender.hex(),
+            receiver=receiver.hex(),
+            amount=amount,
+            currency=currency,
+            metadata=metadata,
+            version=version,
+            sequence=sequence,
+        )
+        return event, offset
+
     def __str__(self) -> str:
         """
         Print as a nested dict to str
         """
-        d = self.__dict__.copy()
+        d = {
+            name: getattr(self, name)
+            for name in (
+                "sender",
+                "receiver",
+                "amount",
+                "currency",
+                "version",
+                "sequence",
+            )
+        }
         d["metadata"] = self.metadata.__dict__
         return str(d)
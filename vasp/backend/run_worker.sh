@@ -1,4 +1,8 @@
 #!/bin/bash
 #export INIT_DRAMATIQ=1
 
-dramatiq merchant_vasp -p 2 -t 2 --verbose  "$@"
+# sizes processes, threads, prefetch and the DB pool from WORKER_PROFILE
+profile=$(python -m merchant_vasp.worker_profile) || exit 1
+eval "$profile"
+
+$DRAMATIQ merchant_vasp -p $WORKER_PROCESSES -t $WORKER_THREADS --verbose  "$@"
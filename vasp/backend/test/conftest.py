@@ -3,6 +3,7 @@ import random
 from datetime import datetime, timedelta, timezone
 from uuid import UUID
 
+import fakeredis
 import pytest
 from diem import identifier
 from diem.jsonrpc import CurrencyInfo
@@ -22,6 +23,7 @@ from merchant_vasp.storage import (
     Payment,
     PaymentOption,
     PaymentStatus,
+    payment_cache,
 )
 
 CHECKOUT_ARGS = lambda: {
@@ -129,6 +131,13 @@ def init_test_onchainwallet(monkeypatch):
     Custody.init(CHAIN_ID)
 
 
+@pytest.fixture(autouse=True)
+def fake_payment_cache():
+    payment_cache.client = fakeredis.FakeStrictRedis()
+    yield payment_cache
+    payment_cache.client.flushall()
+
+
 # TODO - rescope
 @pytest.fixture()
 def db():
@@ -0,0 +1,211 @@
+import time
+
+import fakeredis
+from diem import txnmetadata
+
+from merchant_vasp.background_tasks import expire_payments, process_incoming_txns
+from merchant_vasp.background_tasks import background, periodic
+from merchant_vasp.background_tasks.reaper import schedule_expire_payments
+from merchant_vasp.onchainwallet import OnchainWallet
+from merchant_vasp.storage import (
+    ErrantPayment,
+    ErrantPaymentStatus,
+    Payment,
+    PaymentStatus,
+    ProcessedEvent,
+)
+from pubsub.types import LRWPubSubEvent
+from test.conftest import (
+    SENDER_MOCK_ADDR,
+    SENDER_MOCK_SUBADDR,
+    PAYMENT_SUBADDR,
+    PAYMENT_AMOUNT,
+    PAYMENT_CURRENCY,
+    PAYMENT_ID,
+    EXPIRED_PAYMENT_SUBADDR,
+)
+
+
+def make_event(receiver_sub_address, amount, version, currency=PAYMENT_CURRENCY):
+    return LRWPubSubEvent(
+        sender=SENDER_MOCK_ADDR,
+        receiver=OnchainWallet().address_str,
+        amount=amount,
+        currency=currency,
+        metadata=txnmetadata.general_metadata(
+            from_subaddress=bytes.fromhex(SENDER_MOCK_SUBADDR),
+            to_subaddress=(
+                bytes.fromhex(receiver_sub_address) if receiver_sub_address else None
+            ),
+        ),
+        version=version,
+        sequence=version,
+    )
+
+
+def test_batch_with_unsupported_currency(db):
+    process_incoming_txns(
+        [
+            make_event(PAYMENT_SUBADDR, PAYMENT_AMOUNT, 1, currency="XDX"),
+            make_event(PAYMENT_SUBADDR, PAYMENT_AMOUNT, 2),
+        ]
+    )
+
+    payment = db.query(Payment).filter(Payment.id == PAYMENT_ID).one()
+    assert payment.status == PaymentStatus.cleared
+    assert payment.get_chain_transaction(2) is not None
+    assert not ProcessedEvent.is_processed(1, 1)
+
+
+def test_batch_fallback_survives_unexpected_errors(db, monkeypatch):
+    process_one = background.process_incoming_transaction
+
+    def flaky(**kwargs):
+        if kwargs["version"] == 1:
+            raise RuntimeError("boom")
+        return process_one(**kwargs)
+
+    def failing_batch(_):
+        raise RuntimeError("batch failed")
+
+    monkeypatch.setattr(background, "process_incoming_transactions", failing_batch)
+    monkeypatch.setattr(background, "process_incoming_transaction", flaky)
+    process_incoming_txns(
+        [
+            make_event(PAYMENT_SUBADDR, PAYMENT_AMOUNT, 1),
+            make_event(PAYMENT_SUBADDR, PAYMENT_AMOUNT, 2),
+        ]
+    )
+
+    payment = db.query(Payment).filter(Payment.id == PAYMENT_ID).one()
+    assert payment.status == PaymentStatus.cleared
+    assert payment.get_chain_transaction(2) is not None
+
+
+def test_batch_isolates_failed_events(db):
+    process_incoming_txns(
+        [
+            make_event("0123456789abcdef", PAYMENT_AMOUNT, 1),  # unknown payment
+            make_event(PAYMENT_SUBADDR, PAYMENT_AMOUNT, 2),
+        ]
+    )
+
+    payment = db.query(Payment).filter(Payment.id == PAYMENT_ID).one()
+    assert payment.status == PaymentStatus.cleared
+    assert payment.get_chain_transaction(2) is not None
+    errant = db.query(ErrantPayment).one()
+    assert (errant.tx_id, errant.amount, errant.status) == (
+        1,
+        PAYMENT_AMOUNT,
+        ErrantPaymentStatus.pending,
+    )
+    assert errant.sender_sub_address == SENDER_MOCK_SUBADDR
+
+
+def test_untagged_deposit_is_not_refunded(db):
+    process_incoming_txns([make_event(None, PAYMENT_AMOUNT, 1)])
+
+    assert db.query(ErrantPayment).count() == 0
+    assert ProcessedEvent.is_processed(1, 1)
+
+
+def test_replayed_event_is_skipped(db, mocker):
+    event = make_event(PAYMENT_SUBADDR, PAYMENT_AMOUNT, 3)
+    process_incoming_txns([event])
+    process = mocker.patch(
+        "merchant_vasp.background_tasks.background.process_incoming_transactions",
+        return_value=[None],
+    )
+
+    process_incoming_txns([event, make_event(PAYMENT_SUBADDR, PAYMENT_AMOUNT, 4)])
+
+    assert ProcessedEvent.is_processed(3, 3)
+    assert ProcessedEvent.is_processed(4, 4)
+    process.assert_called_once()
+    assert [txn["version"] for txn in process.call_args.args[0]] == [4]
+
+
+def test_replay_reprocesses_without_recording_refunds_twice(db, mocker):
+    unknown = make_event("0123456789abcdef", PAYMENT_AMOUNT, 3)
+    process_incoming_txns([unknown])
+    process = mocker.spy(background, "process_incoming_transactions")
+
+    process_incoming_txns(
+        [unknown, make_event(PAYMENT_SUBADDR, PAYMENT_AMOUNT, 4)], reprocess=True
+    )
+
+    assert [txn["version"] for txn in process.call_args.args[0]] == [3, 4]
+    assert db.query(ErrantPayment).count() == 1
+    payment = db.query(Payment).filter(Payment.id == PAYMENT_ID).one()
+    assert payment.status == PaymentStatus.cleared
+
+
+def test_failed_batch_falls_back_to_single_events(db, mocker):
+    mocker.patch(
+        "merchant_vasp.background_tasks.background.process_incoming_transactions",
+        side_effect=RuntimeError("boom"),
+    )
+
+    process_incoming_txns(
+        [
+            make_event("0123456789abcdef", PAYMENT_AMOUNT, 5),
+            make_event(PAYMENT_SUBADDR, PAYMENT_AMOUNT, 6),
+        ]
+    )
+
+    payment = db.query(Payment).filter(Payment.id == PAYMENT_ID).one()
+    assert payment.status == PaymentStatus.cleared
+    assert ProcessedEvent.is_processed(5, 5)
+    assert ProcessedEvent.is_processed(6, 6)
+
+
+def test_expire_payments_reschedules_itself(db, mocker):
+    schedule = mocker.patch(
+        "merchant_vasp.background_tasks.reaper.schedule_expire_payments"
+    )
+
+    expire_payments("chain")
+
+    assert Payment.find_by_subaddress(EXPIRED_PAYMENT_SUBADDR).status == (
+        PaymentStatus.rejected
+    )
+    schedule.assert_called_once_with("chain")
+
+
+def test_only_one_reaper_schedule_is_kept(mocker):
+    client = fakeredis.FakeStrictRedis()
+    mocker.patch("dramatiq.get_broker", return_value=mocker.Mock(client=client))
+    send = mocker.patch.object(expire_payments, "send_with_options")
+
+    schedule_expire_payments()
+    schedule_expire_payments()
+    assert send.call_count == 1
+    [chain] = send.call_args.kwargs["args"]
+
+    # the chain continues, a run of another chain stops
+    schedule_expire_payments(chain)
+    schedule_expire_payments("superseded")
+    assert send.call_count == 2
+
+    # a lost run lets the lock lapse, the next start takes over
+    client.delete("lrm:periodic:expire_payments")
+    schedule_expire_payments()
+    assert send.call_count == 3
+    assert send.call_args.kwargs["args"] != (chain,)
+    schedule_expire_payments(chain)
+    assert send.call_count == 3
+
+
+def test_periodic_scheduler_keeps_restarting_schedules(mocker):
+    schedule = mocker.Mock()
+    mocker.patch.object(periodic, "_schedules", [(schedule, 0.01)])
+    broker = mocker.Mock(client=fakeredis.FakeStrictRedis())
+    scheduler = periodic.PeriodicScheduler()
+
+    scheduler.after_worker_boot(broker, None)
+    deadline = time.monotonic() + 5
+    while schedule.call_count < 3 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    scheduler.before_worker_shutdown(broker, None)
+
+    assert schedule.call_count >= 3
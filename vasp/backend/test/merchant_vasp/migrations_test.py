@@ -0,0 +1,81 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlalchemy import create_engine, inspect
+
+from merchant_vasp.storage import Base
+from merchant_vasp.storage.migrations import (
+    current_version,
+    m0005_merchant_api_key_hash,
+    migrate,
+    migrations,
+)
+from merchant_vasp.storage.models import hash_api_key
+
+
+def index_names(engine, table):
+    return {index["name"] for index in inspect(engine).get_indexes(table)}
+
+
+def test_migrate_fresh_database(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'fresh.db'}")
+    latest = migrations()[-1][0]
+
+    assert migrate(engine) == latest
+    assert migrate(engine) == latest
+    assert current_version(engine) == latest
+    assert "uq_payment_merchant_reference_id" in index_names(engine, "payment")
+
+
+def test_migrate_fresh_database_to_the_models(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'models.db'}")
+    migrate(engine)
+
+    inspector = inspect(engine)
+    for table in Base.metadata.sorted_tables:
+        columns = {column["name"] for column in inspector.get_columns(table.name)}
+        assert set(table.columns.keys()) <= columns
+        assert {index.name for index in table.indexes} <= index_names(
+            engine, table.name
+        )
+
+
+def test_concurrent_migrations_apply_each_version_once(tmp_path):
+    engines = [
+        create_engine(f"sqlite:///{tmp_path / 'concurrent.db'}") for _ in range(4)
+    ]
+    latest = migrations()[-1][0]
+
+    with ThreadPoolExecutor(len(engines)) as executor:
+        assert list(executor.map(migrate, engines)) == [latest] * len(engines)
+
+    versions = [
+        row.version for row in engines[0].execute("SELECT version FROM schema_version")
+    ]
+    assert sorted(versions) == [version for version, _ in migrations()]
+
+
+def test_migrate_database_created_without_migrations(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'legacy.db'}")
+    Base.metadata.create_all(bind=engine)
+    engine.execute("DROP INDEX ix_chain_transaction_tx_id")
+    engine.execute("DROP INDEX uq_payment_merchant_reference_id")
+
+    migrate(engine)
+
+    assert "ix_chain_transaction_tx_id" in index_names(engine, "chain_transaction")
+    assert "uq_payment_merchant_reference_id" in index_names(engine, "payment")
+
+
+def test_migrate_hashes_plaintext_api_keys(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'keys.db'}")
+    migrate(engine)
+    engine.execute("INSERT INTO merchant (id, api_key) VALUES (1, 'secret')")
+
+    with engine.begin() as connection:
+        m0005_merchant_api_key_hash.upgrade(connection)
+
+    [(api_key, api_key_hash)] = engine.execute(
+        "SELECT api_key, api_key_hash FROM merchant"
+    ).fetchall()
+    assert api_key is None
+    assert api_key_hash == hash_api_key("secret")
@@ -0,0 +1,130 @@
+from contextlib import contextmanager
+from datetime import datetime
+
+import pytest
+from sqlalchemy import event
+
+from merchant_vasp.storage import Merchant, Payment, PaymentStatus, engine
+from merchant_vasp.storage.cache import merchant_auth_cache
+from merchant_vasp.storage.models import hash_api_key
+from test.conftest import (
+    CLEARED_PAYMENT_ID,
+    EXPIRED_PAYMENT_ID,
+    PAYMENT_AMOUNT,
+    PAYMENT_AMOUNT_2,
+    PAYMENT_CURRENCY,
+    PAYMENT_ID,
+    TOKEN_1,
+)
+
+
+@contextmanager
+def count_queries():
+    statements = []
+
+    def record(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    event.listen(engine, "before_cursor_execute", record)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, "before_cursor_execute", record)
+
+
+def test_find_payment_option_exact_match(db):
+    payment = db.query(Payment).filter(Payment.id == PAYMENT_ID).one()
+
+    assert payment.find_payment_option(PAYMENT_AMOUNT, PAYMENT_CURRENCY).amount == (
+        PAYMENT_AMOUNT
+    )
+    assert payment.find_payment_option(PAYMENT_AMOUNT - 1, PAYMENT_CURRENCY) is None
+    assert payment.find_payment_option(PAYMENT_AMOUNT, "XDX") is None
+
+
+def test_find_payment_option_within_tolerance(db):
+    payment = db.query(Payment).filter(Payment.id == PAYMENT_ID).one()
+
+    option = payment.find_payment_option(
+        PAYMENT_AMOUNT - 2, PAYMENT_CURRENCY, underpay_bps=100
+    )
+    assert option.amount == PAYMENT_AMOUNT
+    assert (
+        payment.find_payment_option(
+            PAYMENT_AMOUNT - 3, PAYMENT_CURRENCY, underpay_bps=100
+        )
+        is None
+    )
+    option = payment.find_payment_option(
+        PAYMENT_AMOUNT_2 + 1, PAYMENT_CURRENCY, overpay_bps=100
+    )
+    assert option.amount == PAYMENT_AMOUNT_2
+
+
+def test_reject_expired_payments(db):
+    now = datetime.utcnow()
+
+    assert Payment.reject_expired(now, limit=10) == 1
+    assert Payment.reject_expired(now, limit=10) == 0
+
+    expired = db.query(Payment).filter(Payment.id == EXPIRED_PAYMENT_ID).one()
+    assert expired.status == PaymentStatus.rejected
+    assert [log.status for log in expired.payment_status_logs] == [
+        PaymentStatus.created,
+        PaymentStatus.rejected,
+    ]
+    cleared = db.query(Payment).filter(Payment.id == CLEARED_PAYMENT_ID).one()
+    assert cleared.status == PaymentStatus.cleared
+
+
+def test_merchant_api_key_is_stored_hashed(db):
+    merchant = Merchant.find_by_token(TOKEN_1)
+
+    assert merchant.api_key_hash == hash_api_key(TOKEN_1)
+    assert TOKEN_1 not in vars(merchant).values()
+    assert Merchant.find_by_token("wrong") is None
+
+
+def test_generated_api_key_authenticates(db):
+    merchant = Merchant(name="generated")
+    api_key = merchant.generate_api_key()
+    db.add(merchant)
+    db.commit()
+
+    assert Merchant.find_by_token(api_key).id == merchant.id
+
+
+def test_merchant_without_api_key_is_rejected(db):
+    db.add(Merchant(name="keyless"))
+    with pytest.raises(ValueError):
+        db.commit()
+    db.rollback()
+
+
+def test_find_by_token_served_from_cache(db):
+    merchant_id = Merchant.find_by_token(TOKEN_1).id
+    db.remove()
+
+    with count_queries() as statements:
+        merchant = Merchant.find_by_token(TOKEN_1)
+    assert statements == []
+    assert merchant.id == merchant_id
+    assert merchant.settlement_currency is not None
+
+
+def test_find_by_token_after_key_rotation(db):
+    merchant = Merchant.find_by_token(TOKEN_1)
+    merchant.api_key = "rotated"
+    db.commit()
+
+    assert Merchant.find_by_token(TOKEN_1) is None
+    assert Merchant.find_by_token("rotated").id == merchant.id
+
+
+def test_find_by_token_cache_expires(db, monkeypatch):
+    monkeypatch.setattr(merchant_auth_cache, "ttl_seconds", -1)
+    Merchant.find_by_token(TOKEN_1)
+    misses = merchant_auth_cache.misses
+
+    Merchant.find_by_token(TOKEN_1)
+    assert merchant_auth_cache.misses == misses + 1
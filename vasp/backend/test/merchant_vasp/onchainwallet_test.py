@@ -0,0 +1,41 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from diem import identifier
+
+from merchant_vasp.config import CHAIN_HRP
+from merchant_vasp.onchainwallet import (
+    OnchainWallet,
+    get_diem_client,
+    get_http_session,
+)
+
+
+def test_wallet_is_shared_across_threads():
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        wallets = set(pool.map(lambda _: id(OnchainWallet.shared()), range(32)))
+    assert len(wallets) == 1
+
+
+def test_each_thread_has_its_own_client_on_a_shared_session():
+    # the barrier holds each call on its own thread
+    barrier = threading.Barrier(4)
+
+    def wallet_client(_):
+        barrier.wait()
+        client = OnchainWallet.shared()._diem_client
+        assert client is get_diem_client()
+        return client
+
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        clients = list(pool.map(wallet_client, range(4)))
+
+    assert len({id(client) for client in clients}) == 4
+    assert all(client._session is get_http_session() for client in clients)
+
+
+def test_encode_address():
+    wallet = OnchainWallet.shared()
+    assert wallet.encode_address("0123456789abcdef") == identifier.encode_account(
+        wallet.address_str, "0123456789abcdef", CHAIN_HRP
+    )
@@ -1,9 +1,14 @@
+import socket
+import time
+
 import pytest
 from diem_utils.types.currencies import DEFAULT_DIEM_CURRENCY
+from sqlalchemy import event
 
 from merchant_vasp import payment_service
 from merchant_vasp.onchainwallet import OnchainWallet
-from merchant_vasp.storage import Payment, PaymentStatus
+from merchant_vasp.storage import Payment, PaymentStatus, engine
+from merchant_vasp.storage.cache import PaymentCache
 from test.conftest import (
     REJECTED_PAYMENT_SUBADDR,
     SENDER_MOCK_ADDR,
@@ -136,3 +141,86 @@ def test_successful_payment(db):
     payment = db.query(Payment).filter(Payment.id == PAYMENT_ID).one()
     assert payment.status == PaymentStatus.cleared
     assert payment.get_chain_transaction(payment_version) is not None
+
+
+def test_process_incoming_transactions_isolates_rejections(db):
+    def txn(receiver_sub_address, version):
+        return dict(
+            version=version,
+            sender_address=SENDER_MOCK_ADDR,
+            sender_sub_address=SENDER_MOCK_SUBADDR,
+            receiver_address=OnchainWallet().address_str,
+            receiver_sub_address=receiver_sub_address,
+            amount=PAYMENT_AMOUNT,
+            currency=PAYMENT_CURRENCY,
+        )
+
+    results = payment_service.process_incoming_transactions(
+        [
+            txn(EXPIRED_PAYMENT_SUBADDR, 1),
+            txn(PAYMENT_SUBADDR, 2),
+            txn(PAYMENT_SUBADDR, 3),  # already cleared by the previous one
+        ]
+    )
+    db.commit()
+
+    assert isinstance(results[0], payment_service.PaymentExpiredException)
+    assert results[1] is None
+    assert isinstance(results[2], payment_service.PaymentStatusException)
+    payment = db.query(Payment).filter(Payment.id == PAYMENT_ID).one()
+    assert payment.status == PaymentStatus.cleared
+    assert len(payment.chain_transactions) == 1
+    expired = Payment.find_by_subaddress(EXPIRED_PAYMENT_SUBADDR)
+    assert expired.status == PaymentStatus.rejected
+
+
+def test_cached_payment_clears_without_reading_the_db(db, fake_payment_cache):
+    fake_payment_cache.put(Payment.find_by_subaddress(PAYMENT_SUBADDR))
+    db.expunge_all()
+    statements = []
+    listener = lambda conn, cursor, statement, *args: statements.append(statement)
+    event.listen(engine, "before_cursor_execute", listener)
+    try:
+        payment_service.process_incoming_transaction(
+            version=11,
+            sender_address=SENDER_MOCK_ADDR,
+            sender_sub_address=SENDER_MOCK_SUBADDR,
+            receiver_address=OnchainWallet.shared().address_str,
+            receiver_sub_address=PAYMENT_SUBADDR,
+            amount=PAYMENT_AMOUNT,
+            currency=PAYMENT_CURRENCY,
+        )
+    finally:
+        event.remove(engine, "before_cursor_execute", listener)
+
+    assert not [s for s in statements if s.lstrip().upper().startswith("SELECT")]
+    assert fake_payment_cache.get(PAYMENT_SUBADDR) is None
+    payment = Payment.find_by_subaddress(PAYMENT_SUBADDR)
+    assert payment.status == PaymentStatus.cleared
+    assert payment.get_chain_transaction(11) is not None
+
+
+def test_final_status_evicts_cached_payment(db, fake_payment_cache):
+    payment = Payment.find_by_subaddress(PAYMENT_SUBADDR)
+    fake_payment_cache.put(payment)
+    assert fake_payment_cache.get(PAYMENT_SUBADDR).id == PAYMENT_ID
+
+    payment.set_status(PaymentStatus.rejected)
+    db.commit()
+
+    assert fake_payment_cache.get(PAYMENT_SUBADDR) is None
+
+
+def test_unresponsive_payment_cache_is_a_miss(mocker):
+    # accepts connections but never answers, like a blackholed Redis
+    with socket.socket() as server:
+        server.bind(("127.0.0.1", 0))
+        server.listen(1)
+        mocker.patch("merchant_vasp.storage.cache.REDIS_HOST", "127.0.0.1")
+        mocker.patch("merchant_vasp.storage.cache.REDIS_PORT", server.getsockname()[1])
+        cache = PaymentCache()
+        cache.enabled = True
+
+        start = time.monotonic()
+        assert cache.get(PAYMENT_SUBADDR) is None
+        assert time.monotonic() - start < 5
@@ -0,0 +1,146 @@
+"""
+Checks the hot lookups are served by indexes on a seeded database. Seeds
+QUERY_PLAN_ROWS payments (20k by default), set it to 1000000 for the full
+size run: QUERY_PLAN_ROWS=1000000 pytest test/merchant_vasp/query_plan_test.py
+"""
+
+import os
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import create_engine
+
+from merchant_vasp.storage import (
+    Payment,
+    PaymentOption,
+    PaymentStatus,
+    db_session,
+)
+from merchant_vasp.storage.migrations import migrate
+from merchant_vasp.storage.models import ChainTransaction, PaymentStatusLog
+
+ROWS = int(os.getenv("QUERY_PLAN_ROWS", 20000))
+CHUNK = 10000
+
+
+@pytest.fixture(scope="module")
+def seeded(tmp_path_factory):
+    engine = create_engine(f"sqlite:///{tmp_path_factory.mktemp('plan') / 'db'}")
+    migrate(engine)
+    now = datetime.utcnow()
+    statuses = [PaymentStatus.created, PaymentStatus.cleared, PaymentStatus.rejected]
+    with engine.begin() as connection:
+        connection.execute("INSERT INTO merchant (id, api_key_hash) VALUES (1, 'key')")
+        for start in range(0, ROWS, CHUNK):
+            ids = range(start, min(start + CHUNK, ROWS))
+            connection.execute(
+                Payment.__table__.insert(),
+                [
+                    dict(
+                        id=f"payment-{i}",
+                        merchant_id=1,
+                        merchant_reference_id=f"order-{i}",
+                        created_at=now,
+                        requested_amount=100,
+                        requested_currency="USD",
+                        status=statuses[i % 3],
+                        refund_requested=False,
+                        subaddress="%016x" % i,
+                        expiry_date=now + timedelta(minutes=i % 60 - 30),
+                    )
+                    for i in ids
+                ],
+            )
+            connection.execute(
+                PaymentOption.__table__.insert(),
+                [
+                    dict(payment_id=f"payment-{i}", amount=100, currency="XUS")
+                    for i in ids
+                ],
+            )
+            connection.execute(
+                PaymentStatusLog.__table__.insert(),
+                [
+                    dict(payment_id=f"payment-{i}", created_at=now, status="created")
+                    for i in ids
+                ],
+            )
+            connection.execute(
+                ChainTransaction.__table__.insert(),
+                [
+                    dict(
+                        payment_id=f"payment-{i}",
+                        sender_address="sender",
+                        amount=100,
+                        currency="XUS",
+                        is_refund=False,
+                        tx_id=i,
+                    )
+                    for i in ids
+                    if i % 3 == 1
+                ],
+            )
+        connection.execute("ANALYZE")
+    return engine
+
+
+def query_plan(engine, query):
+    sql = query.statement.compile(
+        dialect=engine.dialect, compile_kwargs={"literal_binds": True}
+    )
+    rows = engine.execute(f"EXPLAIN QUERY PLAN {sql}").fetchall()
+    return [row[-1] for row in rows]
+
+
+def assert_no_full_scan(plan):
+    scans = [step for step in plan if step.startswith("SCAN") and "INDEX" not in step]
+    assert not scans, plan
+
+
+@pytest.mark.parametrize(
+    "query, index",
+    [
+        (
+            lambda: db_session.query(Payment).filter_by(
+                merchant_id=1, merchant_reference_id="order-7"
+            ),
+            "uq_payment_merchant_reference_id",
+        ),
+        (
+            lambda: db_session.query(Payment).filter_by(subaddress="%016x" % 7),
+            "ix_payment_option_payment_id",
+        ),
+        (
+            lambda: db_session.query(ChainTransaction).filter_by(tx_id=7),
+            "ix_chain_transaction_tx_id",
+        ),
+        (
+            lambda: db_session.query(PaymentStatusLog).filter_by(
+                payment_id="payment-7"
+            ),
+            "ix_payment_status_log_payment_id",
+        ),
+        (
+            lambda: db_session.query(Payment.id)
+            .filter(
+                Payment.status == PaymentStatus.created,
+                Payment.expiry_date <= datetime.utcnow(),
+            )
+            .order_by(Payment.expiry_date)
+            .limit(500),
+            "ix_payment_status_expiry_date",
+        ),
+        (
+            lambda: db_session.query(Payment.id, Payment.created_at)
+            .filter(Payment.merchant_id == 1)
+            .order_by(Payment.created_at.desc(), Payment.id.desc())
+            .limit(100),
+            "ix_payment_merchant_created_at",
+        ),
+    ],
+)
+def test_lookup_uses_index(seeded, query, index):
+    plan = query_plan(seeded, query())
+
+    assert_no_full_scan(plan)
+    assert any(index in step for step in plan), plan
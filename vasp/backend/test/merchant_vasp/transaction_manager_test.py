@@ -0,0 +1,93 @@
+import pytest
+from diem import jsonrpc
+from diem_utils.types.currencies import DiemCurrency
+
+from merchant_vasp import transaction_manager
+from merchant_vasp.onchainwallet import OnchainWallet
+from merchant_vasp.storage import ErrantPayment, ErrantPaymentStatus
+from test.conftest import SENDER_MOCK_ADDR, SENDER_MOCK_SUBADDR
+
+OTHER_SENDER_ADDR = "c" * 32
+
+
+def test_refund_errant_payments_groups_by_sender_and_currency(db, mocker):
+    for tx_id, sender, amount in [
+        (1, SENDER_MOCK_ADDR, 100),
+        (2, OTHER_SENDER_ADDR, 50),
+        (3, SENDER_MOCK_ADDR, 20),
+    ]:
+        db.add(
+            ErrantPayment(
+                tx_id=tx_id,
+                sender_address=sender,
+                sender_sub_address=SENDER_MOCK_SUBADDR,
+                amount=amount,
+                currency="XUS",
+                reason="wrongsubaddr",
+            )
+        )
+    db.commit()
+    send = mocker.patch.object(
+        OnchainWallet, "send_transactions", return_value=[77, None]
+    )
+
+    assert transaction_manager.refund_errant_payments(limit=10) == 2
+
+    send.assert_called_once_with(
+        [
+            (DiemCurrency.XUS, 120, SENDER_MOCK_ADDR, SENDER_MOCK_SUBADDR),
+            (DiemCurrency.XUS, 50, OTHER_SENDER_ADDR, SENDER_MOCK_SUBADDR),
+        ]
+    )
+    statuses = {
+        errant.tx_id: (errant.status, errant.refund_tx_id)
+        for errant in db.query(ErrantPayment)
+    }
+    assert statuses == {
+        1: (ErrantPaymentStatus.refunded, 77),
+        2: (ErrantPaymentStatus.refund_error, None),
+        3: (ErrantPaymentStatus.refunded, 77),
+    }
+    assert transaction_manager.refund_errant_payments(limit=10) == 0
+
+
+def test_refund_errant_payments_send_failure(db, mocker):
+    db.add(
+        ErrantPayment(
+            tx_id=1,
+            sender_address=SENDER_MOCK_ADDR,
+            sender_sub_address=SENDER_MOCK_SUBADDR,
+            amount=100,
+            currency="XUS",
+            reason="wrongsubaddr",
+        )
+    )
+    db.commit()
+    mocker.patch.object(
+        OnchainWallet, "send_transactions", side_effect=RuntimeError("no account")
+    )
+
+    with pytest.raises(RuntimeError):
+        transaction_manager.refund_errant_payments(limit=10)
+
+    assert db.query(ErrantPayment).one().status == ErrantPaymentStatus.refund_error
+
+
+def test_send_transactions_pipelines_sequence_numbers(mocker):
+    client = mocker.Mock()
+    client.get_account.return_value = mocker.Mock(sequence_number=5)
+    client.submit.side_effect = [None, None, jsonrpc.JsonRpcError("full")]
+    client.wait_for_transaction.side_effect = [
+        mocker.Mock(version=10),
+        jsonrpc.JsonRpcError("failed"),
+    ]
+    wallet = OnchainWallet(client)
+
+    versions = wallet.send_transactions(
+        [(DiemCurrency.XUS, 1, OTHER_SENDER_ADDR, None)] * 4
+    )
+
+    assert versions == [10, None, None, None]
+    assert [
+        call.args[0].raw_txn.sequence_number for call in client.submit.call_args_list
+    ] == [5, 6, 7]
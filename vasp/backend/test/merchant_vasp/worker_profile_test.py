@@ -0,0 +1,34 @@
+import pytest
+
+from merchant_vasp.worker_profile import load_profile, main
+
+
+def test_default_profile_sizes_pool_and_prefetch_from_threads(monkeypatch):
+    monkeypatch.delenv("WORKER_PROFILE", raising=False)
+    monkeypatch.setenv("WORKER_THREADS", "8")
+
+    profile = load_profile()
+
+    assert (profile.processes, profile.threads, profile.gevent) == (2, 8, False)
+    assert profile.pool_size == 8
+    assert profile.queue_prefetch == 16
+
+
+def test_profile_overrides_and_exports(monkeypatch, capsys):
+    monkeypatch.setenv("WORKER_PROFILE", "io")
+    monkeypatch.setenv("WORKER_GEVENT", "0")
+    monkeypatch.setenv("DB_POOL_SIZE", "4")
+
+    main()
+
+    out, err = capsys.readouterr()
+    assert "export DRAMATIQ=dramatiq\n" in out
+    assert "export DB_POOL_SIZE=4\n" in out
+    assert "export dramatiq_queue_prefetch=128\n" in out
+    assert "2 processes x 64 threads = 128 concurrent actors" in err
+
+
+def test_unknown_profile(monkeypatch):
+    monkeypatch.setenv("WORKER_PROFILE", "turbo")
+    with pytest.raises(ValueError):
+        load_profile()
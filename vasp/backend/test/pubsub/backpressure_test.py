@@ -0,0 +1,53 @@
+import dramatiq
+from dramatiq.brokers.stub import StubBroker
+
+from pubsub.backpressure import QueueDepthThrottle, ThrottleState
+
+
+def make_throttle():
+    broker = StubBroker(middleware=[])
+
+    @dramatiq.actor(broker=broker)
+    def task(n):
+        pass
+
+    return task, QueueDepthThrottle(
+        broker, high_water_mark=4, low_water_mark=2, poll_interval_ms=1
+    )
+
+
+def test_throttle_states_follow_queue_depth():
+    task, throttle = make_throttle()
+    assert throttle.update() == ThrottleState.open
+
+    for n in range(2):
+        task.send(n)
+    assert throttle.update() == ThrottleState.slowed
+
+    for n in range(2):
+        task.send(n)
+    assert throttle.update() == ThrottleState.paused
+
+    # stays paused until the queue is drained below the low water mark
+    throttle.broker.queues["default"].get_nowait()
+    assert throttle.update() == ThrottleState.paused
+    throttle.broker.queues["default"].get_nowait()
+    throttle.broker.queues["default"].get_nowait()
+    assert throttle.update() == ThrottleState.open
+
+
+def test_wait_blocks_while_paused(mocker):
+    _, throttle = make_throttle()
+    depths = iter([5, 3, 1])
+    mocker.patch.object(throttle, "depth", side_effect=lambda: next(depths))
+
+    assert throttle.wait() == ThrottleState.open
+    assert throttle.depth.call_count == 3
+
+
+def test_wait_fails_open_on_broker_errors(mocker):
+    _, throttle = make_throttle()
+    throttle.state = ThrottleState.paused
+    mocker.patch.object(throttle, "depth", side_effect=ConnectionError("down"))
+
+    assert throttle.wait() == ThrottleState.open
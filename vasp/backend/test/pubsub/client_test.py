@@ -0,0 +1,315 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from diem import jsonrpc
+from prometheus_client import REGISTRY
+
+from bench.fake_jsonrpc import FakeJsonRpcServer, SyntheticEventStream
+from pubsub import DEFL_CONFIG
+from pubsub.client import DryRunProcessor, LRWPubSubClient
+
+from test.pubsub.conftest import EVENT_KEYS, key_version_base
+
+
+def test_sync_keeps_per_key_order(make_client, processor):
+    client = make_client({key: 7 for key in EVENT_KEYS}, sync_workers=3)
+
+    state = client.sync({key: 0 for key in EVENT_KEYS})
+
+    assert state == {key: 7 for key in EVENT_KEYS}
+    for key in EVENT_KEYS:
+        base = key_version_base(key)
+        sequences = [
+            e.sequence for e in processor.sent if e.version // 1000 == base // 1000
+        ]
+        assert sequences == list(range(7))
+
+
+def test_sync_checkpoints_each_key(make_client):
+    client = make_client({EVENT_KEYS[0]: 3, EVENT_KEYS[1]: 15})
+
+    client.sync({EVENT_KEYS[0]: 0, EVENT_KEYS[1]: 0})
+
+    assert client.progress.fetch_state() == {EVENT_KEYS[0]: 3, EVENT_KEYS[1]: 10}
+    assert client.lag[EVENT_KEYS[0]] == 0
+    assert client.lag[EVENT_KEYS[1]] == 5000 - 2009
+
+
+def test_sync_failed_key_does_not_block_others(make_client):
+    client = make_client({EVENT_KEYS[0]: 3})
+    broken_key = "broken"
+
+    def get_events(key, start, limit):
+        if key == broken_key:
+            raise ConnectionError("node unavailable")
+        return client.client.streams[key][start : start + limit]
+
+    client.client.get_events = get_events
+    state = client.sync({EVENT_KEYS[0]: 0, broken_key: 4}, catch_error=True)
+
+    assert state == {EVENT_KEYS[0]: 3, broken_key: 4}
+    with pytest.raises(ConnectionError):
+        client.sync({broken_key: 4})
+
+
+def test_adaptive_fetch_grows_batch_until_caught_up(make_client, processor):
+    key = EVENT_KEYS[0]
+    client = make_client(
+        {key: 100}, adaptive_fetch=True, fetch_batch_size=10, max_fetch_batch_size=40
+    )
+
+    state = {key: 0}
+    page_sizes = []
+    while True:
+        before = state[key]
+        state = client.sync(state)
+        page_sizes.append(state[key] - before)
+        if client.is_caught_up():
+            break
+
+    assert page_sizes == [10, 20, 40, 30]
+    assert [e.sequence for e in processor.sent] == list(range(100))
+    assert client.batch_sizes[key] == 10
+
+
+def test_fixed_fetch_keeps_batch_size(make_client):
+    key = EVENT_KEYS[0]
+    client = make_client({key: 100}, adaptive_fetch=False, fetch_batch_size=10)
+
+    state = client.sync(client.sync({key: 0}))
+
+    assert state == {key: 20}
+    assert not client.is_caught_up()
+
+
+def test_claim_event_keys_reloads_taken_over_keys(make_client):
+    client = make_client({})
+    client.event_keys = EVENT_KEYS[:2]
+    client.progress.save_state({EVENT_KEYS[0]: 4, EVENT_KEYS[1]: 9})
+
+    state = client.claim_event_keys({EVENT_KEYS[0]: 6})
+
+    assert state == {EVENT_KEYS[0]: 6, EVENT_KEYS[1]: 9}
+
+
+def test_start_survives_progress_storage_errors(make_client, processor, mocker):
+    key = EVENT_KEYS[0]
+    client = make_client({key: 3})
+    mocker.patch.object(client, "init_progress_state", return_value={key: 0})
+    mocker.patch.object(
+        client.progress,
+        "acquire_leases",
+        side_effect=[RuntimeError("storage down"), [key], [key]],
+    )
+    mocker.patch("pubsub.client.time.sleep", side_effect=[None, KeyboardInterrupt])
+
+    with pytest.raises(KeyboardInterrupt):
+        client.start()
+
+    assert [event.sequence for event in processor.sent] == [0, 1, 2]
+
+
+def test_batch_dispatch_sends_one_message_per_page(make_client, processor):
+    key = EVENT_KEYS[0]
+    client = make_client(
+        {key: 25}, batch_dispatch=True, adaptive_fetch=False, fetch_batch_size=10
+    )
+
+    client.sync(client.sync(client.sync({key: 0})))
+
+    assert processor.batches == [10, 10, 5]
+    assert [e.sequence for e in processor.sent] == list(range(25))
+
+
+def test_replay_streams_range_in_order(make_client, processor):
+    key = EVENT_KEYS[0]
+    client = make_client(
+        {key: 50}, sync_workers=2, max_fetch_batch_size=7, batch_dispatch=True
+    )
+    client.progress.save_state({key: 50})
+
+    replayed = client.replay([key], 5, 40)
+
+    assert replayed == 35
+    assert [e.sequence for e in processor.sent] == list(range(5, 40))
+    assert client.progress.fetch_state() == {key: 50}
+    assert processor.kwargs == [{"reprocess": True}] * len(processor.batches)
+
+
+def test_replay_stops_at_end_of_stream(make_client, processor):
+    key = EVENT_KEYS[0]
+    client = make_client({key: 12}, max_fetch_batch_size=5)
+
+    assert client.replay([key], 0, 1000) == 12
+    assert [e.sequence for e in processor.sent] == list(range(12))
+
+
+def test_sync_against_fake_jsonrpc_node(tmp_path, processor):
+    address = "c" * 32
+    stream = SyntheticEventStream(
+        address, [("%016x" % i, 100, "XUS") for i in range(15)]
+    )
+    server = FakeJsonRpcServer(0, stream, max_page_size=10)
+    server.start()
+    try:
+        client = LRWPubSubClient(
+            {
+                **DEFL_CONFIG,
+                "diem_node_uri": server.url,
+                "accounts": [address],
+                "progress_file_path": str(tmp_path / "progress"),
+                "adaptive_fetch": False,
+                "fetch_batch_size": 100,
+                "processor": processor,
+                "batch_processor": processor,
+            }
+        )
+        state = client.sync(client.sync(client.init_progress_state()))
+    finally:
+        server.stop()
+
+    assert state == {stream.received_events_key: 15}
+    assert [e.receiver_sub_address for e in processor.sent] == [
+        "%016x" % i for i in range(15)
+    ]
+
+
+def test_each_thread_has_its_own_jsonrpc_client(tmp_path):
+    client = LRWPubSubClient(
+        {**DEFL_CONFIG, "progress_file_path": str(tmp_path / "progress")}
+    )
+
+    # the barrier holds each call on its own thread
+    barrier = threading.Barrier(4)
+
+    def thread_client(_):
+        barrier.wait()
+        return client.client
+
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        clients = list(pool.map(thread_client, range(4)))
+    clients.append(client.client)
+
+    assert len({id(c) for c in clients}) == 5
+    assert all(c._session is client.session for c in clients)
+
+
+def test_in_process_mode_processes_before_checkpoint(make_client, processor):
+    key = EVENT_KEYS[0]
+    client = make_client(
+        {key: 8}, processing_mode="in_process", adaptive_fetch=False, fetch_batch_size=5
+    )
+
+    assert client.sync({key: 0}) == {key: 5}
+    assert sorted(e.sequence for e in processor.sent) == list(range(5))
+    assert processor.batches == []
+
+    processor.fail_on = 6
+    assert client.sync({key: 5}, catch_error=True) == {key: 5}
+    assert client.progress.fetch_state() == {key: 5}
+
+
+def test_dry_run_in_process_mode(make_client, caplog):
+    key = EVENT_KEYS[0]
+    client = make_client(
+        {key: 3},
+        processing_mode="in_process",
+        processor=DryRunProcessor(),
+        batch_processor=DryRunProcessor(),
+    )
+
+    with caplog.at_level("INFO", logger="pubsub.client"):
+        assert client.sync({key: 0}) == {key: 3}
+
+    assert len([r for r in caplog.records if "DRY RUN" in r.message]) == 3
+    assert client.progress.fetch_state() == {key: 3}
+
+
+def test_lazy_checkpoint_flushes_pending_progress(make_client):
+    key = EVENT_KEYS[0]
+    client = make_client(
+        {key: 30},
+        adaptive_fetch=False,
+        fetch_batch_size=10,
+        checkpoint_interval_ms=60_000,
+    )
+
+    state = client.sync(client.sync(client.sync({key: 0})))
+
+    assert state == {key: 30}
+    assert client.progress.fetch_state() == {key: 10}
+    client.checkpoint_pending()
+    assert client.progress.fetch_state() == {key: 30}
+
+
+def test_lazy_checkpoint_of_idle_key_is_saved_once_due(make_client, mocker):
+    key = EVENT_KEYS[0]
+    client = make_client({key: 30}, fetch_batch_size=10, checkpoint_interval_ms=60_000)
+    monotonic = mocker.patch("pubsub.client.time.monotonic", return_value=1000.0)
+
+    client.sync(client.sync(client.sync({key: 0})))
+    client.checkpoint_due()
+    assert client.progress.fetch_state() == {key: 10}
+
+    # the key got no new events, its deferred position is saved all the same
+    monotonic.return_value = 1061.0
+    client.checkpoint_due()
+    assert client.progress.fetch_state() == {key: 30}
+    assert client._uncheckpointed == {}
+
+
+def test_event_keys_are_resolved_once_and_cached(make_client, mocker):
+    client = make_client({}, accounts=["a" * 32, "b" * 32, "c" * 32])
+    client.client.get_account = mocker.Mock(
+        side_effect=lambda address: (
+            None
+            if address == "c" * 32
+            else jsonrpc.Account(received_events_key=address + "00")
+        )
+    )
+    assert client.received_events_keys() == ["a" * 32 + "00", "b" * 32 + "00"]
+    assert client.event_key_cache.load() == {
+        "a" * 32: "a" * 32 + "00",
+        "b" * 32: "b" * 32 + "00",
+    }
+
+    # a restart uses the cache and revalidates it later
+    client.accounts = ["a" * 32, "b" * 32]
+    client.client.get_account.reset_mock()
+    assert client.received_events_keys() == ["a" * 32 + "00", "b" * 32 + "00"]
+    assert client.client.get_account.call_count == 0
+
+    client.event_keys = client.received_events_keys()
+    client.client.get_account.side_effect = lambda address: jsonrpc.Account(
+        received_events_key=address + "01"
+    )
+    client.revalidate_event_keys()
+    assert client.event_keys == [
+        "a" * 32 + "00",
+        "b" * 32 + "00",
+        "a" * 32 + "01",
+        "b" * 32 + "01",
+    ]
+
+
+def test_sync_reports_per_key_metrics(make_client):
+    key = EVENT_KEYS[0]
+    client = make_client({key: 12}, adaptive_fetch=False, fetch_batch_size=10)
+    fetched_before = REGISTRY.get_sample_value(
+        "pubsub_events_fetched_total", {"event_key": key}
+    )
+
+    client.sync({key: 0})
+
+    assert (
+        REGISTRY.get_sample_value("pubsub_events_fetched_total", {"event_key": key})
+        == (fetched_before or 0) + 10
+    )
+    assert REGISTRY.get_sample_value(
+        "pubsub_fetch_latency_seconds_count", {"event_key": key}
+    )
+    assert (
+        REGISTRY.get_sample_value("pubsub_sync_lag_versions", {"event_key": key})
+        == 5000 - key_version_base(key) - 9
+    )
@@ -0,0 +1,95 @@
+import pytest
+from diem import jsonrpc, txnmetadata
+
+from pubsub import DEFL_CONFIG
+from pubsub.client import LRWPubSubClient
+
+RECEIVER_ADDR = "9135abc8effbd75abe8ec6192e2b0c8b"
+SENDER_ADDR = "b" * 32
+EVENT_KEYS = ["00000000000000%02d" % i + RECEIVER_ADDR for i in range(3)]
+
+
+def key_version_base(key: str) -> int:
+    return 1000 * (EVENT_KEYS.index(key) + 1) if key in EVENT_KEYS else 0
+
+
+def make_event(key: str, sequence_number: int) -> jsonrpc.Event:
+    """Versions encode the event key, e.g. key #1 seq 5 lands in version 2005"""
+    metadata = txnmetadata.general_metadata(
+        from_subaddress=bytes.fromhex("ff" * 8),
+        to_subaddress=bytes.fromhex("%016x" % sequence_number),
+    )
+    return jsonrpc.Event(
+        key=key,
+        sequence_number=sequence_number,
+        transaction_version=key_version_base(key) + sequence_number,
+        data=jsonrpc.EventData(
+            type="receivedpayment",
+            amount=jsonrpc.Amount(amount=100 + sequence_number, currency="XUS"),
+            sender=SENDER_ADDR,
+            receiver=RECEIVER_ADDR,
+            metadata=metadata.hex(),
+        ),
+    )
+
+
+class FakeDiemClient:
+    """Serves `get_events` from an in-memory event stream per event key"""
+
+    def __init__(self, event_counts):
+        self.streams = {
+            key: [make_event(key, seq) for seq in range(count)]
+            for key, count in event_counts.items()
+        }
+        self.version = 5000
+
+    def get_events(self, key, start, limit):
+        return self.streams.get(key, [])[start : start + limit]
+
+    def get_last_known_state(self):
+        return jsonrpc.client.State(chain_id=2, version=self.version, timestamp_usecs=0)
+
+
+class RecordingProcessor:
+    def __init__(self):
+        self.sent = []
+        self.batches = []
+        self.kwargs = []
+        self.fail_on = None
+
+    def send(self, event, **kwargs):
+        self.kwargs.append(kwargs)
+        if isinstance(event, list):
+            self.sent.extend(event)
+            self.batches.append(len(event))
+        else:
+            self.sent.append(event)
+
+    def fn(self, event, **kwargs):
+        """Plays the actor function for in-process processing"""
+        if self.fail_on is not None and event.sequence == self.fail_on:
+            raise RuntimeError("processing failed")
+        self.sent.append(event)
+
+
+@pytest.fixture
+def processor():
+    return RecordingProcessor()
+
+
+@pytest.fixture
+def make_client(tmp_path, processor):
+    def _make_client(event_counts, **overrides):
+        config = {
+            **DEFL_CONFIG,
+            "progress_file_path": str(tmp_path / "progress"),
+            "processor": processor,
+            "batch_processor": processor,
+            "backpressure": False,
+            **overrides,
+        }
+        client = LRWPubSubClient(config)
+        client.client = FakeDiemClient(event_counts)
+        return client
+
+    return _make_client
@@ -0,0 +1,167 @@
+import json
+import time
+
+import fakeredis
+import pytest
+
+from pubsub.progress import (
+    CorruptProgressLogError,
+    FileProgressStorage,
+    LeaseLostError,
+    LogProgressStorage,
+    RedisProgressStorage,
+    make_progress_storage,
+)
+
+
+def test_file_storage_roundtrip(tmp_path):
+    path = str(tmp_path / "progress")
+    storage = FileProgressStorage(path)
+    storage.save_state({"a": 1, "b": 2})
+    storage.save_key_state("b", 5)
+
+    assert FileProgressStorage(path).fetch_state() == {"a": 1, "b": 5}
+    assert not (tmp_path / "progress.tmp").exists()
+
+
+def test_log_storage_replays_log(tmp_path):
+    path = str(tmp_path / "progress")
+    storage = LogProgressStorage(path)
+    storage.fetch_state()
+    storage.save_state({"a": 1})
+    storage.save_key_state("a", 3)
+    storage.save_key_state("b", 7)
+
+    assert json.loads((tmp_path / "progress").read_text()) == {"a": 1}
+    assert LogProgressStorage(path).fetch_state() == {"a": 3, "b": 7}
+
+
+def test_log_storage_ignores_torn_entry(tmp_path):
+    path = str(tmp_path / "progress")
+    storage = LogProgressStorage(path)
+    storage.fetch_state()
+    storage.save_key_state("a", 3)
+    with open(f"{path}.log", "a") as log:
+        log.write('["a", 4')
+
+    assert LogProgressStorage(path).fetch_state() == {"a": 3}
+
+
+def test_log_storage_keeps_entries_written_after_torn_entry(tmp_path):
+    path = str(tmp_path / "progress")
+    storage = LogProgressStorage(path)
+    storage.fetch_state()
+    storage.save_key_state("a", 2)
+    with open(f"{path}.log", "a") as log:
+        log.write('["a", 3')
+
+    recovered = LogProgressStorage(path)
+    assert recovered.fetch_state() == {"a": 2}
+    recovered.save_key_state("a", 10)
+    recovered.save_key_state("b", 5)
+    recovered.flush()
+
+    assert LogProgressStorage(path).fetch_state() == {"a": 10, "b": 5}
+
+
+def test_log_storage_recovers_last_entry_missing_its_newline(tmp_path):
+    path = str(tmp_path / "progress")
+    with open(f"{path}.log", "w") as log:
+        log.write('["a", 2]\n["a", 3]')
+
+    recovered = LogProgressStorage(path)
+    assert recovered.fetch_state() == {"a": 3}
+    recovered.save_key_state("b", 5)
+
+    assert LogProgressStorage(path).fetch_state() == {"a": 3, "b": 5}
+
+
+def test_log_storage_rejects_corrupt_entry_before_others(tmp_path):
+    path = str(tmp_path / "progress")
+    with open(f"{path}.log", "w") as log:
+        log.write('["a", 2]\n["a", 3\n["a", 4]\n')
+
+    with pytest.raises(CorruptProgressLogError):
+        LogProgressStorage(path).fetch_state()
+
+
+def test_log_storage_fsyncs_coalesced_writes_when_idle(tmp_path, mocker):
+    path = str(tmp_path / "progress")
+    storage = LogProgressStorage(path, fsync_interval_ms=50)
+    storage.fetch_state()
+    fsync = mocker.patch("pubsub.progress.os.fsync")
+
+    storage.save_key_state("a", 1)
+    storage.save_key_state("a", 2)
+    assert fsync.call_count == 0
+
+    # no further checkpoint comes, the timer fsyncs the log all the same
+    deadline = time.monotonic() + 5
+    while not fsync.called and time.monotonic() < deadline:
+        time.sleep(0.01)
+    fsync.assert_called_once_with(storage._log.fileno())
+    assert not storage._dirty
+
+
+def test_log_storage_compacts(tmp_path):
+    path = str(tmp_path / "progress")
+    storage = LogProgressStorage(path, fsync_interval_ms=60_000, compact_every=3)
+    storage.fetch_state()
+    for sequence_num in range(1, 5):
+        storage.save_key_state("a", sequence_num)
+    storage.flush()
+
+    assert json.loads((tmp_path / "progress").read_text()) == {"a": 4}
+    assert (tmp_path / "progress.log").read_text() == ""
+    assert LogProgressStorage(path).fetch_state() == {"a": 4}
+
+
+def test_make_progress_storage_unknown_type(tmp_path):
+    with pytest.raises(ValueError):
+        make_progress_storage(
+            {"progress_storage_type": "nope", "progress_file_path": str(tmp_path)}
+        )
+
+
+@pytest.fixture
+def fake_redis():
+    return fakeredis.FakeStrictRedis()
+
+
+def test_redis_storage_splits_keys_between_replicas(fake_redis):
+    keys = [f"key-{i}" for i in range(4)]
+    first = RedisProgressStorage(fake_redis, replica_id="first")
+    second = RedisProgressStorage(fake_redis, replica_id="second")
+
+    assert first.acquire_leases(keys) == keys
+    second.acquire_leases(keys)  # announces itself, nothing is free yet
+    first_keys = first.acquire_leases(keys)
+    second_keys = second.acquire_leases(keys)
+
+    assert len(first_keys) == len(second_keys) == 2
+    assert set(first_keys) | set(second_keys) == set(keys)
+
+
+def test_redis_storage_takes_over_dead_replica(fake_redis):
+    keys = ["key-0", "key-1"]
+    dead = RedisProgressStorage(fake_redis, lease_ttl_ms=50, replica_id="dead")
+    alive = RedisProgressStorage(fake_redis, lease_ttl_ms=50, replica_id="alive")
+    dead.acquire_leases(keys)
+    dead.save_key_state("key-0", 12)
+
+    assert alive.acquire_leases(keys) == []
+    time.sleep(0.1)
+    assert alive.acquire_leases(keys) == keys
+    assert alive.fetch_state() == {"key-0": 12}
+
+
+def test_redis_storage_rejects_save_without_lease(fake_redis):
+    owner = RedisProgressStorage(fake_redis, replica_id="owner")
+    other = RedisProgressStorage(fake_redis, replica_id="other")
+    owner.acquire_leases(["key-0"])
+
+    with pytest.raises(LeaseLostError):
+        other.save_key_state("key-0", 5)
+
+    owner.release_leases()
+    assert other.acquire_leases(["key-0"]) == ["key-0"]
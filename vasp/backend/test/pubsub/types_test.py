@@ -0,0 +1,58 @@
+import dramatiq
+import pytest
+from diem import diem_types
+
+from merchant_vasp.background_tasks import process_incoming_txns
+from merchant_vasp.encoder import LRWEventEncoder
+from pubsub.types import LRWPubSubEvent
+from test.pubsub.conftest import EVENT_KEYS, make_event
+
+
+def test_wire_format_roundtrip():
+    event = LRWPubSubEvent.from_jsonrpc_event(make_event(EVENT_KEYS[0], 3))
+
+    decoded = LRWPubSubEvent.from_bytes(event.to_bytes())
+
+    assert str(decoded) == str(event)
+    assert decoded.raw_metadata == event.raw_metadata
+    assert isinstance(decoded.metadata, diem_types.Metadata__GeneralMetadata)
+
+
+def test_wire_format_rejects_unknown_version():
+    event = LRWPubSubEvent.from_jsonrpc_event(make_event(EVENT_KEYS[0], 3))
+
+    with pytest.raises(ValueError):
+        LRWPubSubEvent.from_bytes(b"\x09" + event.to_bytes()[1:])
+
+
+def test_encoder_roundtrips_batch_message():
+    events = [
+        LRWPubSubEvent.from_jsonrpc_event(make_event(EVENT_KEYS[0], seq))
+        for seq in range(3)
+    ]
+    message = process_incoming_txns.message(events)
+    encoder = LRWEventEncoder()
+
+    decoded = dramatiq.Message(**encoder.decode(encoder.encode(message.asdict())))
+
+    assert decoded.message_id == message.message_id
+    assert [str(e) for e in decoded.args[0]] == [str(e) for e in events]
+
+
+def test_metadata_decoded_lazily_once(mocker):
+    event = LRWPubSubEvent.from_jsonrpc_event(make_event(EVENT_KEYS[0], 3))
+    deserialize = mocker.spy(diem_types.Metadata, "bcs_deserialize")
+
+    assert not hasattr(event, "__dict__")
+    assert event.receiver_sub_address == "%016x" % 3
+    assert event.sender_sub_address == "ff" * 8
+    assert event.receiver_sub_address == "%016x" % 3
+    assert deserialize.call_count == 1
+
+
+def test_undecodable_metadata_has_no_subaddresses():
+    event = LRWPubSubEvent.from_jsonrpc_event(make_event(EVENT_KEYS[0], 3))
+    event.raw_metadata = b"\xff\xff"
+
+    assert isinstance(event.metadata, diem_types.Metadata__Undefined)
+    assert event.receiver_sub_address is None
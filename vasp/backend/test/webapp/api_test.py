@@ -1,6 +1,11 @@
+import csv
+import io
+import json
 from http import HTTPStatus
 from diem_utils.vasp import Vasp
+from prometheus_client import REGISTRY, generate_latest
 
+from merchant_vasp import payment_export
 from merchant_vasp.config import PAYMENT_EXPIRE_MINUTES
 from merchant_vasp.payment_service import payment_service
 from merchant_vasp.storage.models import PaymentStatusLog
@@ -302,3 +307,145 @@ def test_list_payments(client):
 
     assert payment["status"] == PaymentStatus.cleared
     assert payment["refund_requested"] == False
+
+
+def test_list_payments_pages(client):
+    rv = client.get("/payments?limit=3", headers=GOOD_AUTH)
+    assert HTTPStatus.OK == rv.status_code
+    first = rv.get_json()
+    assert len(first["payments"]) == 3
+    assert first["next_cursor"] is not None
+
+    rv = client.get(
+        f"/payments?limit=3&cursor={first['next_cursor']}", headers=GOOD_AUTH
+    )
+    second = rv.get_json()
+    assert len(second["payments"]) == 1
+    assert second["next_cursor"] is None
+
+    listed = [p["payment_id"] for p in first["payments"] + second["payments"]]
+    assert sorted(listed) == sorted(
+        [PAYMENT_ID, CLEARED_PAYMENT_ID, REJECTED_PAYMENT_ID, EXPIRED_PAYMENT_ID]
+    )
+
+
+def test_list_payments_filters(client):
+    rv = client.get("/payments?status=cleared", headers=GOOD_AUTH)
+    assert HTTPStatus.OK == rv.status_code
+    assert [p["payment_id"] for p in rv.get_json()["payments"]] == [CLEARED_PAYMENT_ID]
+
+    rv = client.get("/payments?created_from=2100-01-01T00:00:00", headers=GOOD_AUTH)
+    assert rv.get_json()["payments"] == []
+
+
+@pytest.mark.parametrize(
+    "query, error",
+    [
+        ("limit=0", "invalid_limit"),
+        ("limit=x", "invalid_limit"),
+        ("status=unknown", "invalid_status"),
+        ("cursor=not-a-cursor", "invalid_cursor"),
+        ("created_to=yesterday", "invalid_created_to"),
+    ],
+)
+def test_list_payments_bad_arguments(client, query, error):
+    rv = client.get(f"/payments?{query}", headers=GOOD_AUTH)
+    assert HTTPStatus.BAD_REQUEST == rv.status_code
+    assert rv.get_json()["error"] == error
+
+
+@pytest.fixture
+def no_export_lag(monkeypatch):
+    monkeypatch.setattr(payment_export, "PAYMENTS_EXPORT_SAFETY_LAG_SECONDS", 0)
+
+
+def test_export_payments_ndjson(client, no_export_lag):
+    rv = client.get("/payments/export", headers=GOOD_AUTH)
+    assert HTTPStatus.OK == rv.status_code
+    assert rv.mimetype == "application/x-ndjson"
+    payments = {
+        payment["payment_id"]: payment
+        for payment in map(json.loads, rv.get_data(as_text=True).splitlines())
+    }
+
+    assert len(payments) == 4
+    [tx] = payments[CLEARED_PAYMENT_ID]["chain_transactions"]
+    assert tx["tx_id"] == CLEARED_TX_ID
+    assert payments[PAYMENT_ID]["chain_transactions"] == []
+
+
+def test_export_payments_csv(client, no_export_lag):
+    rv = client.get("/payments/export?format=csv", headers=GOOD_AUTH)
+    assert HTTPStatus.OK == rv.status_code
+    rows = list(csv.DictReader(io.StringIO(rv.get_data(as_text=True))))
+
+    assert len([row for row in rows if row["record"] == "payment"]) == 4
+    [tx] = [row for row in rows if row["record"] == "chain_transaction"]
+    assert tx["payment_id"] == CLEARED_PAYMENT_ID
+    assert tx["tx_id"] == str(CLEARED_TX_ID)
+
+
+def test_export_payments_since_watermark(client, no_export_lag):
+    rv = client.get("/payments/export", headers=GOOD_AUTH)
+    watermark = rv.headers["X-Export-Watermark"]
+
+    rv = client.get(f"/payments/export?since={watermark}", headers=GOOD_AUTH)
+    assert rv.get_data(as_text=True) == ""
+
+    payment = Payment.query.get(CLEARED_PAYMENT_ID)
+    payment.set_status(PaymentStatus.refund_requested)
+    db_session.commit()
+
+    rv = client.get(f"/payments/export?since={watermark}", headers=GOOD_AUTH)
+    [exported] = map(json.loads, rv.get_data(as_text=True).splitlines())
+    assert exported["payment_id"] == CLEARED_PAYMENT_ID
+    assert exported["status_logs"][-1]["status"] == PaymentStatus.refund_requested
+
+
+def test_export_payments_since_watermark_includes_new_chain_transactions(
+    client, no_export_lag
+):
+    rv = client.get("/payments/export", headers=GOOD_AUTH)
+    watermark = rv.headers["X-Export-Watermark"]
+
+    # a refund transaction alone, the payment status stays as it is
+    Payment.query.get(CLEARED_PAYMENT_ID).add_chain_transaction(
+        sender_address=SENDER_MOCK_ADDR,
+        amount=100,
+        currency="XUS",
+        tx_id=CLEARED_TX_ID + 1,
+        is_refund=True,
+    )
+
+    rv = client.get(f"/payments/export?since={watermark}", headers=GOOD_AUTH)
+    [exported] = map(json.loads, rv.get_data(as_text=True).splitlines())
+    assert exported["payment_id"] == CLEARED_PAYMENT_ID
+    assert [tx["tx_id"] for tx in exported["chain_transactions"]] == [
+        CLEARED_TX_ID,
+        CLEARED_TX_ID + 1,
+    ]
+
+
+def test_export_payments_lags_behind_recent_updates(client):
+    rv = client.get("/payments/export", headers=GOOD_AUTH)
+
+    assert rv.get_data(as_text=True) == ""
+    watermark = datetime.fromisoformat(rv.headers["X-Export-Watermark"])
+    assert watermark < datetime.utcnow() - timedelta(seconds=60)
+
+
+def test_metrics_count_merchant_auth_cache_lookups(client):
+    client.get("/payments", headers=GOOD_AUTH)
+    client.get("/payments", headers=GOOD_AUTH)
+
+    assert 'merchant_auth_cache_lookups_total{result="hit"}' in generate_latest(
+        REGISTRY
+    ).decode("utf-8")
+    # metrics are served on the internal WEBAPP_METRICS_PORT only
+    assert HTTPStatus.NOT_FOUND == client.get("/metrics").status_code
+
+
+def test_export_payments_bad_format(client):
+    rv = client.get("/payments/export?format=xml", headers=GOOD_AUTH)
+    assert HTTPStatus.BAD_REQUEST == rv.status_code
+    assert rv.get_json()["error"] == "invalid_format"
@@ -6,11 +6,13 @@ import time
 import psycopg2
 from flask import Flask, request
 from flask.logging import default_handler
+from prometheus_client import start_http_server
 from sqlalchemy.exc import IntegrityError
 from werkzeug.middleware.proxy_fix import ProxyFix
 
-from merchant_vasp.config import DB_URL
-from merchant_vasp.storage import db_session, engine, models, Merchant
+from merchant_vasp.config import DB_URL, WEBAPP_METRICS_PORT
+from merchant_vasp.storage import db_session, engine, Merchant
+from merchant_vasp.storage.migrations import migrate
 from .routes import vasp, vasp_wallet
 
 root = logging.getLogger()
@@ -62,7 +64,7 @@ def _setup_fake_merchant():
 
 def _create_db(app: Flask) -> None:
     with app.app_context():
-        models.Base.metadata.create_all(bind=engine)
+        app.logger.info(f"Database schema at version {migrate(engine)}")
 
 
 def _create_app() -> Flask:
@@ -89,6 +91,8 @@ def init() -> Flask:
     _wait_for_postgres()
     _create_db(app)
     _setup_fake_merchant()
+    if WEBAPP_METRICS_PORT:
+        start_http_server(WEBAPP_METRICS_PORT)
     app.logger.info("App init complete!")
     return app
 
@@ -15,6 +15,12 @@ def vasp_routes():
         methods=["GET"],
     )
 
+    vasp.add_url_rule(
+        rule="/payments/export",
+        view_func=VaspRoutes.ExportPaymentsView.as_view("export_merchant_payments"),
+        methods=["GET"],
+    )
+
     vasp.add_url_rule(
         rule="/payments/<payment_id>",
         view_func=VaspRoutes.PaymentOptionsView.as_view("payment_options"),
@@ -1,13 +1,24 @@
 import os
+from datetime import datetime, timezone
 from http import HTTPStatus
 from urllib.parse import urljoin
 
 import werkzeug
-from flask import Blueprint, request, url_for, render_template
+from flask import (
+    Blueprint,
+    Response,
+    request,
+    url_for,
+    render_template,
+    stream_with_context,
+)
 
-from merchant_vasp import transaction_manager
+from merchant_vasp import payment_export, transaction_manager
+from merchant_vasp.config import PAYMENTS_PAGE_SIZE
 from merchant_vasp.payment_service import payment_service
+from merchant_vasp.storage import PaymentStatus
 from merchant_vasp.transaction_manager import (
+    InvalidListArguments,
     InvalidPaymentStatus,
     TakenMerchantReferenceId,
 )
@@ -16,6 +27,8 @@ from .strict_schema_view import (
     response_definition,
     path_uuid_param,
     body_parameter,
+    query_int_param,
+    query_str_param,
 )
 from ..schemas import (
     RefundSchema,
@@ -48,9 +61,31 @@ def invalid_args_status_handler(e):
     return {"error": e.args[0]}, HTTPStatus.BAD_REQUEST
 
 
+def _int_arg(name, default):
+    try:
+        return int(request.args.get(name, default))
+    except ValueError:
+        raise InvalidListArguments(f"invalid_{name}")
+
+
+def _datetime_arg(name):
+    value = request.args.get(name)
+    if value is None:
+        return None
+    try:
+        moment = datetime.fromisoformat(value)
+    except ValueError:
+        raise InvalidListArguments(f"invalid_{name}")
+    # payments are stored in naive UTC
+    if moment.tzinfo is not None:
+        moment = moment.astimezone(timezone.utc).replace(tzinfo=None)
+    return moment
+
+
 vasp = Blueprint("vasp", __name__)
 vasp.register_error_handler(PaymentNotFound, payment_not_found_handler)
 vasp.register_error_handler(InvalidPaymentStatus, bad_payment_status_handler)
+vasp.register_error_handler(InvalidListArguments, bad_payment_status_handler)
 vasp.register_error_handler(KeyError, invalid_args_status_handler)
 
 
@@ -171,12 +206,82 @@ class VaspRoutes:
         responses = {
             HTTPStatus.OK: response_definition(
                 "List payments successful", schema=ListPaymentsSchema
+            ),
+            HTTPStatus.BAD_REQUEST: response_definition(
+                "Invalid arguments", BadArgsSchema
+            ),
+        }
+        parameters = [
+            query_int_param("limit", "Maximum number of payments to return", False),
+            query_str_param("cursor", "next_cursor of the previous page", False),
+            query_str_param(
+                "status",
+                "Only list payments in this status",
+                False,
+                list(PaymentStatus.__members__),
+            ),
+            query_str_param(
+                "created_from",
+                "Only list payments created at or after (ISO 8601)",
+                False,
+            ),
+            query_str_param(
+                "created_to", "Only list payments created before (ISO 8601)", False
+            ),
+        ]
+
+        def get(self):
+            payments, next_cursor = transaction_manager.get_merchant_payments(
+                self.merchant,
+                limit=_int_arg("limit", PAYMENTS_PAGE_SIZE),
+                cursor=request.args.get("cursor"),
+                status=request.args.get("status"),
+                created_from=_datetime_arg("created_from"),
+                created_to=_datetime_arg("created_to"),
             )
+            return (
+                {"payments": payments, "next_cursor": next_cursor},
+                HTTPStatus.OK,
+            )
+
+    class ExportPaymentsView(MerchantVaspView):
+        summary = "Stream the merchant payments with status logs and chain transactions"
+        responses = {
+            HTTPStatus.OK: response_definition(
+                "Export stream, X-Export-Watermark is the since of the next export"
+            ),
+            HTTPStatus.BAD_REQUEST: response_definition(
+                "Invalid arguments", BadArgsSchema
+            ),
         }
+        parameters = [
+            query_str_param(
+                "format", "Export format", False, list(payment_export.FORMATS)
+            ),
+            query_str_param(
+                "since",
+                "Only export payments updated after this watermark (ISO 8601)",
+                False,
+            ),
+        ]
 
         def get(self):
+            export_format = request.args.get("format", "ndjson")
+            if export_format not in payment_export.FORMATS:
+                raise InvalidListArguments("invalid_format")
+            since = _datetime_arg("since")
+            until = payment_export.watermark()
+
+            encode, mimetype = payment_export.FORMATS[export_format]
+            payments = payment_export.export_payments(
+                self.merchant.id, until, since=since
+            )
             return (
-                {"payments": transaction_manager.get_merchant_payments(self.merchant)},
+                Response(
+                    stream_with_context(encode(payments)),
+                    mimetype=mimetype,
+                    headers={"X-Export-Watermark": until.isoformat()},
+                ),
                 HTTPStatus.OK,
             )
 
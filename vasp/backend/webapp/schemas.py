@@ -95,6 +95,7 @@ class _PaymentItem(Schema):
 
 class ListPaymentsSchema(Schema):
     payments = fields.List(fields.Nested(_PaymentItem), required=True)
+    next_cursor = fields.Str(required=True, allow_none=True)
 
 
 class _PaymentLogSingleEvent(Schema):